@@ -27,8 +27,38 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import bisect
+import mmap
+import struct
+from array import array
+from collections import OrderedDict
 from elftools.elf.segments import LoadSegment
-from elftools.construct import Struct
+
+#struct format code(signed) for each integer size
+INT_FORMAT_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+PAGE_SIZE = 4096
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+try:
+    _buffer = buffer
+except NameError:
+    _buffer = None
+
+#Type of the slices returned by as_slice()
+SLICE_TYPE = memoryview if _buffer == None else _buffer
+
+def as_slice(data, offset=0, size=None):
+    """ Returns read only zero copy slice of data(str, bytearray, mmap or
+        an earlier slice). Every AddressSpace.read() returns this type -
+        buffer on Python 2(its mmap has no new buffer protocol), memoryview
+        otherwise.
+    """
+    if size == None:
+        size = len(data) - offset
+    if _buffer != None:
+        return _buffer(data, offset, size)
+    return memoryview(data)[offset:offset + size]
 
 """ AddressSpace - Represents address space of an application/coredump
     Only read operation is supported
@@ -44,6 +74,7 @@ class AddressSpace:
         for segment in core_file.iter_segments():
             if isinstance(segment, LoadSegment):
                 self.load_segments.append(segment)
+        self._compile_int_structs(core_file)
 
     def read(self, address, size):
         """Returns one or more bytes(size) at the given address
@@ -53,45 +84,319 @@ class AddressSpace:
             if address >= seg.va_start and address <= seg.va_end:
                 offset = seg.file_offset + address - seg.va_start
                 self.core_file.stream.seek(offset, 0)
-                return self.core_file.stream.read(size)
+                return as_slice(self.core_file.stream.read(size))
+        return None
+
+    def get_mapping(self, address):
+        """Returns (start, end) of the mapping containing the address or None
+        """
+        for seg in self.load_segments:
+            start = seg['p_vaddr']
+            if address >= start and address < start + seg['p_memsz']:
+                return start, start + seg['p_memsz']
         return None
 
-    def read_int(self, address, size):
-        """Wrapper function for read_intXX()
+    def _compile_int_structs(self, elf_file):
+        """Create struct.Struct for every integer size once per core.
+           Endianness and word size are taken from the ELF header of the core.
+        """
+        self.byte_order = '<' if elf_file.little_endian else '>'
+        self.word_size = elf_file.elfclass // 8
+        self._int_structs = dict()
+        for size, code in INT_FORMAT_CODES.items():
+            self._int_structs[(size, False)] = \
+                struct.Struct(self.byte_order + code.upper())
+            self._int_structs[(size, True)] = \
+                struct.Struct(self.byte_order + code)
+
+    def _read_checked(self, address, size):
+        """Same as read() but raises ValueError if the address is not mapped
+        """
+        data = self.read(address, size)
+        if data == None or len(data) != size:
+            raise ValueError('Address {0:#x} is not mapped'.format(address))
+        return data
+
+    def read_int(self, address, size, signed=False):
+        """Returns integer of the given size(1, 2, 4 or 8) at the given address
+        """
+        int_struct = self._int_structs.get((size, signed))
+        if int_struct == None:
+            raise ValueError
+        return int_struct.unpack_from(self._read_checked(address, size))[0]
+
+    def read_ints(self, address, count, size, signed=False):
+        """Returns tuple of count integers of the given size starting from
+           the given address. The memory is read only once.
         """
-        if size == 8:
-            return self.read_int64(address)
-        elif size == 4:
-            return self.read_int32(address)
-        elif size == 2:
-            return self.read_int16(address)
-        elif size == 1:
-            return self.read_int8(address)
+        code = INT_FORMAT_CODES.get(size)
+        if code == None:
+            raise ValueError
+        if not signed:
+            code = code.upper()
+        data = self._read_checked(address, count * size)
+        return struct.unpack_from('{0}{1}{2}'.format(self.byte_order, count,
+                                                     code), data)
 
-        raise ValueError
+    def read_word(self, address, signed=False):
+        """Returns pointer sized integer at the given address
+        """
+        return self.read_int(address, self.word_size, signed)
 
-    def read_int64(self, address):
+    def read_int64(self, address, signed=False):
         """Returns 64bit at the given address
         """
-        int64 = Struct("int", self.core_file.structs.Elf_word64("value"))
-        return int64.parse(self.read(address, int64.sizeof())).value
+        return self.read_int(address, 8, signed)
 
-    def read_int32(self, address):
+    def read_int32(self, address, signed=False):
         """Returns 32bit at the given address
         """
-        int32 = Struct("int", self.core_file.structs.Elf_word("value"))
-        return int32.parse(self.read(address, int32.sizeof())).value
+        return self.read_int(address, 4, signed)
 
-    def read_int16(self, address):
+    def read_int16(self, address, signed=False):
         """Returns 16bit at the given address
         """
-        int16 = Struct("int", self.core_file.structs.Elf_half("value"))
-        return int16.parse(self.read(address, int16.sizeof())).value
+        return self.read_int(address, 2, signed)
 
-    def read_int8(self, address):
+    def read_int8(self, address, signed=False):
         """Returns 8bit at the given address
         """
-        int8 = Struct("int", self.core_file.structs.Elf_byte("value"))
-        return int8.parse(self.read(address, int8.sizeof())).value
+        return self.read_int(address, 1, signed)
+
+class MmapAddressSpace(AddressSpace):
+    """ Address space backed by a read only memory map of the whole core file.
+        Segments are kept sorted by start address so that an address can be
+        located by binary search and the data is returned as slices of the
+        map(as_slice) - no seek()/read() and no copy.
+    """
+    def __init__(self, core_file):
+        AddressSpace.__init__(self, core_file)
+        self._map = mmap.mmap(core_file.stream.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+        self.load_segments.sort(key=lambda seg: seg['p_vaddr'])
+        count = len(self.load_segments)
+        self._starts = array('L', [0] * count)
+        self._ends = array('L', [0] * count)
+        self._file_offsets = array('L', [0] * count)
+        self._file_sizes = array('L', [0] * count)
+        for index, seg in enumerate(self.load_segments):
+            self._starts[index] = seg['p_vaddr']
+            self._ends[index] = seg['p_vaddr'] + seg['p_memsz']
+            self._file_offsets[index] = seg['p_offset']
+            self._file_sizes[index] = seg['p_filesz']
+
+    def _find_segment(self, address):
+        """ Returns index of the segment containing the address or -1
+        """
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index >= 0 and address < self._ends[index]:
+            return index
+        return -1
 
+    def get_mapping(self, address):
+        """Returns (start, end) of the mapping containing the address or None
+        """
+        index = self._find_segment(address)
+        if index < 0:
+            return None
+        return self._starts[index], self._ends[index]
+
+    def _slice(self, offset, size):
+        """ Returns zero copy slice of the core file
+        """
+        return as_slice(self._map, offset, size)
 
+    def _read_segment(self, index, address, size):
+        """ Returns slice of the part of the segment[index] starting at
+            address. The size is trimmed to the end of the segment.
+            Pages which are not backed by the file(filesz < memsz) are
+            returned as zeros.
+        """
+        seg_offset = address - self._starts[index]
+        size = min(size, self._ends[index] - address)
+        file_size = self._file_sizes[index]
+        if seg_offset + size <= file_size:
+            offset = self._file_offsets[index] + seg_offset
+            return self._slice(offset, size)
+
+        #Read crosses in to(or starts from) the unbacked part of the segment
+        backed = max(file_size - seg_offset, 0)
+        data = bytearray(size)
+        if backed:
+            offset = self._file_offsets[index] + seg_offset
+            data[0:backed] = self._slice(offset, backed)
+        return as_slice(data)
+
+    def read(self, address, size):
+        """Returns size bytes at the given address without copying
+           Returns None if any part of the range is not mapped in the core
+        """
+        index = self._find_segment(address)
+        if index < 0:
+            return None
+
+        chunk = self._read_segment(index, address, size)
+        if len(chunk) == size:
+            return chunk
+
+        #The read spans multiple segments - stitch them together
+        data = bytearray(size)
+        filled = 0
+        while True:
+            data[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+            if filled == size:
+                return as_slice(data)
+            index += 1
+            if index >= len(self._starts) or \
+               self._starts[index] != address + filled:
+                return None
+            chunk = self._read_segment(index, address + filled, size - filled)
+
+class ProcessAddressSpace(AddressSpace):
+    """ Address space of a live process read through /proc/<pid>/mem
+        Every read is a system call, so it should be used behind
+        CachedAddressSpace. Endianness and word size are taken from the
+        symbol file.
+    """
+    def __init__(self, pid, sym_file):
+        self.pid = pid
+        self.core_file = None
+        self.load_segments = list()
+        self._compile_int_structs(sym_file)
+        self._mem = open('/proc/{0}/mem'.format(pid), 'rb', 0)
+
+    def read(self, address, size):
+        """Returns size bytes at the given address
+           Returns None if the range is not mapped in the process
+        """
+        try:
+            self._mem.seek(address, 0)
+            data = self._mem.read(size)
+        except (IOError, OverflowError, ValueError):
+            return None
+        if len(data) != size:
+            return None
+        return as_slice(data)
+
+    def get_mapping(self, address):
+        """Returns (start, end) of the mapping containing the address or None
+           The mappings of a live process can change, so they are read every
+           time.
+        """
+        with open('/proc/{0}/maps'.format(self.pid), 'r') as maps:
+            for line in maps:
+                start, end = [int(value, 16)
+                              for value in line.split(' ', 1)[0].split('-')]
+                if address >= start and address < end:
+                    return start, end
+        return None
+
+class CachedAddressSpace(AddressSpace):
+    """ Page granular LRU cache which can sit in front of any address space.
+        Pages are read from the backend on first access and kept until the
+        byte budget is exceeded; then the least recently used page is evicted.
+        A page which is only partly mapped(end of a segment) is cached with
+        the offset of its mapped part.
+        Backends of live processes must call invalidate() whenever the target
+        runs, since the cached pages could be stale after that.
+    """
+    def __init__(self, backend, cache_size=DEFAULT_CACHE_SIZE,
+                 page_size=PAGE_SIZE):
+        self.backend = backend
+        self.cache_size = cache_size
+        self.page_size = page_size
+        self.byte_order = backend.byte_order
+        self.word_size = backend.word_size
+        self._int_structs = backend._int_structs
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        """ Everything other than read is served by the backend
+        """
+        return getattr(self.backend, name)
+
+    def get_mapping(self, address):
+        return self.backend.get_mapping(address)
+
+    def _get_page(self, page_address, address):
+        """ Returns (offset, data) of the page from cache or reads it from
+            the backend. data is the mapped part of the page starting at
+            offset and is found using the mapping of address.
+            Returns None if the address is not mapped
+        """
+        page = self._pages.pop(page_address, None)
+        if page != None:
+            self.hits += 1
+            self._pages[page_address] = page
+            return page
+
+        self.misses += 1
+        data = self.backend.read(page_address, self.page_size)
+        offset = 0
+        if data == None or len(data) != self.page_size:
+            mapping = self.backend.get_mapping(address)
+            if mapping == None:
+                return None
+            start = max(mapping[0], page_address)
+            end = min(mapping[1], page_address + self.page_size)
+            data = self.backend.read(start, end - start)
+            if data == None or len(data) != end - start:
+                return None
+            offset = start - page_address
+        page = (offset, str(bytearray(data)))
+        self._pages[page_address] = page
+        while len(self._pages) * self.page_size > self.cache_size:
+            self._pages.popitem(last=False)
+            self.evictions += 1
+        return page
+
+    def read(self, address, size):
+        """Returns size bytes at the given address
+        """
+        page_mask = self.page_size - 1
+        chunks = list()
+        current = address
+        end = address + size
+        while current < end:
+            page_address = current & ~page_mask
+            page = self._get_page(page_address, current)
+            if page == None:
+                return None
+            page_offset, data = page
+            offset = current - page_address
+            length = min(end - current, self.page_size - offset)
+            offset -= page_offset
+            if offset < 0 or offset + length > len(data):
+                #Outside the mapped part(another mapping in the same page)
+                return self.backend.read(address, size)
+            if len(chunks) == 0 and length == size:
+                return as_slice(data, offset, length)
+            chunks.append(data[offset:offset + length])
+            current += length
+
+        return as_slice(''.join(chunks))
+
+    def invalidate(self, address=None, size=None):
+        """Drop cached pages of the given range or all pages if no range given
+        """
+        if address == None:
+            self._pages.clear()
+            return
+
+        page_mask = self.page_size - 1
+        page_address = address & ~page_mask
+        while page_address < address + size:
+            self._pages.pop(page_address, None)
+            page_address += self.page_size
+
+    def get_stats(self):
+        """Returns cache hit/miss/eviction counters
+        """
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, pages=len(self._pages),
+                    bytes=len(self._pages) * self.page_size)
@@ -31,15 +31,31 @@ import debugger
 import shared
 import logging
 import sys
+from index_cache import DEFAULT_CACHE_DIR
 from disassemble import Disassemble
 from elftools.elf.segments import LoadSegment
 from elftools.elf.note import NoteSegment
 from data_structures import get_pydie
+from symbolize import (iter_symbolize, format_symbolization,
+                       DEFAULT_BATCH_SIZE)
 from register_map import RegisterMap
+from frames import STOP_OUTERMOST
 
 BACKTRACE_FORMAT =  '#{index:<2d} {ip:#018x} '\
                         'in {function} ({parameters}) '\
                         'at {filename}:{line}\n'
+INLINE_FRAME_FORMAT =  '#{index:<2d} {ip:#018x} '\
+                        'in {function} [inlined] '\
+                        'at {filename}:{line}\n'
+THREAD_HEADER_FORMAT = '\nThread {index} ({thread}):\n'
+THREAD_BACKTRACE_FORMAT =  '#{index:<2d} {ip:#018x} '\
+                        'in {function} '\
+                        'at {filename}:{line}\n'
+LOCAL_FORMAT = '        {local.name} = {local.value}\n'
+#Printed in place of the arguments by backtrace --no-args
+NO_ARGS_PARAMETERS = '...'
+STOP_REASON_FORMAT = 'Backtrace stopped: {reason}\n'
+UNIQUE_STACK_FORMAT = '\n{count} thread(s): {threads}\n'
 LIST_LINE_FORMAT = '{line_no:4} {symbol:2} {line}'
 
 CONTEXT_LINE_COUNT = 20
@@ -100,6 +116,13 @@ def command_whatis(args):
 
     return result
 
+def _format_frame_info(frame):
+    """ Short description of a FrameInfo, same as str() of a Frame
+    """
+    if frame.ip and frame.offset != None:
+        return '{0}+{1:#x}'.format(frame.function, frame.offset)
+    return 'ip:{0:#x} sp:{1:#x}'.format(frame.ip, frame.sp)
+
 @lexer(None)
 def command_info_thread(args):
     """ Returns all the threads in the process
@@ -107,15 +130,37 @@ def command_info_thread(args):
     threads = debugger.get_threads()
     result =    'Total thread contexts : {0}\n'\
                 '  Id   Target Id         Frame\n'.format(len(threads))
-    for index, thread in enumerate(threads):
-        frames = thread.get_frames()
+    #Only the top frame is shown - do not unwind the stacks
+    for backtrace in debugger.iter_thread_backtraces(max_frames=1):
         frame = None
-        if frames:
-            frame = frames[0]
-            frame.populate()
+        if backtrace.frames:
+            frame = _format_frame_info(backtrace.frames[0])
+        index = backtrace.index
         result += '{active} {index:<4} {thread:<16}  {frame}\n'.format(
                     active='*' if index == shared.current_thread_index else ' ',
-                    index=index, thread=thread, frame=frame)
+                    index=index, thread=backtrace.thread_id, frame=frame)
+    return result
+
+@lexer(None)
+def command_info_stacks(args):
+    """ Returns unique stacks of the process with count of threads
+    """
+    result = ''
+    for stack in debugger.get_unique_stacks():
+        result += UNIQUE_STACK_FORMAT.format(count=len(stack.thread_ids),
+                        threads=', '.join(str(t) for t in stack.thread_ids))
+        for index, frame in enumerate(stack.frames):
+            for inline_frame in frame.inlined:
+                result += INLINE_FRAME_FORMAT.format(index=index,
+                                        ip=frame.address,
+                                        function=inline_frame.function,
+                                        filename=inline_frame.filename,
+                                        line=inline_frame.line)
+            result += THREAD_BACKTRACE_FORMAT.format(index=index,
+                                        ip=frame.address,
+                                        function=frame.function,
+                                        filename=frame.call_file,
+                                        line=frame.call_line)
     return result
 
 @lexer(None)
@@ -165,6 +210,20 @@ def command_info_core(args):
                     note_seg += '{0}\n'.format(note) 
     return note_seg + load_seg
 
+@lexer(None)
+def command_info_cache(args):
+    """ Returns memory page cache statistics
+    """
+    aspace = shared.address_space
+    if aspace == None or not hasattr(aspace, 'get_stats'):
+        logging.warning('Memory page cache is not enabled')
+        return
+
+    stats = aspace.get_stats()
+    return '\n'.join('{0:10} {1}'.format(name, stats[name])
+                     for name in ['hits', 'misses', 'evictions', 'pages',
+                                  'bytes'])
+
 @lexer(None)
 def command_info_frame(args):
     """ Returns information about the frame
@@ -195,28 +254,96 @@ def command_info_registers(args):
 @lexer(None)
 def command_backtrace(args):
     """ Returns stack trace for current thread
+        Returns a generator so that each frame is written as soon as it is
+        unwound.
     """
+    if args.all_threads:
+        return _all_threads_backtrace(args)
+
     thread = debugger.get_thread(shared.current_thread_index)
     if thread is None:
         logging.error('Invalid thread {0}'.format(shared.current_thread_index))
         return
 
-    frames = thread.get_frames()
-    if len(frames) == 0:
-        logging.warn('No frame to display')
+    return _thread_backtrace(thread.get_frames(), args)
 
-    btf = BACKTRACE_FORMAT
-    result = ''
-    for index, frame in enumerate(frames):
+def _thread_backtrace(frames, args):
+    """ Yields backtrace of a thread line by line
+        Each frame is printed as soon as it is unwound. The stack pages read
+        for the variables of a frame are kept for the following frames.
+    """
+    count = 0
+    address_space = None
+    for frame in frames.iter_frames():
+        if args.count != None and count >= args.count:
+            yield '(More stack frames follow...)\n'
+            return
         frame.populate()
-        args = debugger.get_frame_args(frame)
-        args_str = ', '.join('{arg.name} = {arg.value}'\
-                    .format(arg=arg) for arg in args) if args else ''
-        result += btf.format(index=index, ip=frame.ip, sp=frame.sp,
-                             filename=frame.filename, line=frame.line,
-                             function=frame.function, offset=frame.offset,
-                             parameters=args_str)
-    return result
+        if args.full or not args.no_args:
+            address_space = debugger.plan_frame_reads([frame], args.full,
+                                                      not args.no_args,
+                                                      address_space)
+        for line in _format_frame(frame, count, args, address_space):
+            yield line
+        count += 1
+
+    if count == 0:
+        logging.warn('No frame to display')
+    elif _is_abnormal_stop(frames.stop_reason):
+        yield STOP_REASON_FORMAT.format(reason=frames.stop_reason)
+
+def _format_frame(frame, index, args, address_space=None):
+    """ Yields backtrace lines of a populated frame
+        Arguments are decoded once when the line is formatted and not at all
+        with --no-args. The arguments and locals(--full) are read from the
+        given address space(see debugger.plan_frame_reads()).
+    """
+    for inline_frame in frame.inline_frames:
+        yield INLINE_FRAME_FORMAT.format(index=index, ip=frame.ip,
+                                    function=inline_frame.function,
+                                    filename=inline_frame.filename,
+                                    line=inline_frame.line)
+    if args.no_args:
+        parameters = NO_ARGS_PARAMETERS
+    else:
+        parameters = frame.get_arguments(address_space)
+    yield BACKTRACE_FORMAT.format(index=index, ip=frame.ip, sp=frame.sp,
+                         filename=frame.filename, line=frame.line,
+                         function=frame.function, offset=frame.offset,
+                         parameters=parameters)
+    if args.full:
+        for local in debugger.get_frame_locals(frame, address_space) or []:
+            yield LOCAL_FORMAT.format(local=local)
+
+def _is_abnormal_stop(reason):
+    """ Whether the unwinder stopped before reaching the outermost frame
+    """
+    return reason != None and reason != STOP_OUTERMOST
+
+def _all_threads_backtrace(args):
+    """ Yields stack trace of all the threads(thread apply all backtrace)
+    """
+    for backtrace in debugger.iter_thread_backtraces():
+        result = THREAD_HEADER_FORMAT.format(index=backtrace.index,
+                                             thread=backtrace.thread_id)
+        for index, frame in enumerate(backtrace.frames):
+            if args.count != None and index >= args.count:
+                result += '(More stack frames follow...)\n'
+                break
+            for inline_frame in frame.inline_frames:
+                result += INLINE_FRAME_FORMAT.format(index=index, ip=frame.ip,
+                                            function=inline_frame.function,
+                                            filename=inline_frame.filename,
+                                            line=inline_frame.line)
+            result += THREAD_BACKTRACE_FORMAT.format(index=index, ip=frame.ip,
+                                            function=frame.function,
+                                            filename=frame.filename,
+                                            line=frame.line)
+        else:
+            if _is_abnormal_stop(backtrace.stop_reason):
+                result += STOP_REASON_FORMAT.format(
+                                            reason=backtrace.stop_reason)
+        yield result
 
 @lexer(LEXER_NAME_C)
 def command_list(args):
@@ -299,6 +426,19 @@ def command_examine(args):
 
     return result
 
+@lexer(None)
+def command_symbolize(args):
+    """Symbolize addresses read from a file or stdin - one per line
+       Returns a generator so that output is written as batches complete
+    """
+    stream = open(args.file, 'r') if args.file else sys.stdin
+    def generate():
+        for result in iter_symbolize(stream, args.batch_size):
+            yield format_symbolization(result)
+        if stream != sys.stdin:
+            stream.close()
+    return generate()
+
 @lexer(None)
 def command_thread(args):
     """Selects the current thread
@@ -330,6 +470,24 @@ def create_commandline_parser():
                         help='Land in interactive command prompt')
 
     parser.add_argument('-v', '--verbose', action='count', default=0)
+    parser.add_argument('-cs', '--cache-size', type=int, default=None,
+                        help='Memory page cache size in MB(0 to disable, '\
+                             'default 64 for live processes and 0 for '\
+                             'core files)')
+    parser.add_argument('-ic', '--index-cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory to cache symbol and debug indexes')
+    parser.add_argument('-nic', '--no-index-cache', action='store_true',
+                        default=False,
+                        help='Do not use the on-disk index cache')
+    parser.add_argument('-md', '--max-depth', type=int,
+                        default=shared.max_frame_depth,
+                        help='Maximum number of frames unwound per thread')
+    parser.add_argument('-ut', '--unwind-timeout', type=float, default=0,
+                        help='Seconds allowed to unwind a thread(0 for '\
+                             'no limit)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to build indexes '\
+                             'and unwind threads')
 
     #disassemble
     subparsers = parser.add_subparsers()
@@ -363,6 +521,10 @@ def create_commandline_parser():
     pa_info_thread = info_subpa.add_parser('threads', help='List all threads')
     pa_info_thread.set_defaults(func=command_info_thread)
 
+    pa_info_stacks = info_subpa.add_parser('stacks', help='Unique stacks '\
+                                           'of all threads with thread count')
+    pa_info_stacks.set_defaults(func=command_info_stacks)
+
     pa_info_locals = info_subpa.add_parser('locals', help='Print local'\
                                                           'variables')
     pa_info_locals.set_defaults(func=command_info_locals)
@@ -381,9 +543,23 @@ def create_commandline_parser():
     pa_info_core = info_subpa.add_parser('core', help='Info about core file')
     pa_info_core.set_defaults(func=command_info_core)
 
+    pa_info_cache = info_subpa.add_parser('cache',
+                                          help='Memory page cache statistics')
+    pa_info_cache.set_defaults(func=command_info_cache)
+
     #Backtrace
     pa_bt = subparsers.add_parser('backtrace', help='Print backtrace of '\
                                                      'current thread')
+    pa_bt.add_argument('-n', '--count', type=int,
+                       help='Print only the innermost N frames')
+    pa_bt.add_argument('-f', '--full', action='store_true', default=False,
+                       help='Print local variables of each frame')
+    pa_bt.add_argument('-na', '--no-args', action='store_true',
+                       default=False,
+                       help='Do not decode the arguments of the frames')
+    pa_bt.add_argument('-a', '--all-threads', action='store_true',
+                       default=False,
+                       help='Backtrace of all threads(unwound in parallel)')
     pa_bt.set_defaults(func=command_backtrace)
 
     #list
@@ -403,6 +579,15 @@ def create_commandline_parser():
                       help='Unit size')
     pa_x.set_defaults(func=command_examine)
 
+    #symbolize
+    pa_sym = subparsers.add_parser('symbolize', help='Symbolize addresses '\
+                                   'read from file or stdin(one per line)')
+    pa_sym.add_argument('-f', '--file', help='File with addresses(hex)')
+    pa_sym.add_argument('-b', '--batch-size', type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help='Addresses resolved per batch')
+    pa_sym.set_defaults(func=command_symbolize)
+
     return parser
 
 
@@ -0,0 +1,272 @@
+"""
+core_notes.py:
+    Index of the notes in a core file, built in a single pass over the
+    PT_NOTE segments. Per thread notes(PRSTATUS, PRFPREG, XSTATE) are
+    grouped by thread and process wide notes(PRPSINFO, AUXV, FILE, SIGINFO)
+    are recorded once. Only the note headers are parsed here; register sets
+    are decoded when a thread is actually used, with the prstatus layout and
+    word size of the ELF class and machine of the core(x86-64 and i386).
+
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+NT_PRSTATUS = 1
+NT_PRFPREG = 2
+NT_PRPSINFO = 3
+NT_AUXV = 6
+NT_X86_XSTATE = 0x202
+NT_SIGINFO = 0x53494749
+NT_FILE = 0x46494c45
+
+AT_NULL = 0
+AT_ENTRY = 9
+
+""" Layout of elf_prstatus
+    pid_offset     - offset of pr_pid
+    reg_offset     - offset of pr_reg
+    registers      - names of the registers in elf_gregset_t order
+    register_index - register name to its position in registers
+"""
+PrstatusLayout = namedtuple('PrstatusLayout', ['pid_offset', 'reg_offset',
+                                               'registers', 'register_index'])
+
+def _create_layout(pid_offset, reg_offset, registers):
+    return PrstatusLayout(pid_offset, reg_offset, registers,
+                          dict((name, index) for index, name in
+                               enumerate(registers)))
+
+""" elf_prstatus layout by (ELF class, e_machine) of the core
+    Registers are in struct user_regs_struct order.
+"""
+PRSTATUS_LAYOUTS = {
+    (64, 'EM_X86_64'): _create_layout(32, 112,
+                        ('r15', 'r14', 'r13', 'r12', 'rbp', 'rbx', 'r11',
+                         'r10', 'r9', 'r8', 'rax', 'rcx', 'rdx', 'rsi', 'rdi',
+                         'orig_rax', 'rip', 'cs', 'rflags', 'rsp', 'ss',
+                         'fs_base', 'gs_base', 'ds', 'es', 'fs', 'gs')),
+    (32, 'EM_386'): _create_layout(24, 72,
+                        ('ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'eax',
+                         'ds', 'es', 'fs', 'gs', 'orig_eax', 'eip', 'cs',
+                         'eflags', 'esp', 'ss')),
+}
+
+#struct code of a word(long) by ELF class
+WORD_CODES = {32: 'I', 64: 'Q'}
+
+""" A note in the core
+    data   - contents of the note segment containing the note
+    offset - offset of the note's desc in data
+    size   - size of the desc
+"""
+Note = namedtuple('Note', ['n_type', 'name', 'data', 'offset', 'size'])
+
+FileMapping = namedtuple('FileMapping', ['start', 'end', 'file_offset',
+                                         'file_name'])
+
+class RegisterView():
+    """ General purpose registers of a thread as attributes(rip, rsp...)
+        A row of the register table of all threads - nothing is copied.
+    """
+    def __init__(self, table, row, layout):
+        self.table = table
+        self.layout = layout
+        self.names = layout.registers
+        self.base = row * len(layout.registers)
+
+    def values(self):
+        """ Register values in the order of names
+        """
+        return self.table[self.base:self.base + len(self.names)]
+
+    def __getattr__(self, name):
+        index = self.layout.register_index.get(name)
+        if index == None:
+            raise AttributeError(name)
+        return self.table[self.base + index]
+
+class ThreadNotes():
+    """ Notes of one thread
+    """
+    def __init__(self, prstatus):
+        self.prstatus = prstatus
+        self.fpregset = None
+        self.xstate = None
+
+def _align4(size):
+    return (size + 3) & ~3
+
+def _get_array_typecode(size):
+    """ Returns array typecode whose items are of the given size, or None
+        if there is no such(8 bytes on 32 bit Python 2)
+    """
+    for typecode in 'IL':
+        if array(typecode).itemsize == size:
+            return typecode
+    return None
+
+class CoreNotes():
+    """ Notes of a core file
+        threads - ThreadNotes of each thread in the order of the core
+    """
+    def __init__(self, core_file):
+        self.byte_order = '<' if core_file.little_endian else '>'
+        self.word_code = WORD_CODES.get(core_file.elfclass)
+        self.word_size = core_file.elfclass // 8
+        machine = core_file.header['e_machine']
+        self.layout = PRSTATUS_LAYOUTS.get((core_file.elfclass, machine))
+        self.threads = list()
+        self.prpsinfo = None
+        self.auxv = None
+        self.file = None
+        self.siginfo = None
+        self.other_notes = list()
+        self._register_table = None
+        if self.layout == None:
+            logging.error('{0} bit {1} cores are not supported'\
+                          .format(core_file.elfclass, machine))
+            return
+        for segment in core_file.iter_segments():
+            if segment['p_type'] == 'PT_NOTE':
+                self._index_segment(segment.data())
+
+    def _index_segment(self, data):
+        """ Walk the note headers of a note segment once
+        """
+        byte_order = self.byte_order
+        offset = 0
+        while offset + 12 <= len(data):
+            namesz, descsz, n_type = struct.unpack_from(byte_order + 'III',
+                                                        data, offset)
+            offset += 12
+            name = data[offset:offset + namesz].rstrip('\0')
+            offset += _align4(namesz)
+            note = Note(n_type, name, data, offset, descsz)
+            offset += _align4(descsz)
+
+            if n_type == NT_PRSTATUS:
+                self.threads.append(ThreadNotes(note))
+            elif n_type == NT_PRFPREG and self.threads:
+                self.threads[-1].fpregset = note
+            elif n_type == NT_X86_XSTATE and self.threads:
+                self.threads[-1].xstate = note
+            elif n_type == NT_PRPSINFO and self.prpsinfo == None:
+                self.prpsinfo = note
+            elif n_type == NT_AUXV and self.auxv == None:
+                self.auxv = note
+            elif n_type == NT_FILE and self.file == None:
+                self.file = note
+            elif n_type == NT_SIGINFO and self.siginfo == None:
+                self.siginfo = note
+            else:
+                self.other_notes.append(note)
+
+    def get_desc(self, note):
+        """ Returns contents of the note
+        """
+        return note.data[note.offset:note.offset + note.size]
+
+    def _gather(self, field_offset, count, code):
+        """ Returns array of a field of the NT_PRSTATUS of all threads
+            The field is count items of the struct code. The fields are
+            joined and converted in one go.
+        """
+        size = count * struct.calcsize(code)
+        data = ''.join([note.data[note.offset + field_offset:
+                                  note.offset + field_offset + size]
+                        for note in [thread.prstatus
+                                     for thread in self.threads]])
+        typecode = _get_array_typecode(struct.calcsize(code))
+        if typecode == None:
+            return list(struct.unpack(self.byte_order + str(len(data) //
+                                      struct.calcsize(code)) + code, data))
+        table = array(typecode.lower() if code.islower() else typecode)
+        table.fromstring(data)
+        if (self.byte_order == '<') != (sys.byteorder == 'little'):
+            table.byteswap()
+        return table
+
+    def get_thread_ids(self):
+        """ Returns pr_pid of all threads
+        """
+        if self.layout == None:
+            return list()
+        return self._gather(self.layout.pid_offset, 1, 'i')
+
+    def get_register_table(self):
+        """ Returns general purpose registers of all threads as one
+            threads x registers array(row major)
+        """
+        if self._register_table == None:
+            self._register_table = self._gather(self.layout.reg_offset,
+                                                len(self.layout.registers),
+                                                self.word_code)
+        return self._register_table
+
+    def get_registers(self, thread_index):
+        """ Returns RegisterView of the given thread
+        """
+        return RegisterView(self.get_register_table(), thread_index,
+                            self.layout)
+
+    def get_auxv(self):
+        """ Returns auxiliary vector as dict of a_type:a_val
+        """
+        auxv = dict()
+        if self.auxv == None:
+            return auxv
+        values = struct.unpack_from(self.byte_order +
+                                    str(self.auxv.size // self.word_size) +
+                                    self.word_code, self.auxv.data,
+                                    self.auxv.offset)
+        for i in range(0, len(values) - 1, 2):
+            if values[i] == AT_NULL:
+                break
+            auxv[values[i]] = values[i + 1]
+        return auxv
+
+    def get_file_mappings(self):
+        """ Returns FileMapping list decoded from NT_FILE
+        """
+        if self.file == None:
+            return list()
+        desc = self.get_desc(self.file)
+        word_size = self.word_size
+        count, page_size = struct.unpack_from(self.byte_order +
+                                              self.word_code * 2, desc, 0)
+        entries = struct.unpack_from(self.byte_order + str(count * 3) +
+                                     self.word_code, desc, word_size * 2)
+        names = desc[word_size * 2 + count * word_size * 3:].split('\0')
+        if len(names) < count:
+            logging.warning('Truncated NT_FILE note')
+            return list()
+        return [FileMapping(entries[i * 3], entries[i * 3 + 1],
+                            entries[i * 3 + 2] * page_size, names[i])
+                for i in range(count)]
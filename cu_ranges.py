@@ -0,0 +1,148 @@
+"""
+cu_ranges.py:
+    Address range to compilation unit index built from .debug_aranges
+    (or the CU DW_AT_ranges/DW_AT_low_pc/DW_AT_high_pc when there is no
+    .debug_aranges entry for a CU).
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+import logging
+import struct
+from array import array
+from name_index import get_compile_unit, get_cu_offsets, get_die_ranges
+import shared
+
+_ADDRESS_FORMATS = {4: 'I', 8: 'Q'}
+
+def parse_aranges(data, byte_order):
+    """Returns list of (start, end, CU offset) from .debug_aranges data
+    """
+    result = list()
+    offset = 0
+    while offset < len(data):
+        set_start = offset
+        length = struct.unpack_from(byte_order + 'I', data, offset)[0]
+        offset += 4
+        offset_format = 'I'
+        if length == 0xffffffff:
+            length = struct.unpack_from(byte_order + 'Q', data, offset)[0]
+            offset += 8
+            offset_format = 'Q'
+        end = offset + length
+        version, cu_offset, address_size, segment_size = \
+            struct.unpack_from(byte_order + 'H' + offset_format + 'BB',
+                               data, offset)
+        offset += 2 + struct.calcsize(offset_format) + 2
+        #tuples start at a multiple of the tuple size from the set start
+        tuple_size = 2 * address_size
+        offset = set_start + ((offset - set_start + tuple_size - 1) //
+                              tuple_size) * tuple_size
+        tuple_format = byte_order + 2 * _ADDRESS_FORMATS[address_size]
+        while offset + tuple_size <= end:
+            address, size = struct.unpack_from(tuple_format, data, offset)
+            offset += tuple_size
+            if address == 0 and size == 0:
+                break
+            if size:
+                result.append((address, address + size, cu_offset))
+        offset = end
+    return result
+
+class CURangeIndex():
+    """Sorted address ranges of all the compilation units
+       Lookup is a binary search over the range start addresses.
+    """
+    CACHE_NAME = 'cu_ranges'
+    CACHE_VERSION = 1
+
+    def __init__(self, elf_file, index_cache=None):
+        self.elf_file = elf_file
+        columns = None
+        if index_cache:
+            columns = index_cache.load(self.CACHE_NAME, self.CACHE_VERSION)
+        if not columns:
+            columns = self._build_columns(elf_file)
+            if index_cache:
+                index_cache.store(self.CACHE_NAME, self.CACHE_VERSION,
+                                  columns)
+        self.starts, self.ends, self.cu_offsets = columns
+
+    def _build_columns(self, elf_file):
+        ranges = list()
+        section = elf_file.get_section_by_name('.debug_aranges')
+        if section is not None:
+            byte_order = '<' if elf_file.little_endian else '>'
+            try:
+                ranges = parse_aranges(section.data(), byte_order)
+            except (struct.error, KeyError) as e:
+                logging.warning('Unable to parse .debug_aranges: {0}'\
+                                .format(e))
+                ranges = list()
+
+        #CUs which are not described in .debug_aranges
+        covered = set(r[2] for r in ranges)
+        cu_offsets = get_cu_offsets(elf_file)
+        if len(covered) >= len(cu_offsets):
+            cu_offsets = list()
+        for cu_offset in cu_offsets:
+            if cu_offset in covered:
+                continue
+            cu = get_compile_unit(elf_file, cu_offset)
+            top_die = cu.get_top_DIE()
+            base_address = 0
+            if top_die.attributes.has_key('DW_AT_low_pc'):
+                base_address = top_die.attributes['DW_AT_low_pc'].value
+            for low_pc, high_pc in get_die_ranges(top_die, base_address):
+                ranges.append((low_pc, high_pc, cu.cu_offset))
+
+        ranges.sort()
+        return [array('L', [r[0] for r in ranges]),
+                array('L', [r[1] for r in ranges]),
+                array('L', [r[2] for r in ranges])]
+
+    def lookup(self, address):
+        """Returns offset of the CU containing the address or None
+        """
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return self.cu_offsets[i]
+        return None
+
+    def get_cu(self, address):
+        """Returns CompileUnit containing the address or None
+        """
+        cu_offset = self.lookup(address)
+        if cu_offset == None:
+            return None
+        return get_compile_unit(self.elf_file, cu_offset)
+
+def get_cu_range_index():
+    """Returns CU range index of the symbol file being debugged
+    """
+    if shared.cu_range_index == None:
+        shared.cu_range_index = CURangeIndex(shared.symbol_file,
+                                             shared.index_cache)
+    return shared.cu_range_index
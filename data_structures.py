@@ -31,63 +31,108 @@ import logging
 from collections import OrderedDict, namedtuple
 from elftools.dwarf.dwarf_expr import GenericExprVisitor
 from dwarf_expression_decoder import decode_die_expression
+from name_index import get_name_index, UNKNOWN_DIE
+from struct_layout import get_layout
 import shared
 
 def get_pydie(name):
     """Returns variable/structure/function with the given name 
     """
-    for cu in shared.symbol_file.get_dwarf_info().iter_CUs():
-        pycu = PyCompileUnit(cu)
-        if pycu.die_hash.has_key(name):
-            for pydie in pycu.die_hash[name]:
+    index = get_name_index()
+    for cu_offset, die_offset in index.lookup(name):
+        pycu = PyCompileUnit(index.get_cu(cu_offset))
+        if die_offset == UNKNOWN_DIE:
+            #Only the CU is known, search the name inside the CU
+            for pydie in pycu.get_pydies_by_name(name):
+                yield pydie
+        else:
+            pydie = pycu.get_pydie_at_offset(die_offset)
+            if pydie != None:
                 yield pydie
 
 class PyCompileUnit(object):
     """Represents a DWARF Compilation Unit and contains all the DIEs in the CU.
+       PyDies are created only when they are asked for - either directly or
+       through name, parent, children or base type of another PyDie.
     """
     _instances = dict()
     def __new__(cls, *args, **kwargs):
         """ Restrict only one instance per compile unit
+            CU offset is used as key since the same CU could be parsed more
+            than once into different CompileUnit objects.
         """
         cu = args[0] 
-        if cls._instances.has_key(cu):
-            return cls._instances[cu]
+        if cls._instances.has_key(cu.cu_offset):
+            return cls._instances[cu.cu_offset]
 
         return super(PyCompileUnit, cls).__new__(cls, *args, **kwargs) 
 
     def __init__(self, cu):
-        if PyCompileUnit._instances.has_key(cu):
+        if PyCompileUnit._instances.has_key(cu.cu_offset):
             #Initialize only once
             return
-        PyCompileUnit._instances[cu] = self
+        PyCompileUnit._instances[cu.cu_offset] = self
 
         self.compile_unit = cu
 
-        """A dictionary of lists containing PyDie
-            Key is PyDie name. A list is created even if there is no name
-            collision(for simpilicity)
-        """
-        self.die_hash = dict()
-
-        """A hash table to hold PyDie with offset as key
-           This hash table is used to create parent/child link.
+        """A hash table to hold PyDie with DIE offset as key
+           Filled as PyDies are created.
         """
         self.die_offset_hash = dict()
 
-        self._parse_dies()
-
-    def _parse_dies(self):
-        """ Parse all the DIEs in the compilation unit(recursively)
+        """Lightweight index of the DIEs in the CU - built on first use
+           _name_index   - name to list of DIE offsets
+           _dies         - DIE offset to DIE
+           _parent_index - DIE offset to parent DIE offset
+        """
+        self._index_built = False
+        self._name_index = dict()
+        self._dies = dict()
+        self._parent_index = dict()
+
+    def _build_index(self):
+        """ Walk all the DIEs in the compilation unit(recursively) and record
+            their names, offsets and parents. No PyDie is created here.
         """
-        self._parse_die_children(self.compile_unit.get_top_DIE())
+        if self._index_built:
+            return
+        self._index_built = True
+        self._index_die_children(self.compile_unit.get_top_DIE(), None)
 
-    def _parse_die_children(self, die, parent=None):
-        """ Create PyDie instacnes for children of given die
+    def _index_die_children(self, die, parent_offset):
+        """ Index children of the given die
         """
         for child in die.iter_children():
-            pydie = self._parse_pydie(child, parent)
+            attr = child.attributes
+            #if there is no attribute then skip the die and its children
+            if attr == None or len(attr) == 0:
+                continue
+
+            offset = child.offset
+            self._dies[offset] = child
+            self._parent_index[offset] = parent_offset
+            name = attr['DW_AT_name'].value if attr.has_key('DW_AT_name') \
+                   else ''
+            if self._name_index.has_key(name):
+                self._name_index[name].append(offset)
+            else:
+                self._name_index[name] = [offset]
+
+            self._index_die_children(child, offset)
 
-    def _parse_pydie(self, die, parent=None):
+    def _get_type_offset(self, die):
+        """ Returns DIE offset of the DW_AT_type of the given die or 0
+        """
+        attr = die.attributes
+        if not attr.has_key('DW_AT_type'):
+            return 0
+        type_attr = attr['DW_AT_type']
+        if type_attr.form == 'DW_FORM_ref_addr':
+            return type_attr.value
+        #Other reference forms are relative to the compilation unit
+        return type_attr.value + self.compile_unit.cu_offset
+
+    def _create_pydie(self, die):
         """Helper function to create PyDie from the given die
         """
         attr = die.attributes
@@ -95,48 +140,69 @@ class PyCompileUnit(object):
         if attr == None or len(attr) == 0:
             return None 
 
-        #get offset of first attribute
-        offset = attr[attr.keys()[0]].offset
-        #TODO - Remove after debugging
-        assert not self.die_offset_hash.has_key(offset)
-
-        if attr.has_key('DW_AT_type'):
-            base_type_offset = attr['DW_AT_type'].value + 1
-        else:
-            base_type_offset = 0
-
-        pydie = PyDie(die, self, base_type_offset, parent, offset)
+        pydie = PyDie(die, self, self._get_type_offset(die), None, die.offset)
+        self.die_offset_hash[die.offset] = pydie
+        return pydie
 
-        #Insert the pydie in the hash table
-        if self.die_hash.has_key(pydie.name):
-            collision_list = self.die_hash[pydie.name]
-        else:
-            collision_list = list()
-        collision_list.append(pydie)
-        self.die_hash[pydie.name] = collision_list
+    def get_pydie(self, die):
+        """Return PyDie for the given die
+        """
+        pydie = self.die_offset_hash.get(die.offset)
+        if pydie == None:
+            pydie = self._create_pydie(die)
+        return pydie
 
-        self.die_offset_hash[offset] = pydie 
+    def get_pydie_at_offset(self, offset):
+        """Return PyDie for the die at the given offset
+        """
+        pydie = self.die_offset_hash.get(offset)
+        if pydie != None:
+            return pydie
 
-        #Parse children of this die
-        self._parse_die_children(die, pydie)
+        self._build_index()
+        die = self._dies.get(offset)
+        if die == None:
+            return None
+        return self._create_pydie(die)
 
-        return pydie
+    def get_pydies_by_name(self, name):
+        """Yields PyDies with the given name
+        """
+        self._build_index()
+        for offset in self._name_index.get(name, []):
+            yield self.get_pydie_at_offset(offset)
 
-    def get_pydie(self, die):
-        """Return PyDie for the given die
+    def get_parent_pydie(self, pydie):
+        """Returns parent PyDie of the given PyDie
+           Returns None for DIEs directly under the compilation unit
         """
-        attr = die.attributes
-        offset = attr[attr.keys()[0]].offset
-        if self.die_offset_hash.has_key(offset):
-            return self.die_offset_hash[offset]
+        self._build_index()
+        parent_offset = self._parent_index.get(pydie.offset)
+        if parent_offset == None:
+            return None
+        return self.get_pydie_at_offset(parent_offset)
 
-class PyDie():
+    def get_children_pydies(self, pydie):
+        """Returns PyDies of children of the given PyDie as OrderedDict
+           Key is the name of the child.
+        """
+        children = OrderedDict()
+        for child in pydie.die.iter_children():
+            child_pydie = self.get_pydie(child)
+            if child_pydie == None:
+                continue
+            child_pydie._parent = pydie
+            children[child_pydie.name] = child_pydie
+        return children
+
+class PyDie(object):
     """This class represents a DWARF DIE
+       Parent and children are resolved only when they are accessed.
     """
     def __init__(self, die, pycu, base_type_offset=0, parent=None, offset=0):
         self.die = die
         self.pycu = pycu
-        self.children = OrderedDict()
+        self._children = None
         self.base_type_offset = base_type_offset
         attr = die.attributes
 
@@ -161,26 +227,44 @@ class PyDie():
         self.line_number = get_attr_value('DW_AT_decl_line')
         self.offset = offset
 
-        self.parent = parent
+        self._parent = parent
 
         self.byte_offset = 0
         if die.tag == 'DW_TAG_member' and\
            attr.has_key('DW_AT_data_member_location'):
-            loc = LocExprDecoder(die.cu.structs)
-            loc.process_expr(attr['DW_AT_data_member_location'].value)
-            self.byte_offset = loc.byte_offset[0]
-
-        if parent:
-            parent.children[self.name] = self
+            location = attr['DW_AT_data_member_location'].value
+            if isinstance(location, (int, long)):
+                #DWARF3+ encodes the offset as constant
+                self.byte_offset = location
+            else:
+                loc = LocExprDecoder(die.cu.structs)
+                loc.process_expr(location)
+                self.byte_offset = loc.byte_offset[0]
 
         self._dso = None
 
+    @property
+    def parent(self):
+        """Parent PyDie - None for DIEs directly under the compilation unit
+        """
+        if self._parent == None:
+            self._parent = self.pycu.get_parent_pydie(self)
+        return self._parent
+
+    @property
+    def children(self):
+        """Children PyDies as OrderedDict(name as key)
+        """
+        if self._children == None:
+            self._children = self.pycu.get_children_pydies(self)
+        return self._children
+
     def get_base_type(self):
         """Returns base type die of the current die
         """
-        if self.pycu.die_offset_hash.has_key(self.base_type_offset):
-            return self.pycu.die_offset_hash[self.base_type_offset]
-        return None
+        if self.base_type_offset == 0:
+            return None
+        return self.pycu.get_pydie_at_offset(self.base_type_offset)
 
     def is_pointer(self):
         """Returns true if the datatype is of type pointer
@@ -560,6 +644,26 @@ class DataStructureObject():
 
         return internal.value
 
+    def decode(self):
+        """ Returns decoded value of this DIE.
+            The whole object(sizeof() bytes) is read with one read and decoded
+            with the precompiled layout of its type. Structures and arrays are
+            returned as views whose members are decoded from that buffer when
+            accessed - dso.decode().second.val[2]
+        """
+        address = self.get_address()
+        if address == None:
+            return
+
+        address_space = shared.address_space
+        layout = get_layout(self._internal.pydie, address_space.byte_order,
+                            address_space.word_size)
+        data = address_space.read(address, layout.size)
+        if data == None or len(data) < layout.size:
+            return
+
+        return layout.decode(data, 0)
+
     def get_address(self, dont_disturb_parent=False):
         """ Returns address of this DIE variable.
         """
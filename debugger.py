@@ -27,10 +27,12 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import logging
+import struct
 from process_coredump import Process
-from dwarf_expression_decoder import (get_function_frame_base,
-                                      decode_die_expression)
-from data_structures import PyCompileUnit
+from dwarf_expression_decoder import decode_die_expression, get_frame_offset
+from parallel_unwind import iter_unwind_threads
+from read_planner import PlannedAddressSpace
+from struct_layout import get_layout, StructLayout, ArrayLayout
 
 import shared
 
@@ -45,6 +47,20 @@ def get_threads():
     if get_threads.pt_info:
         return get_threads.pt_info.get_threads()
 
+def iter_thread_backtraces(max_frames=None):
+    """ Yields ThreadBacktrace of every thread in the process
+        Threads are unwound in parallel when more than one job is allowed.
+        Only the innermost max_frames frames are unwound if it is given.
+    """
+    return iter_unwind_threads(get_threads(), shared.jobs,
+                               max_frames=max_frames)
+
+def get_unique_stacks():
+    """ Returns threads of the process grouped by identical stacks
+    """
+    get_threads()
+    return get_threads.pt_info.get_unique_stacks()
+
 def get_thread(index):
     """ Returns thread of given index
         Note - Index != thread_id
@@ -72,34 +88,99 @@ def get_current_frame():
     """
     return get_frame(shared.current_thread_index, shared.current_frame_index)
 
-def get_frame_args(frame):
+def get_frame_args(frame, address_space=None):
     """Get Function Parameters and their location
     """
     if frame.fn_die is None:
         return None
 
     return _fill_die_value(frame,
-                           frame.fn_die.iter_children_of_type_parameter())
+                           frame.fn_die.iter_children_of_type_parameter(),
+                           address_space)
 
-def get_frame_locals(frame):
+def get_frame_locals(frame, address_space=None):
     """Get Function variables and their location
     """
     if frame.fn_die is None:
         return None
 
     return _fill_die_value(frame,
-                           frame.fn_die.iter_children_of_type_variable())
-
-def _fill_die_value(frame, die_list):
+                           frame.fn_die.iter_children_of_type_variable(),
+                           address_space)
+
+def plan_frame_reads(frames, with_locals=False, with_args=True,
+                     address_space=None):
+    """Returns address space to evaluate args(and/or locals) of the frames
+       The stack pages of the DW_OP_fbreg variables of the frames are read
+       with few page aligned reads. Pass the returned address space back
+       for the next frames so the pages already read are reused.
+       The frames must be populated.
+    """
+    if address_space == None:
+        address_space = PlannedAddressSpace(shared.address_space)
+    reads = list()
+    for frame in frames:
+        if frame.fn_die is None:
+            continue
+        dies = list()
+        if with_args:
+            dies.extend(frame.fn_die.iter_children_of_type_parameter())
+        if with_locals:
+            dies.extend(frame.fn_die.iter_children_of_type_variable())
+        try:
+            reads.extend(_get_frame_reads(frame, dies, address_space))
+        except (ValueError, struct.error), e:
+            logging.warning('Frame base of {0} could not be read: {1}'\
+                            .format(frame, e))
+    address_space.plan(reads)
+    return address_space
+
+def _get_frame_reads(frame, die_list, address_space):
+    """ Returns (address, size) read by decoding the DIEs(args, locals)
+        which are located relative to the frame base
+    """
+    reads = list()
+    frame_base = None
+    pycu = frame.get_pycu()
+    for die in die_list:
+        offset = get_frame_offset(die, 'DW_AT_location', frame.ip)
+        if offset == None:
+            continue
+        if frame_base == None:
+            frame_base = frame.get_frame_base()
+            if frame_base == None:
+                break
+        base_type = pycu.get_pydie(die).get_base_type()
+        layout = get_layout(base_type, address_space.byte_order,
+                            address_space.word_size)
+        if isinstance(layout, (StructLayout, ArrayLayout)):
+            reads.append((frame_base + offset, layout.size))
+        else:
+            #DW_OP_fbreg reads a word - see _fill_die_value()
+            reads.append((frame_base + offset, 8))
+    return reads
+
+def _fill_die_value(frame, die_list, address_space=None):
     """ Fill DIE(args, locals) values
+        Structures and arrays are read with one read and decoded with the
+        compiled layout of their type(StructView, ArrayView).
     """
-    frame_base = get_function_frame_base(frame, shared.address_space)
-    pycu = PyCompileUnit(frame.compile_unit)
+    if address_space == None:
+        address_space = shared.address_space
+    frame_base = frame.get_frame_base()
+    pycu = frame.get_pycu()
     result = []
     for die in die_list:
         pydie = pycu.get_pydie(die)
+        layout = get_layout(pydie.get_base_type(), address_space.byte_order,
+                            address_space.word_size)
+        if isinstance(layout, (StructLayout, ArrayLayout)):
+            pydie.value = _read_layout(die, layout, frame, address_space,
+                                       frame_base)
+            result.append(pydie)
+            continue
         value = decode_die_expression(die, 'DW_AT_location', frame.ip,
-                                      frame.registers, shared.address_space,
+                                      frame.registers, address_space,
                                       frame_base)
         # The value decoded is 8 byte regardless of the datatype.
         # So truncate the value based on data type
@@ -110,3 +191,16 @@ def _fill_die_value(frame, die_list):
 
     return result
 
+def _read_layout(die, layout, frame, address_space, frame_base):
+    """ Returns view of the structure or array variable or None if it could
+        not be read
+    """
+    address = decode_die_expression(die, 'DW_AT_location', frame.ip,
+                                    frame.registers, address_space,
+                                    frame_base, is_address=True)
+    if not address:
+        return None
+    data = address_space.read(address, layout.size)
+    if data == None or len(data) < layout.size:
+        return None
+    return layout.decode(data, 0)
@@ -2,6 +2,9 @@
 DWARF Expression Decoder
     Functions to decode DWARF expression as specfied in
     DWARF4 Spec - Section 2.5 'DWARF Expressions'
+    Each distinct expression is compiled once in to a tuple of
+    (handler, operand) and cached; evaluating it only binds the registers
+    and frame base.
 
 Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
 
@@ -32,35 +35,51 @@ import logging
 from register_map import RegisterMap
 
 def decode_die_expression(die, attribute_name, address, registers,
-                          address_space, frame_base):
+                          address_space, frame_base, is_address=False):
     """Decode a expression that is found in a DIE attributes.
-       The expression could be in location list(offset as DW_FORM_data)
-       or embedded - this routine handles both.
+       The expression could be in location list(offset as DW_FORM_data,
+       DW_FORM_sec_offset or DW_FORM_loclistx) or embedded - this routine
+       handles both.
+       If is_address is True DW_OP_fbreg results in the address of the
+       object instead of the value stored there(structures, arrays).
     """
-    dwarf_info = die.dwarfinfo
+    program = get_die_program(die, attribute_name, address)
+    if program == None:
+        return None
+    return evaluate_expression(program, registers, address_space, frame_base,
+                               address, is_address=is_address)
+
+def get_die_program(die, attribute_name, address):
+    """ Returns compiled expression of a DIE attribute valid at the address
+        (location list entry or the embedded expression) or None
+    """
+    #location_lists compiles expressions with this module
+    from location_lists import is_location_list, get_location_list_index
+
     if not die.attributes.has_key(attribute_name):
         return None
     attr = die.attributes[attribute_name]
-    if attr.form.startswith('DW_FORM_data'):
+    if is_location_list(attr):
         # The expression is in location list
-        loc_lists = dwarf_info.location_lists()
-        if loc_lists == None:
-            logging.error('Not able to obtain Location List')
-            return None
+        location_list = get_location_list_index().get_location_list(die, attr)
         # Get location list entry for the given address
-        entry = loc_lists.get_location_list_entry(attr.value, address,
-                                                  die.cu.get_low_pc())
-        if entry == None:
+        program = location_list.lookup(address)
+        if program == None:
             logging.error('Locaton List Entry not found')
-            return None
-        expr = entry.loc_expr
-    else:
-        # The expression is embedded
-        expr = attr.value
+        return program
 
-    # Parse the expression and return result
-    return parse_dwarf_expression(expr, dwarf_info, registers, address_space,
-                                  frame_base)
+    # The expression is embedded
+    return compile_expression(attr.value, die.dwarfinfo.structs)
+
+def get_frame_offset(die, attribute_name, address):
+    """ Returns offset from the frame base of a location which is just
+        DW_OP_fbreg, or None for any other location
+    """
+    program = get_die_program(die, attribute_name, address)
+    if program and len(program) == 1 and \
+       program[0][0] == _push_frame_register:
+        return program[0][1]
+    return None
 
 def get_function_frame_base(frame, address_space):
     """ Convenience function to decode frame base of a function
@@ -69,186 +88,245 @@ def get_function_frame_base(frame, address_space):
                                  frame.ip, frame.registers, address_space, None)
 
 def parse_dwarf_expression(expression, dwarf_info, registers, address_space, 
-                           frame_base):
+                           frame_base, address=None, is_address=False):
     """ Parse the dwarf expression and returns the result.
     """
-    #TODO - Replace the hardcoded x86-65
-    register_map = RegisterMap('x86-64')
-    if registers:
-        reg_tab = registers.copy()
-    else:
-        reg_tab = None
-    if frame_base:
-        reg_tab[register_map.get_frame_pointer_register_number()] = frame_base
-    decoder = ExpressionDecoder(dwarf_info.structs, address_space, reg_tab, frame_base)
-    decoder.process_expr(expression)
-
-    return decoder.get_result()
-
-class ExpressionDecoder(GenericExprVisitor):
-    """DWARF Expression decoder
-        
-       DWARF Expression decoder is a state machine operating on stack.
-       The expression is byte stream. (Multiple operation is possible)
-       The first byte is opcode followed by optional operands.
-       The opcode determines the number of operands and their size.
+    program = compile_expression(expression, dwarf_info.structs)
+    return evaluate_expression(program, registers, address_space, frame_base,
+                               address, is_address=is_address)
 
-       Most opcode performs some operation on the operand and pushes the result
-       in the stack. When all the opcodes are parsed and end of byte stream is
-       reached the last entry in the stack is result of the expression.
+#TODO - Replace the hardcoded x86-64
+_FRAME_POINTER_REGISTER = RegisterMap('x86-64')\
+                                .get_frame_pointer_register_number()
 
-       For more info refer DWARF4 Spec - Section 2.5
+#(expression bytes, address size) to compiled program
+_compiled_expressions = dict()
+
+def compile_expression(expression, structs):
+    """ Returns compiled program of the expression - tuple of
+        (handler, operand). The programs are cached.
     """
-    def __init__(self, structs, address_space, registers, frame_base):
-        super(ExpressionDecoder, self).__init__(structs)
-        self.address_space = address_space
+    key = (tuple(expression), structs.address_size)
+    program = _compiled_expressions.get(key)
+    if program == None:
+        compiler = ExpressionCompiler(structs)
+        compiler.process_expr(expression)
+        program = tuple(compiler.program)
+        _compiled_expressions[key] = program
+    return program
+
+class EvaluationContext():
+    """ Values an expression is evaluated against
+        The frame pointer register reads as the frame base when it is given.
+    """
+    def __init__(self, registers, address_space, frame_base, address,
+                 is_address=False):
         self.registers = registers
-        self.describe = ''
-        self.stack = [0]
+        self.address_space = address_space
+        self.frame_base = frame_base
+        self.address = address
+        self.is_address = is_address
         #TODO - Replace this with proper value read from dwarfinfo
         self.default_data_size = 8
-        self.frame_base = frame_base
 
-    def _push(self, value):
-        """ Push a value into stack
-        """
-        self.stack.append(value)
+    def get_register(self, register_no):
+        if self.frame_base and register_no == _FRAME_POINTER_REGISTER:
+            return self.frame_base
+        return self.registers[register_no]
 
-    def _pop(self):
-        """ Pop last entry from the stack
+    def get_cfa(self):
+        """ Canonical frame address of the frame at self.address
         """
-        return self.stack.pop()
+        #unwind_table evaluates CFI expressions with this module
+        from unwind_table import get_unwind_table, compute_cfa
+        program = get_unwind_table().find_program(self.address)
+        if program == None:
+            logging.error('No CFI to compute CFA at {0:#x}'\
+                          .format(self.address or 0))
+            return 0
+        return compute_cfa(program, self.registers, self.address_space)
 
-    def _peek(self):
-        """ Reterive last entry from the stack without removing it
-        """
-        return self.stack[-1]
+def evaluate_expression(program, registers, address_space, frame_base,
+                        address=None, stack_base=0, is_address=False):
+    """ Run a compiled expression and return the result.
+        stack_base is the value on the stack before the first operation(CFA
+        for the register rules of CFI).
+    """
+    context = EvaluationContext(registers, address_space, frame_base, address,
+                                is_address)
+    stack = [stack_base]
+    for handler, operand in program:
+        handler(stack, context, operand)
+    return stack[-1]
 
-    def _pick(self, index):
-        """ Reterive a entry from stack and push it in the top
-        """
-        val = self.stack[-index]
-        self._push(val)
+class ExpressionCompiler(GenericExprVisitor):
+    """DWARF Expression compiler
 
-    def _push_register(self, register_no, index=0):
-        """ Push a register into the stack
-        """
-        self._push(self.registers[register_no] + index)
+       DWARF Expression decoder is a state machine operating on stack.
+       The expression is byte stream. (Multiple operation is possible)
+       The first byte is opcode followed by optional operands.
+       The opcode determines the number of operands and their size.
 
-    def _push_frame_register(self, index):
-        """ Read a value from memory at (frame_base + index) and push it
-        """
-        address = self.frame_base + index
-        value = self.address_space.read_int(address, 8)
-        self._push(value)
+       Most opcode performs some operation on the operand and pushes the result
+       in the stack. When all the opcodes are parsed and end of byte stream is
+       reached the last entry in the stack is result of the expression.
 
-    def _do_op_pop1(self, op):
-        """ Pop top entry from stack and execute OP(top)
-            and push result back into the stack
-        """
-        top = self._pop()
-        result = op(top)
-        self._push(result)
+       The compiler translates each operation to (handler, operand) using
+       _OPERATIONS, so evaluation does not parse or compare opcode names.
 
-    def _do_op_pop2(self, op):
-        """ Pop 2 entries from stack and execute OP(first, second)
-            and push result back into the stack
-        """
-        first = self._pop()
-        second = self._pop()
-        result = op(first, second)
-        self._push(result)
+       For more info refer DWARF4 Spec - Section 2.5
+    """
+    def __init__(self, structs):
+        super(ExpressionCompiler, self).__init__(structs)
+        self.program = list()
 
     def _after_visit(self, opcode, opcode_name, args):
         """ GenericExprVisitor() will call this function after parsing each
             opcode and operands.
-
-            This function just push/pop the entries to/from stack based on
-            stack.
         """
-        if opcode_name == 'DW_OP_addr' or opcode_name.startswith('DW_OP_const'):
-            self._push(args[0])
-        elif opcode_name == 'DW_OP_deref':
-            self._do_op_pop1(lambda top: self.address_space.read_int(top, self.default_data_size))
-        elif opcode_name == 'DW_OP_deref_size':
-            self._do_op_pop1(lambda top: self.address_space.read_int(top, args[0]))
-        elif opcode_name == 'DW_OP_dup':
-            top = self._peek()
-            self.push(top)
-        elif opcode_name == 'DW_OP_drop':
-            self.pop()
-        elif opcode_name == 'DW_OP_over':
-            self._pick(-1)
-        elif opcode_name == 'DW_OP_pick':
-            self._pick[args[0]]
-        elif opcode_name == 'DW_OP_swap':
-            top = self._pop()
-            self.stack.insert(len(self.stack - 1), top)
-        elif opcode_name == 'DW_OP_rot':
-            top = self._pop()
-            self.stack.insert(len(self.stack - 2), top)
-        elif opcode_name == 'DW_OP_abs':
-            self._do_op_pop1(lambda top: abs(top))
-        elif opcode_name == 'DW_OP_and':
-            self._do_op_pop2(lambda first, second: second & first)
-        elif opcode_name == 'DW_OP_div':
-            self._do_op_pop2(lambda first, second: second / first)
-        elif opcode_name == 'DW_OP_minus':
-            self._do_op_pop2(lambda first, second: first - second)
-        elif opcode_name == 'DW_OP_mod':
-            self._do_op_pop2(lambda first, second: second % first)
-        elif opcode_name == 'DW_OP_mul':
-            self._do_op_pop2(lambda first, second: second * first)
-        elif opcode_name == 'DW_OP_neg':
-            self._do_op_pop1(lambda top: -top)
-        elif opcode_name == 'DW_OP_not':
-            self._do_op_pop1(lambda top: ~top)
-        elif opcode_name == 'DW_OP_or':
-            self._do_op_pop2(lambda first, second: first | second)
-        elif opcode_name == 'DW_OP_plus':
-            self._do_op_pop2(lambda first, second: first + second)
-        elif opcode_name == 'DW_OP_plus_uconst':
-            self._do_op_pop1(lambda top: top + args[0])
-        elif opcode_name == 'DW_OP_shl':
-            self._do_op_pop2(lambda first, second: second << first)
-        elif opcode_name == 'DW_OP_shr':
-            self._do_op_pop2(lambda first, second: second >> first)
-        elif opcode_name == 'DW_OP_xor':
-            self._do_op_pop2(lambda first, second: second ^ first)
-        elif opcode_name == 'DW_OP_le':
-            self._do_op_pop2(lambda first, second: second <= first)
-        elif opcode_name == 'DW_OP_ge':
-            self._do_op_pop2(lambda first, second: second >= first)
-        elif opcode_name == 'DW_OP_eq':
-            self._do_op_pop2(lambda first, second: second == first)
-        elif opcode_name == 'DW_OP_lt':
-            self._do_op_pop2(lambda first, second: second < first)
-        elif opcode_name == 'DW_OP_gt':
-            self._do_op_pop2(lambda first, second: second > first)
-        elif opcode_name == 'DW_OP_ne':
-            self._do_op_pop2(lambda first, second: second != first)
-        elif opcode_name.startswith('DW_OP_lit'):
-            self._push(args[0])
-        elif opcode_name == 'DW_OP_regx':
-            self._push_register(args[0])
-        elif opcode_name.startswith('DW_OP_reg'):
-            self._push_register(opcode - DW_OP_name2opcode['DW_OP_reg0'])
-        elif opcode_name == 'DW_OP_bregx':
-            self._push_register(args[0], args[1])
-        elif opcode_name.startswith('DW_OP_breg'):
-            self._push_register(opcode - DW_OP_name2opcode['DW_OP_breg0'], args[0])
-        elif opcode_name == 'DW_OP_fbreg':
-            self._push_frame_register(args[0])
-        elif opcode_name == 'DW_OP_nop':
-            pass
-        else:
+        operation = _OPERATIONS.get(opcode)
+        if operation == None:
             logging.error('DWARF expression opcode {0} is not yet implemented'\
                           .format(opcode_name))
+            return
+        handler, make_operand = operation
+        self.program.append((handler, make_operand(opcode, args)))
 
-        self.describe += '{0} {1}'.format(opcode_name, args)
+#Handlers - handler(stack, context, operand)
+def _push(stack, context, value):
+    stack.append(value)
 
-    def get_result(self):
-        """ Get the result from the stack and return.
-        """
-        return self._peek()
+def _push_register(stack, context, operand):
+    register_no, offset = operand
+    stack.append(context.get_register(register_no) + offset)
+
+def _push_frame_register(stack, context, offset):
+    """ Read a value from memory at (frame_base + offset) and push it
+        (push the address itself when the address of the object is needed)
+    """
+    if context.is_address:
+        stack.append(context.frame_base + offset)
+        return
+    stack.append(context.address_space.read_int(context.frame_base + offset,
+                                                8))
+
+def _push_cfa(stack, context, operand):
+    stack.append(context.get_cfa())
+
+def _deref(stack, context, size):
+    stack.append(context.address_space.read_int(stack.pop(),
+                                        size or context.default_data_size))
+
+def _dup(stack, context, operand):
+    stack.append(stack[-1])
+
+def _drop(stack, context, operand):
+    stack.pop()
+
+def _pick(stack, context, index):
+    stack.append(stack[-1 - index])
+
+def _swap(stack, context, operand):
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+
+def _rot(stack, context, operand):
+    stack[-3], stack[-2], stack[-1] = stack[-1], stack[-3], stack[-2]
+
+def _nop(stack, context, operand):
+    pass
+
+def _unary(op):
+    def handler(stack, context, operand):
+        stack.append(op(stack.pop()))
+    return handler
+
+def _binary(op):
+    """ op(second, first) - first is the top of the stack
+    """
+    def handler(stack, context, operand):
+        first = stack.pop()
+        second = stack.pop()
+        stack.append(op(second, first))
+    return handler
+
+def _plus_uconst(stack, context, value):
+    stack.append(stack.pop() + value)
+
+#Operand builders - make_operand(opcode, args)
+def _no_operand(opcode, args):
+    return None
+
+def _first_arg(opcode, args):
+    return args[0]
+
+def _const8(opcode, args):
+    #pyelftools splits 8 byte constants in to two 4 byte words
+    if len(args) == 2:
+        return args[0] | (args[1] << 32)
+    return args[0]
+
+def _relative_to(base_name, with_offset):
+    base = DW_OP_name2opcode[base_name]
+    if with_offset:
+        return lambda opcode, args: (opcode - base, args[0])
+    return lambda opcode, args: (opcode - base, 0)
+
+def _build_operations():
+    """ opcode to (handler, operand builder) dispatch table
+    """
+    operations = dict()
+    def add(name, handler, make_operand=_no_operand):
+        operations[DW_OP_name2opcode[name]] = (handler, make_operand)
+
+    add('DW_OP_addr', _push, _first_arg)
+    for name in ['DW_OP_const1u', 'DW_OP_const1s', 'DW_OP_const2u',
+                 'DW_OP_const2s', 'DW_OP_const4u', 'DW_OP_const4s',
+                 'DW_OP_constu', 'DW_OP_consts']:
+        add(name, _push, _first_arg)
+    add('DW_OP_const8u', _push, _const8)
+    add('DW_OP_const8s', _push, _const8)
+    add('DW_OP_deref', _deref)
+    add('DW_OP_deref_size', _deref, _first_arg)
+    add('DW_OP_dup', _dup)
+    add('DW_OP_drop', _drop)
+    add('DW_OP_over', _pick, lambda opcode, args: 1)
+    add('DW_OP_pick', _pick, _first_arg)
+    add('DW_OP_swap', _swap)
+    add('DW_OP_rot', _rot)
+    add('DW_OP_abs', _unary(abs))
+    add('DW_OP_neg', _unary(lambda top: -top))
+    add('DW_OP_not', _unary(lambda top: ~top))
+    add('DW_OP_plus_uconst', _plus_uconst, _first_arg)
+    add('DW_OP_and', _binary(lambda second, first: second & first))
+    add('DW_OP_div', _binary(lambda second, first: second // first))
+    add('DW_OP_minus', _binary(lambda second, first: second - first))
+    add('DW_OP_mod', _binary(lambda second, first: second % first))
+    add('DW_OP_mul', _binary(lambda second, first: second * first))
+    add('DW_OP_or', _binary(lambda second, first: second | first))
+    add('DW_OP_plus', _binary(lambda second, first: second + first))
+    add('DW_OP_shl', _binary(lambda second, first: second << first))
+    add('DW_OP_shr', _binary(lambda second, first: second >> first))
+    add('DW_OP_shra', _binary(lambda second, first: second >> first))
+    add('DW_OP_xor', _binary(lambda second, first: second ^ first))
+    add('DW_OP_le', _binary(lambda second, first: int(second <= first)))
+    add('DW_OP_ge', _binary(lambda second, first: int(second >= first)))
+    add('DW_OP_eq', _binary(lambda second, first: int(second == first)))
+    add('DW_OP_lt', _binary(lambda second, first: int(second < first)))
+    add('DW_OP_gt', _binary(lambda second, first: int(second > first)))
+    add('DW_OP_ne', _binary(lambda second, first: int(second != first)))
+    for n in range(0, 32):
+        add('DW_OP_lit%d' % n, _push, lambda opcode, args: \
+                                opcode - DW_OP_name2opcode['DW_OP_lit0'])
+        add('DW_OP_reg%d' % n, _push_register,
+            _relative_to('DW_OP_reg0', False))
+        add('DW_OP_breg%d' % n, _push_register,
+            _relative_to('DW_OP_breg0', True))
+    add('DW_OP_regx', _push_register, lambda opcode, args: (args[0], 0))
+    add('DW_OP_bregx', _push_register,
+        lambda opcode, args: (args[0], args[1]))
+    add('DW_OP_fbreg', _push_frame_register, _first_arg)
+    add('DW_OP_call_frame_cfa', _push_cfa)
+    add('DW_OP_nop', _nop)
+    return operations
 
+_OPERATIONS = _build_operations()
@@ -0,0 +1,387 @@
+"""
+eh_frame.py:
+    .eh_frame call frame information with .eh_frame_hdr lookup.
+    Release binaries are usually stripped of .debug_frame but still carry
+    .eh_frame(used by the C++ runtime) and its sorted binary search table
+    in .eh_frame_hdr. The FDE for an IP is found by bisecting that table and
+    only the FDE(and its CIE) is parsed.
+
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+import logging
+import struct
+from array import array
+from cStringIO import StringIO
+import elftools
+from elftools.dwarf.callframe import CallFrameInfo, CIE, FDE
+from elftools.dwarf.dwarfinfo import DWARFInfo
+from elftools.dwarf.structs import DWARFStructs
+from elftools.common.exceptions import DWARFError
+from name_index import _read_uleb, _read_cstring, _read_initial_length
+
+#Pointer encodings - LSB Core Specification 10.5 'Exception Frames'
+DW_EH_PE_absptr = 0x00
+DW_EH_PE_uleb128 = 0x01
+DW_EH_PE_udata2 = 0x02
+DW_EH_PE_udata4 = 0x03
+DW_EH_PE_udata8 = 0x04
+DW_EH_PE_sleb128 = 0x09
+DW_EH_PE_sdata2 = 0x0a
+DW_EH_PE_sdata4 = 0x0b
+DW_EH_PE_sdata8 = 0x0c
+DW_EH_PE_pcrel = 0x10
+DW_EH_PE_datarel = 0x30
+DW_EH_PE_indirect = 0x80
+DW_EH_PE_omit = 0xff
+
+#pyelftools versions whose CallFrameInfo internals(_entry_cache,
+#_parse_instructions, CIE/FDE constructors) EHFrameInfo is written against.
+#Other versions must provide the public DWARFInfo.EH_CFI_entries().
+EH_FRAME_PARSER_VERSIONS = ('0.20', '0.21')
+
+EH_PE_FORMAT_CODES = {DW_EH_PE_udata2: 'H', DW_EH_PE_udata4: 'I',
+                      DW_EH_PE_udata8: 'Q', DW_EH_PE_sdata2: 'h',
+                      DW_EH_PE_sdata4: 'i', DW_EH_PE_sdata8: 'q'}
+
+def _read_sleb(data, offset):
+    """Returns (value, new offset) of the SLEB128 at the given offset
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            if byte & 0x40:
+                value -= 1 << shift
+            return value, offset
+
+def read_encoded_pointer(data, offset, encoding, byte_order, address_size,
+                         data_address, datarel_base=0, address_space=None):
+    """Returns (value, new offset) of a DW_EH_PE_* encoded pointer
+       data_address is the address of data[0] when loaded, used for pc
+       relative pointers.
+       DW_EH_PE_indirect pointers are read from the address space; raises
+       ValueError if there is none.
+    """
+    value_format = encoding & 0x0f
+    if value_format == DW_EH_PE_absptr:
+        code = 'Q' if address_size == 8 else 'I'
+        value = struct.unpack_from(byte_order + code, data, offset)[0]
+        new_offset = offset + address_size
+    elif value_format == DW_EH_PE_uleb128:
+        value, new_offset = _read_uleb(data, offset)
+    elif value_format == DW_EH_PE_sleb128:
+        value, new_offset = _read_sleb(data, offset)
+    else:
+        code = EH_PE_FORMAT_CODES[value_format]
+        value = struct.unpack_from(byte_order + code, data, offset)[0]
+        new_offset = offset + struct.calcsize(code)
+
+    application = encoding & 0x70
+    if application == DW_EH_PE_pcrel:
+        value += data_address + offset
+    elif application == DW_EH_PE_datarel:
+        value += datarel_base
+    value &= (1 << (address_size * 8)) - 1
+    if encoding & DW_EH_PE_indirect:
+        if address_space == None:
+            raise ValueError('indirect pointer at {0:#x} can not be read'\
+                             .format(data_address + offset))
+        value = address_space.read_word(value)
+    return value, new_offset
+
+class EHFrameInfo(CallFrameInfo):
+    """.eh_frame section parser
+       .eh_frame uses the .debug_frame instruction set but different CIE/FDE
+       headers(CIE id 0, relative CIE pointer, augmentation data and encoded
+       addresses). The headers are parsed here and the instructions are
+       parsed by pyelftools, so the returned CIE/FDE objects can be decoded
+       like any other. This relies on pyelftools internals - it is used only
+       with EH_FRAME_PARSER_VERSIONS.
+       FDEs whose addresses are indirect pointers are rejected(no
+       instructions) since the symbol file has no memory to read them from.
+    """
+    def __init__(self, data, address, little_endian, address_size):
+        self.data = data
+        self.address = address
+        self.byte_order = '<' if little_endian else '>'
+        self.address_size = address_size
+        base_structs = DWARFStructs(little_endian=little_endian,
+                                    dwarf_format=32,
+                                    address_size=address_size)
+        CallFrameInfo.__init__(self, StringIO(data), len(data), base_structs)
+        self._augmentations = dict()
+
+    def _parse_entries(self):
+        entries = []
+        offset = 0
+        while offset < self.size:
+            length, _, _ = _read_initial_length(self.data, offset,
+                                                self.byte_order)
+            if length == 0:
+                #Zero terminator
+                break
+            entry = self._parse_entry_at(offset)
+            entries.append(entry)
+            offset = entry.end_offset
+        return entries
+
+    def _parse_entry_at(self, offset):
+        """Parse and return the CIE or FDE at the given section offset
+        """
+        if offset in self._entry_cache:
+            return self._entry_cache[offset]
+
+        data = self.data
+        byte_order = self.byte_order
+        length, offset_size, id_offset = _read_initial_length(data, offset,
+                                                              byte_order)
+        end_offset = id_offset + length
+        code = 'Q' if offset_size == 8 else 'I'
+        cie_id = struct.unpack_from(byte_order + code, data, id_offset)[0]
+        pos = id_offset + offset_size
+        entry_structs = DWARFStructs(little_endian=byte_order == '<',
+                                     dwarf_format=offset_size * 8,
+                                     address_size=self.address_size)
+
+        rejected = False
+        if cie_id == 0:
+            header, pos = self._parse_cie_header(offset, pos)
+            entry_class = CIE
+            cie = None
+        else:
+            cie = self._parse_entry_at(id_offset - cie_id)
+            entry_class = FDE
+            try:
+                header, pos = self._parse_fde_header(cie, pos)
+            except ValueError, e:
+                logging.warning('Rejecting FDE at {0:#x}: {1}'\
+                                .format(offset, e))
+                header = dict(CIE_pointer=cie.offset, initial_location=0,
+                              address_range=0)
+                rejected = True
+        header['length'] = length
+
+        instructions = None
+        try:
+            if not rejected:
+                instructions = self._parse_instructions(entry_structs, pos,
+                                                        end_offset)
+        except DWARFError, e:
+            #eg: GNU extensions unknown to the pyelftools in use
+            logging.debug('Skipping CFI entry at {0:#x}: {1}'\
+                          .format(offset, e))
+        entry = entry_class(header=header, structs=entry_structs,
+                            instructions=instructions, offset=offset, cie=cie)
+        entry.end_offset = end_offset
+        self._entry_cache[offset] = entry
+        return entry
+
+    def _parse_cie_header(self, offset, pos):
+        """Returns (header, instructions offset) of a CIE
+        """
+        data = self.data
+        version = ord(data[pos])
+        augmentation, pos = _read_cstring(data, pos + 1)
+        if version == 4:
+            #address size and segment selector size
+            pos += 2
+        code_alignment_factor, pos = _read_uleb(data, pos)
+        data_alignment_factor, pos = _read_sleb(data, pos)
+        if version == 1:
+            return_address_register = ord(data[pos])
+            pos += 1
+        else:
+            return_address_register, pos = _read_uleb(data, pos)
+
+        fde_encoding = DW_EH_PE_absptr
+        if augmentation.startswith('z'):
+            augmentation_length, pos = _read_uleb(data, pos)
+            instructions_offset = pos + augmentation_length
+            for char in augmentation[1:]:
+                if char == 'R':
+                    fde_encoding = ord(data[pos])
+                    pos += 1
+                elif char == 'L':
+                    pos += 1
+                elif char == 'P':
+                    #Only skipped - the personality routine is not needed
+                    encoding = ord(data[pos]) & ~DW_EH_PE_indirect
+                    _, pos = read_encoded_pointer(data, pos + 1, encoding,
+                                                  self.byte_order,
+                                                  self.address_size,
+                                                  self.address)
+                elif char == 'S':
+                    continue
+                else:
+                    break
+            pos = instructions_offset
+        elif augmentation != '':
+            logging.warning('Unsupported CIE augmentation {0} at {1:#x}'\
+                            .format(augmentation, offset))
+
+        self._augmentations[offset] = (augmentation.startswith('z'),
+                                       fde_encoding)
+        header = dict(CIE_id=0, version=version, augmentation=augmentation,
+                      code_alignment_factor=code_alignment_factor,
+                      data_alignment_factor=data_alignment_factor,
+                      return_address_register=return_address_register)
+        return header, pos
+
+    def _parse_fde_header(self, cie, pos):
+        """Returns (header, instructions offset) of a FDE
+        """
+        has_augmentation_data, encoding = self._augmentations[cie.offset]
+        initial_location, pos = read_encoded_pointer(self.data, pos, encoding,
+                                                     self.byte_order,
+                                                     self.address_size,
+                                                     self.address)
+        address_range, pos = read_encoded_pointer(self.data, pos,
+                                                  encoding & 0x0f,
+                                                  self.byte_order,
+                                                  self.address_size,
+                                                  self.address)
+        if has_augmentation_data:
+            augmentation_length, pos = _read_uleb(self.data, pos)
+            pos += augmentation_length
+        header = dict(CIE_pointer=cie.offset,
+                      initial_location=initial_location,
+                      address_range=address_range)
+        return header, pos
+
+class EHFrameIndex():
+    """IP to .eh_frame FDE lookup
+       Uses the sorted table from .eh_frame_hdr when available, otherwise
+       all the FDEs are parsed once and sorted by initial location.
+       With pyelftools versions other than EH_FRAME_PARSER_VERSIONS the
+       FDEs are taken from the public DWARFInfo.EH_CFI_entries().
+    """
+    def __init__(self, elf_file):
+        self.elf_file = elf_file
+        self.eh_frame = None
+        self.starts = array('L')
+        self.fde_offsets = array('L')
+        self.fdes = None
+
+        section = elf_file.get_section_by_name('.eh_frame')
+        if section is None or section['sh_type'] == 'SHT_NOBITS':
+            return
+        if elftools.__version__ not in EH_FRAME_PARSER_VERSIONS:
+            self._load_public(elf_file)
+            return
+        self.eh_frame = EHFrameInfo(section.data(), section['sh_addr'],
+                                    elf_file.little_endian,
+                                    elf_file.elfclass // 8)
+
+        header = elf_file.get_section_by_name('.eh_frame_hdr')
+        if header is None or not self._load_header(header):
+            self._build_index()
+
+    def _load_header(self, section):
+        """Load the binary search table from .eh_frame_hdr
+        """
+        data = section.data()
+        address = section['sh_addr']
+        eh_frame = self.eh_frame
+        byte_order = eh_frame.byte_order
+        address_size = eh_frame.address_size
+        version, eh_frame_ptr_enc, fde_count_enc, table_enc = \
+                                        struct.unpack_from('4B', data, 0)
+        if version != 1 or fde_count_enc == DW_EH_PE_omit or \
+           table_enc != DW_EH_PE_datarel | DW_EH_PE_sdata4:
+            logging.info('.eh_frame_hdr has no usable search table')
+            return False
+
+        try:
+            _, offset = read_encoded_pointer(data, 4, eh_frame_ptr_enc,
+                                             byte_order, address_size,
+                                             address)
+            fde_count, offset = read_encoded_pointer(data, offset,
+                                                     fde_count_enc,
+                                                     byte_order,
+                                                     address_size, address)
+        except ValueError, e:
+            logging.info('.eh_frame_hdr is not usable: {0}'.format(e))
+            return False
+        table = array('i', data[offset:offset + fde_count * 8])
+        if (byte_order == '<') != (struct.pack('=H', 1) == '\x01\x00'):
+            table.byteswap()
+        address_mask = (1 << (address_size * 8)) - 1
+        self.starts = array('L', [(address + start) & address_mask
+                                  for start in table[0::2]])
+        self.fde_offsets = array('L', [address + fde - eh_frame.address
+                                       for fde in table[1::2]])
+        return True
+
+    def _load_public(self, elf_file):
+        """Sorted FDE table from the .eh_frame parser of pyelftools
+        """
+        if not hasattr(DWARFInfo, 'EH_CFI_entries'):
+            logging.error('.eh_frame is not supported with pyelftools {0}, '\
+                          'use {1} or a version with EH_CFI_entries'\
+                          .format(elftools.__version__,
+                                  '/'.join(EH_FRAME_PARSER_VERSIONS)))
+            return
+        dwarfinfo = elf_file.get_dwarf_info()
+        if not dwarfinfo.has_EH_CFI():
+            return
+        fdes = [(entry['initial_location'], entry)
+                for entry in dwarfinfo.EH_CFI_entries()
+                if isinstance(entry, FDE)]
+        fdes.sort(key=lambda fde: fde[0])
+        self.eh_frame = dwarfinfo
+        self.starts = array('L', [fde[0] for fde in fdes])
+        self.fdes = [fde[1] for fde in fdes]
+
+    def _build_index(self):
+        """Build the sorted FDE table by parsing the whole .eh_frame
+        """
+        fdes = [(entry['initial_location'], entry.offset)
+                for entry in self.eh_frame.get_entries()
+                if isinstance(entry, FDE)]
+        fdes.sort()
+        self.starts = array('L', [fde[0] for fde in fdes])
+        self.fde_offsets = array('L', [fde[1] for fde in fdes])
+
+    def find_fde(self, ip):
+        """Returns the FDE covering the ip or None
+        """
+        i = bisect.bisect_right(self.starts, ip) - 1
+        if i < 0:
+            return None
+        if self.fdes != None:
+            fde = self.fdes[i]
+        else:
+            fde = self.eh_frame._parse_entry_at(self.fde_offsets[i])
+        if ip >= fde['initial_location'] + fde['address_range']:
+            return None
+        if fde.instructions == None or fde.cie.instructions == None:
+            return None
+        return fde
@@ -27,31 +27,54 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import logging
-from elftools.dwarf.callframe import RegisterRule, CFARule
+import time
 from data_structures import PyCompileUnit
+from function_index import get_function_index
+from cu_ranges import get_cu_range_index
 from register_map import RegisterMap
+from dwarf_expression_decoder import get_function_frame_base
+from unwind_table import get_unwind_table, apply_program
+import shared
+
+#Why unwinding of a stack stopped
+STOP_OUTERMOST = 'outermost frame'
+STOP_NO_REGISTERS = 'no register information'
+STOP_NO_UNWIND_INFO = 'no CFI or frame pointer to unwind further'
+STOP_READ_ERROR = 'stack memory is not readable'
+STOP_CYCLE = 'previous frame identical to this frame (corrupt stack?)'
+STOP_CFA_NOT_MONOTONIC = 'previous frame inner to this frame (corrupt stack?)'
+STOP_CFA_OUTSIDE_STACK = 'frame address outside the stack (corrupt stack?)'
+STOP_MAX_DEPTH = 'maximum backtrace depth reached'
+STOP_TIME_BUDGET = 'unwind time budget exhausted'
 
 class Frames():
     """ Creates call Frames for a given register set
         It does that by unwinding the stack(start from registers->RIP, RS).
     """
     def __init__(self, sym_file, load_address_diff, symbols,
-                 registers, address_space):
+                 registers, address_space, max_depth=None, time_budget=None):
         self.sym_file = sym_file
         self.load_address_diff = load_address_diff
         self.registers = registers
         self.symbols = symbols
         self.address_space = address_space
+        self.max_depth = max_depth
+        if max_depth == None:
+            self.max_depth = shared.max_frame_depth
+        self.time_budget = time_budget
+        if time_budget == None:
+            self.time_budget = shared.unwind_time_budget
+        self.stop_reason = None
         self._frames = None
-        self.dwarfinfo = self.sym_file.get_dwarf_info()
+        self.dwarfinfo = None
 
-        #Log a warning if there is no debug_info section or debug_frame section
-        if self.dwarfinfo == None:
+        #Log a warning if there is no debug_info section or CFI section
+        if self.sym_file.has_dwarf_info():
+            self.dwarfinfo = self.sym_file.get_dwarf_info()
+        else:
             logging.warning('No debug info present in the file')
-            return
-        if not self.dwarfinfo.has_CFI():
+        if not get_unwind_table().has_unwind_info():
             logging.warning('No CFI section')
-            return
 
     def get_frames(self):
         """ Frames as list
@@ -62,12 +85,28 @@ class Frames():
         return self._frames
 
     def build_frames(self):
-        """Build frames by X86-64 specific CFI or stack walk
+        """Build all the frames of the stack
         """
+        self._frames = list(self.iter_frames())
+
+    def iter_frames(self):
+        """Yield frames one by one as they are unwound by X86-64 specific
+           CFI or stack walk. The frames are not kept - use get_frames()
+           for random access.
+           Unwinding stops on a repeated (CFA, IP) state, a CFA that moves
+           inwards or out of the stack mapping, max_depth frames or when
+           time_budget(seconds) is exhausted. The reason is recorded in
+           stop_reason of this object and of the last frame.
+        """
+        if self._frames != None:
+            for frame in self._frames:
+                yield frame
+            return
 
         registers = self.registers
         if registers == None:
             logging.warn('No register information')
+            self.stop_reason = STOP_NO_REGISTERS
             return
 
         register_map = RegisterMap('x86-64')
@@ -76,13 +115,38 @@ class Frames():
 
         reg_tab = register_map.create_register_table(registers)
 
-        self._frames = list()
+        stack = None
+        if hasattr(self.address_space, 'get_mapping'):
+            stack = self.address_space.get_mapping(reg_tab[sp_reg])
+        deadline = None
+        if self.time_budget:
+            deadline = time.time() + self.time_budget
+        seen = set()
+        depth = 0
+
         stack_walk = True
         while True:
             reg_tab[ra_reg] +=  self.load_address_diff
-            self._frames.append(Frame(reg_tab.copy(), register_map,
-                                      self.sym_file, self.symbols))
-            decoded_reg_tab = self._get_decoded_reg_tab(reg_tab, register_map)
+            frame = Frame(reg_tab.copy(), register_map, self.sym_file,
+                          self.symbols)
+            yield frame
+            depth += 1
+            cfa = reg_tab['cfa']
+
+            if depth >= self.max_depth:
+                reason = STOP_MAX_DEPTH
+                break
+            if deadline != None and time.time() > deadline:
+                reason = STOP_TIME_BUDGET
+                break
+
+            try:
+                decoded_reg_tab = self._get_decoded_reg_tab(reg_tab,
+                                                            register_map)
+            except ValueError:
+                logging.debug('Stack memory not readable')
+                reason = STOP_READ_ERROR
+                break
             if decoded_reg_tab != None:
                 reg_tab = decoded_reg_tab
                 #We got a CFI so no need for further stack walking
@@ -91,18 +155,40 @@ class Frames():
                 #Try stack walking (x86) if no CFI is not obtained so far
                 reg_tab = self._stack_walk(reg_tab, register_map)
                 if reg_tab == None:
+                    reason = STOP_NO_UNWIND_INFO
                     break
 
             if decoded_reg_tab == None and stack_walk == False:
                 #Both CFI and stack walk not possible
                 logging.info('No CFI or stack walk possible further')
+                reason = STOP_NO_UNWIND_INFO
                 break
 
             if reg_tab[ra_reg] <= 0L or reg_tab['pc'] <= 0L:
                 logging.debug('Invalid PC encountered')
+                reason = STOP_OUTERMOST
+                break
+
+            new_cfa = reg_tab['cfa']
+            state = (new_cfa, reg_tab[ra_reg])
+            if state in seen:
+                reason = STOP_CYCLE
+                break
+            seen.add(state)
+            if new_cfa < cfa:
+                reason = STOP_CFA_NOT_MONOTONIC
                 break
+            if stack != None and (new_cfa < stack[0] or new_cfa > stack[1]):
+                reason = STOP_CFA_OUTSIDE_STACK
+                break
+
+            reg_tab[sp_reg] = new_cfa
 
-            reg_tab[sp_reg] = reg_tab['cfa']
+        if reason != STOP_OUTERMOST:
+            logging.info('Backtrace stopped at frame {0}: {1}'\
+                         .format(depth - 1, reason))
+        self.stop_reason = reason
+        frame.stop_reason = reason
 
     def _stack_walk(self, reg_tab, register_map):
         """x86-64 specific stack walk
@@ -124,6 +210,8 @@ class Frames():
 
         reg_tab[ra_reg] = ra
         reg_tab[fp_reg] = new_rbp
+        #Caller's stack pointer after return
+        reg_tab['cfa'] = rbp + 16
 
         return reg_tab
        
@@ -131,73 +219,15 @@ class Frames():
         """Decode the register table for the given instruction pointer
         """
         ip = reg_tab[register_map.get_ra_register_number()]
-        fde = self.dwarfinfo.CFI_entry(ip)
-        if fde == None:
-            logging.info('No CFI entry for ip {ip:#x}'.format(ip=ip))
+        program = get_unwind_table().find_program(ip)
+        if program == None:
+            logging.info('No CFI rule for ip {ip:#x}'.format(ip=ip))
             return None
 
-        # Get decoded CFI entries for the given IP
-        fde_decoded = fde.get_decoded()
-
-        # walk through decoded rule table to find rule for the given ip
-        for index, rule in enumerate(fde_decoded):
-            #A single rule can be applicable to multiple consecutive IPs
-            
-            #start_ip - Rule's starting IP
-            start_ip = rule['pc']
-            #end_ip - Next rule's starting IP or last rule's IP
-            if index < len(fde_decoded) - 1:
-                end_ip = fde_decoded[index + 1]['pc'] - 1
-            else:
-                end_ip = fde['initial_location'] + fde['address_range']
-
-            logging.debug('CFI rule ip {ip:#x} {start:#x} {end:#x}'\
-                          .format(ip=ip, start=start_ip, end=end_ip))
+        apply_program(program, reg_tab, self.address_space)
+        reg_tab['pc'] = ip
 
-            #skip the rule if IP is not within the range
-            if ip >= start_ip and ip <= end_ip:
-                # decode the registers
-                for reg in rule:
-                    reg_tab[reg] = self._decode_reg(rule[reg], reg_tab)
-
-                reg_tab['pc'] = ip
-
-                return reg_tab
-
-        #No matching rule found
-        logging.warning('No matching CFI rule found for {0:#x}'.format(ip))
-
-    def _decode_reg(self, reg_rule, reg_tab):
-        """ Decodes the cfi rule and updates the reg_tab with values for 
-            corresponding registers
-        """
-        value = 0
-        #register rule
-        if type(reg_rule) is RegisterRule:
-            if reg_rule.type == RegisterRule.OFFSET:
-                address = reg_tab['cfa'] + reg_rule.arg
-                value = self.address_space.read_int64(address)
-            elif reg_rule.type == RegisterRule.VAL_OFFSET:
-                value = reg_tab['cfa'] + reg_rule.arg
-            elif reg_rule.type == RegisterRule.REGISTER:
-                value = reg_tab[reg_rule.arg]
-            elif reg_rule.type == RegisterRule.EXPRESSION:
-                address = reg_tab[reg_rule.arg]
-                value = self.address_space.read_int64(address)
-            elif reg_rule.type == RegisterRule.VAL_EXPRESSION:
-                value = reg_tab[reg_rule.arg]
-        #cfa rule
-        elif type(reg_rule) is CFARule:
-            if reg_rule.reg:
-                value = reg_tab[reg_rule.reg]
-            if reg_rule.offset:
-                value += reg_rule.offset
-            if reg_rule.expr:
-                value = reg_rule.expr
-        else:
-            value = reg_rule
-
-        return value
+        return reg_tab
 
     def __getitem__(self, key):
         return self.get_frames()[key]
@@ -221,13 +251,19 @@ class Frame():
         self.fn_die = None
         self.fn_pydie = None
         self.compile_unit = None
+        self.inline_frames = list()
+        self.stop_reason = None
+        self._pycu = None
+        self._frame_base = None
+        self._is_frame_base_decoded = False
+        self._arguments = None
 
         ra_reg = register_map.get_ra_register_number()
         sp_reg = register_map.get_sp_register_number()
 
         self.ip = registers[ra_reg]
         self.sp = registers[sp_reg]
-        self.line_program = self.line_entry = None
+        self.line_table = None
         logging.debug('Added ip {0:#x} sp {1:#x}'.format(self.ip, self.sp))
 
     def populate(self):
@@ -239,29 +275,70 @@ class Frame():
         if self.ip:
             self.function, self.offset = self.symbols.find_symbol(self.ip)
 
-        dwarf_info = self.sym_file.get_dwarf_info()
-        self.compile_unit = dwarf_info.get_cu_for_address(self.ip)
+        self.compile_unit = get_cu_range_index().get_cu(self.ip)
         self.fn_die = None
-        self.line_program = None
+        self.line_table = None
         if self.compile_unit:
-            self.line_program = dwarf_info.line_program_for_CU(self.compile_unit)
-            self.line_entry = self.line_program.get_entry(self.ip)
-            if self.line_entry and self.line_entry.state:
-                self.filename = self.line_entry.state.get_file_name()
-                self.line = self.line_entry.state.line
+            self.line_table = self.symbols.get_line_table(self.compile_unit)
+            row = self.line_table.lookup(self.ip) if self.line_table else -1
+            if row >= 0:
+                self.filename = self.line_table.get_file_name(
+                                                self.line_table.files[row])
+                self.line = self.line_table.lines[row]
             else:
                 #Top die contains the file name
                 top_die = self.compile_unit.get_top_DIE()
                 self.filename = top_die.attributes['DW_AT_name'].value
                 self.line = 0
 
-            self.fn_die = self.compile_unit.get_DIE_function(self.function)
+            function_index = get_function_index()
+            chain = function_index.lookup(self.ip)
+            if chain:
+                self.fn_die = function_index.get_die(*chain[0])
             if self.fn_die:
-                pycu = PyCompileUnit(self.compile_unit)
-                self.fn_pydie = pycu.get_pydie(self.fn_die)
+                self.fn_pydie = self.get_pycu().get_pydie(self.fn_die)
+            if len(chain) > 1:
+                self._populate_inline_frames(function_index, chain)
 
         self._is_populated = True
 
+    def get_pycu(self):
+        """ PyCompileUnit of the frame's compile unit - created once
+        """
+        if self._pycu == None and self.compile_unit:
+            self._pycu = PyCompileUnit(self.compile_unit)
+        return self._pycu
+
+    def get_frame_base(self):
+        """ DW_AT_frame_base of the function - decoded once per frame
+            It is always decoded against the process address space, so the
+            value is the same whichever address space the variables of the
+            frame are read from.
+        """
+        if not self._is_frame_base_decoded and self.fn_die:
+            self._frame_base = get_function_frame_base(self,
+                                                       shared.address_space)
+            self._is_frame_base_decoded = True
+        return self._frame_base
+
+    def get_arguments(self, address_space=None):
+        """ Returns FrameArguments - the arguments are decoded only when
+            it is formatted.
+        """
+        if self._arguments == None:
+            self._arguments = FrameArguments(self)
+        if address_space != None:
+            self._arguments.address_space = address_space
+        return self._arguments
+
+    def _populate_inline_frames(self, function_index, chain):
+        """Create virtual frames for inlined functions at this IP
+           This frame gets the call site of the outermost inlined function.
+        """
+        self.inline_frames, self.filename, self.line = \
+            function_index.get_inline_frames(chain, self.line_table,
+                                             self.filename, self.line)
+
     def __str__(self):
         if self.ip and self._is_populated:
             return "{name}+{offset:#x}".format(name=self.function,
@@ -269,3 +346,22 @@ class Frame():
         else:
             return "ip:{ip:#x} sp:{sp:#x}".format(ip=self.ip, sp=self.sp)
 
+class FrameArguments():
+    """ Arguments of a frame formatted as 'name = value, ...'
+        The arguments are decoded on the first str() and the text is kept;
+        the decoded PyDie values are shared by all the frames of a function
+        and are overwritten by the next frame(recursion) decoded.
+    """
+    def __init__(self, frame):
+        self.frame = frame
+        self.address_space = None
+        self._text = None
+
+    def __str__(self):
+        if self._text == None:
+            #debugger imports this module
+            from debugger import get_frame_args
+            frame_args = get_frame_args(self.frame, self.address_space)
+            self._text = ', '.join('{arg.name} = {arg.value}'.format(arg=arg)
+                                   for arg in frame_args or [])
+        return self._text
@@ -0,0 +1,185 @@
+"""
+function_index.py:
+    Address range index of all the functions(DW_TAG_subprogram) and
+    inlined functions(DW_TAG_inlined_subroutine) in the symbol file.
+    Maps an instruction pointer to the function DIE and the chain of
+    inlined functions at that address.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+from array import array
+from collections import namedtuple
+from name_index import index_dwarf, get_compile_unit
+from data_structures import PyCompileUnit
+import shared
+
+""" A virtual frame for a function inlined in to a real frame
+"""
+InlineFrame = namedtuple('InlineFrame', ['function', 'filename', 'line'])
+
+class _RangeLevel():
+    """Sorted, non overlapping address ranges at one nesting level
+       (functions, or inlined functions directly inside a function)
+    """
+    def __init__(self, ranges):
+        ranges.sort()
+        self.starts = array('L', [r[0] for r in ranges])
+        self.ends = array('L', [r[1] for r in ranges])
+        self.die_offsets = array('L', [r[2] for r in ranges])
+
+    def find(self, address):
+        """Returns offset of the DIE whose range contains the address or 0
+        """
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return self.die_offsets[i]
+        return 0
+
+class FunctionIndex():
+    """Interval index of function and inlined function address ranges
+       Functions are kept in one sorted level and inlined functions in a
+       level per enclosing function, so a lookup is a binary search per
+       inline depth.
+    """
+    CACHE_NAME = 'functions'
+    CACHE_VERSION = 1
+
+    def __init__(self, elf_file, index_cache=None, jobs=1):
+        self.elf_file = elf_file
+        columns = None
+        if index_cache:
+            columns = index_cache.load(self.CACHE_NAME, self.CACHE_VERSION)
+        if not columns:
+            columns = self._build_columns(elf_file, jobs)
+            if index_cache:
+                index_cache.store(self.CACHE_NAME, self.CACHE_VERSION,
+                                  columns)
+
+        low_pcs, high_pcs, die_offsets, parents, cu_offsets = columns
+        """DIE offset -> CU offset
+        """
+        self.cu_offsets = dict(zip(die_offsets, cu_offsets))
+
+        levels = dict()
+        for low_pc, high_pc, die_offset, parent in zip(low_pcs, high_pcs,
+                                                       die_offsets, parents):
+            if levels.has_key(parent):
+                levels[parent].append((low_pc, high_pc, die_offset))
+            else:
+                levels[parent] = [(low_pc, high_pc, die_offset)]
+        """Enclosing function DIE offset(0 for top level) -> _RangeLevel
+        """
+        self.levels = dict((parent, _RangeLevel(ranges))
+                           for parent, ranges in levels.iteritems())
+        self._function_names = dict()
+
+    def _build_columns(self, elf_file, jobs):
+        _, columns = index_dwarf(elf_file, jobs)
+        return columns
+
+    def lookup(self, address):
+        """Returns list of (CU offset, DIE offset) of the function containing
+           the address followed by the inlined functions, outermost first.
+           Returns empty list if no function contains the address.
+        """
+        chain = list()
+        level = self.levels.get(0)
+        while level:
+            die_offset = level.find(address)
+            if die_offset == 0:
+                break
+            chain.append((self.cu_offsets[die_offset], die_offset))
+            level = self.levels.get(die_offset)
+        return chain
+
+    def get_die(self, cu_offset, die_offset):
+        """Returns DIE at the given offset
+        """
+        cu = get_compile_unit(self.elf_file, cu_offset)
+        if cu == None:
+            return None
+        pydie = PyCompileUnit(cu).get_pydie_at_offset(die_offset)
+        return pydie.die if pydie else None
+
+    def get_function_name(self, cu_offset, die_offset):
+        """Returns name of the function DIE - follows abstract origin for
+           inlined and out of line instances
+        """
+        name = self._function_names.get(die_offset)
+        if name != None:
+            return name
+
+        name = '??'
+        die = self.get_die(cu_offset, die_offset)
+        for attr_name in ['DW_AT_abstract_origin', 'DW_AT_specification']:
+            if die == None or die.attributes.has_key('DW_AT_name'):
+                break
+            if not die.attributes.has_key(attr_name):
+                continue
+            attr = die.attributes[attr_name]
+            offset = attr.value
+            if attr.form != 'DW_FORM_ref_addr':
+                offset += die.cu.cu_offset
+            origin = self.get_die(die.cu.cu_offset, offset)
+            if origin:
+                die = origin
+        if die and die.attributes.has_key('DW_AT_name'):
+            name = die.attributes['DW_AT_name'].value
+
+        self._function_names[die_offset] = name
+        return name
+
+    def get_inline_frames(self, chain, line_table, filename, line):
+        """Returns (InlineFrame list, filename, line) for a lookup chain
+           filename and line are the line table location of the address.
+           The innermost inlined function gets that location, every other
+           function gets the call site of the function inlined in to it -
+           the returned filename and line are the call site in the
+           outermost function.
+        """
+        inline_frames = list()
+        for cu_offset, die_offset in reversed(chain[1:]):
+            die = self.get_die(cu_offset, die_offset)
+            if die == None:
+                continue
+            inline_frames.append(InlineFrame(
+                        self.get_function_name(cu_offset, die_offset),
+                        filename, line))
+            attr = die.attributes
+            if attr.has_key('DW_AT_call_file') and line_table:
+                filename = line_table.get_file_name(
+                                            attr['DW_AT_call_file'].value)
+            if attr.has_key('DW_AT_call_line'):
+                line = attr['DW_AT_call_line'].value
+        return inline_frames, filename, line
+
+def get_function_index():
+    """Returns function index of the symbol file being debugged
+    """
+    if shared.function_index == None:
+        shared.function_index = FunctionIndex(shared.symbol_file,
+                                              shared.index_cache, shared.jobs)
+    return shared.function_index
@@ -0,0 +1,322 @@
+"""
+index_cache.py:
+    Persistent on-disk cache for the indexes built from the symbol file
+    (symbol table, CU ranges, line tables, name index...). A warm start
+    loads them from the cache instead of parsing the ELF/DWARF sections.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from os import path
+
+""" File layout of a cached table(all integers are little endian)
+        header  - magic, format version, table version
+        records - one or more, each record is
+                    column count, payload size, payload crc32, payload
+        payload - columns one after another, each column is
+                    kind(1 byte), typecode(1 byte), padding(6 bytes),
+                    item count(8 bytes), items(padded to 8 bytes)
+                  The typecode is a fixed size struct code(b, B, h, H, i, I,
+                  q, Q) so the file does not depend on the word size of the
+                  machine. A string column is stored as a 'Q' array of end
+                  offsets followed by a blob of all the strings concatenated.
+    Every column starts at 8 byte boundary. The file is mmaped and each
+    column is copied once from the map in to its array - array can not use
+    the mapped memory in place.
+    A table is usually one record(store()); append() adds a record without
+    rewriting the earlier ones.
+"""
+CACHE_MAGIC = 'PYCDBIDX'
+CACHE_FORMAT_VERSION = 2
+_HEADER = struct.Struct('<8sII')
+_RECORD_HEADER = struct.Struct('<IQI4x')
+_COLUMN_HEADER = struct.Struct('<cc6xQ')
+_COLUMN_ARRAY = 'A'
+_COLUMN_STRINGS = 'S'
+
+#array typecode to the fixed size code it is stored as
+_STORED_CODES = {'b': 'b', 'B': 'B', 'h': 'h', 'H': 'H', 'i': 'i', 'I': 'I',
+                 'l': 'q', 'L': 'Q'}
+_CODE_SIZES = {'b': 1, 'B': 1, 'h': 2, 'H': 2, 'i': 4, 'I': 4, 'q': 8, 'Q': 8}
+
+def _get_array_typecode(code):
+    """ Returns array typecode whose items are of the size of the stored code
+        or the widest one if there is no such(8 bytes on 32 bit Python 2)
+    """
+    candidates = 'bhil' if code.islower() else 'BHIL'
+    for typecode in candidates:
+        if array(typecode).itemsize == _CODE_SIZES[code]:
+            return typecode
+    return candidates[-1]
+
+DEFAULT_CACHE_DIR = path.join(path.expanduser('~'), '.cache', 'pycdb')
+
+def _align(size):
+    return (size + 7) & ~7
+
+def _align4(size):
+    return (size + 3) & ~3
+
+def get_build_id(elf_file):
+    """Returns NT_GNU_BUILD_ID of the given elf file as hex string or None
+    """
+    section = elf_file.get_section_by_name('.note.gnu.build-id')
+    if section is None:
+        return None
+    data = section.data()
+    byte_order = '<' if elf_file.little_endian else '>'
+    offset = 0
+    while offset + 12 <= len(data):
+        namesz, descsz, n_type = struct.unpack_from(byte_order + 'III',
+                                                    data, offset)
+        offset += 12
+        name = data[offset:offset + namesz].rstrip('\0')
+        offset += _align4(namesz)
+        desc = data[offset:offset + descsz]
+        offset += _align4(descsz)
+        #NT_GNU_BUILD_ID
+        if name == 'GNU' and n_type == 3:
+            return desc.encode('hex')
+    return None
+
+class IndexCache():
+    """Cache directory for one symbol file.
+       Tables are stored under <cache_dir>/<key>/<table name>.idx where the
+       key is the build id of the file, or hash of path, size and mtime if
+       the file has no build id.
+    """
+    def __init__(self, elf_file, cache_dir=DEFAULT_CACHE_DIR):
+        self.elf_file = elf_file
+        self.key = self._get_key(elf_file)
+        self.directory = path.join(cache_dir, self.key)
+        #Tables with a corrupted record - appending to them would be lost
+        self._corrupted = set()
+
+    def _get_key(self, elf_file):
+        build_id = get_build_id(elf_file)
+        if build_id:
+            return build_id
+        file_path = path.realpath(elf_file.stream.name)
+        stat = os.stat(file_path)
+        key = '{0}:{1}:{2}'.format(file_path, stat.st_size, stat.st_mtime)
+        return 'path-' + hashlib.sha1(key).hexdigest()
+
+    def _table_path(self, name):
+        return path.join(self.directory, name + '.idx')
+
+    def load(self, name, version):
+        """Returns list of columns(array or list of strings) of the table
+           Returns None if the table is not cached, is of a different version
+           or is corrupted.
+        """
+        records = self.load_records(name, version)
+        return records[0] if records else None
+
+    def load_records(self, name, version):
+        """Returns list of records of the table - each is a list of columns
+           Returns None if the table is not cached, is of a different version
+           or is corrupted. A corrupted record(interrupted append) ends the
+           table.
+        """
+        file_path = self._table_path(name)
+        if not path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'rb') as cache_file:
+                data = mmap.mmap(cache_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            try:
+                return self._decode(data, version, name)
+            finally:
+                data.close()
+        except (IOError, OSError, ValueError, OverflowError,
+                struct.error) as e:
+            logging.warning('Ignoring index cache {0}: {1}'.format(file_path,
+                                                                   e))
+            return None
+
+    def _decode(self, data, version, name):
+        if len(data) < _HEADER.size:
+            raise ValueError('truncated header')
+        magic, fmt_version, tab_version = _HEADER.unpack_from(data, 0)
+        if magic != CACHE_MAGIC or fmt_version != CACHE_FORMAT_VERSION:
+            raise ValueError('unknown format')
+        if tab_version != version:
+            logging.info('Index cache version mismatch')
+            return None
+
+        records = list()
+        offset = _HEADER.size
+        while offset < len(data):
+            try:
+                if offset + _RECORD_HEADER.size > len(data):
+                    raise ValueError('truncated record')
+                count, size, crc = _RECORD_HEADER.unpack_from(data, offset)
+                offset += _RECORD_HEADER.size
+                #buffer() slices the map without copying
+                payload = buffer(data, offset, size)
+                if len(payload) != size or \
+                   (zlib.crc32(payload) & 0xFFFFFFFF) != crc:
+                    raise ValueError('checksum mismatch')
+            except ValueError as e:
+                logging.warning('Ignoring rest of index cache {0}: {1}'\
+                                .format(self._table_path(name), e))
+                self._corrupted.add(name)
+                break
+            records.append(self._decode_columns(payload, count))
+            offset += size
+        return records
+
+    def _decode_columns(self, payload, count):
+        columns = list()
+        offset = 0
+        for index in range(count):
+            kind, code, items = _COLUMN_HEADER.unpack_from(payload, offset)
+            offset += _COLUMN_HEADER.size
+            if kind == _COLUMN_ARRAY:
+                column, offset = self._decode_array(payload, offset, code,
+                                                    items)
+            elif kind == _COLUMN_STRINGS:
+                ends, offset = self._decode_array(payload, offset, code,
+                                                  items)
+                blob_size = ends[-1] if items else 0
+                blob = payload[offset:offset + blob_size]
+                column = list()
+                start = 0
+                for string_end in ends:
+                    column.append(blob[start:string_end])
+                    start = string_end
+                offset = _align(offset + blob_size)
+            else:
+                raise ValueError('unknown column')
+            columns.append(column)
+        return columns
+
+    def _decode_array(self, payload, offset, code, items):
+        """Returns (array, offset of the next column) of the stored items
+        """
+        if not _CODE_SIZES.has_key(code):
+            raise ValueError('unknown typecode')
+        end = offset + items * _CODE_SIZES[code]
+        if end > len(payload):
+            raise ValueError('truncated column')
+        typecode = _get_array_typecode(code)
+        column = array(typecode)
+        if column.itemsize == _CODE_SIZES[code]:
+            column.fromstring(buffer(payload, offset, end - offset))
+            if sys.byteorder != 'little':
+                column.byteswap()
+        else:
+            column.extend(struct.unpack_from('<{0}{1}'.format(items, code),
+                                             payload, offset))
+        return column, _align(end)
+
+    def _encode_array(self, kind, column):
+        """Returns column header and items of the array in stored form
+        """
+        code = _STORED_CODES[column.typecode]
+        if column.itemsize == _CODE_SIZES[code] and \
+           sys.byteorder == 'little':
+            raw = column.tostring()
+        else:
+            raw = struct.pack('<{0}{1}'.format(len(column), code), *column)
+        return [_COLUMN_HEADER.pack(kind, code, len(column)),
+                raw.ljust(_align(len(raw)), '\0')]
+
+    def _encode(self, columns):
+        """Returns the columns as one record
+        """
+        chunks = list()
+        for column in columns:
+            if isinstance(column, array):
+                chunks.extend(self._encode_array(_COLUMN_ARRAY, column))
+            else:
+                ends = array('L')
+                total = 0
+                for string in column:
+                    total += len(string)
+                    ends.append(total)
+                blob = ''.join(column)
+                chunks.extend(self._encode_array(_COLUMN_STRINGS, ends))
+                chunks.append(blob.ljust(_align(len(blob)), '\0'))
+        payload = ''.join(chunks)
+        return _RECORD_HEADER.pack(len(columns), len(payload),
+                                   zlib.crc32(payload) & 0xFFFFFFFF) + payload
+
+    def _is_appendable(self, file_path, version):
+        """Whether the file has the header of this format and table version
+        """
+        try:
+            with open(file_path, 'rb') as cache_file:
+                header = cache_file.read(_HEADER.size)
+        except (IOError, OSError):
+            return False
+        return len(header) == _HEADER.size and \
+               _HEADER.unpack(header) == (CACHE_MAGIC, CACHE_FORMAT_VERSION,
+                                          version)
+
+    def append(self, name, version, columns):
+        """Add the columns as a new record of the table
+           The existing records are not rewritten; a table of another
+           version or with a corrupted record is replaced.
+        """
+        file_path = self._table_path(name)
+        if name in self._corrupted or \
+           not self._is_appendable(file_path, version):
+            self._corrupted.discard(name)
+            self.store(name, version, columns)
+            return
+        try:
+            #One write so that concurrent appends do not interleave
+            with open(file_path, 'ab') as cache_file:
+                cache_file.write(self._encode(columns))
+        except (IOError, OSError) as e:
+            logging.warning('Unable to write index cache: {0}'.format(e))
+
+    def store(self, name, version, columns):
+        """Write the columns(arrays or lists of strings) of the table
+        """
+        header = _HEADER.pack(CACHE_MAGIC, CACHE_FORMAT_VERSION, version)
+        record = self._encode(columns)
+        try:
+            if not path.isdir(self.directory):
+                os.makedirs(self.directory)
+            #Write to a temporary file and rename so that readers never see
+            #partially written table
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(header)
+                cache_file.write(record)
+            os.rename(tmp_path, self._table_path(name))
+        except (IOError, OSError) as e:
+            logging.warning('Unable to write index cache: {0}'.format(e))
@@ -0,0 +1,259 @@
+"""
+location_lists.py:
+    Location lists decoded once in to sorted address ranges with the
+    compiled expression of each range. Lists are shared by all the frames
+    and threads referring to them.
+    Both .debug_loc(DWARF 2-4) and .debug_loclists(DWARF 5) are supported.
+
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+import logging
+import struct
+from array import array
+from name_index import _read_uleb
+from dwarf_expression_decoder import compile_expression
+import shared
+
+#Forms referring to a location list instead of holding an expression
+LOCATION_LIST_FORMS = ('DW_FORM_data4', 'DW_FORM_data8', 'DW_FORM_sec_offset',
+                       'DW_FORM_loclistx')
+
+#DWARF 5 location list entry kinds
+DW_LLE_end_of_list = 0x00
+DW_LLE_base_addressx = 0x01
+DW_LLE_startx_endx = 0x02
+DW_LLE_startx_length = 0x03
+DW_LLE_offset_pair = 0x04
+DW_LLE_default_location = 0x05
+DW_LLE_base_address = 0x06
+DW_LLE_start_end = 0x07
+DW_LLE_start_length = 0x08
+
+def is_location_list(attr):
+    """ Whether the attribute refers to a location list
+    """
+    return attr.form in LOCATION_LIST_FORMS
+
+class LocationList():
+    """ A decoded location list
+        starts, ends - sorted address ranges
+        programs     - compiled expression of each range
+        default      - compiled DW_LLE_default_location expression or None
+    """
+    def __init__(self, entries, default, structs):
+        entries.sort(key=lambda entry: entry[0])
+        self.starts = array('L', [entry[0] for entry in entries])
+        self.ends = array('L', [entry[1] for entry in entries])
+        self.programs = [compile_expression(entry[2], structs)
+                         for entry in entries]
+        self.default = None
+        if default != None:
+            self.default = compile_expression(default, structs)
+
+    def lookup(self, address):
+        """ Returns compiled expression valid at the address or None
+        """
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return self.programs[i]
+        return self.default
+
+class LocationListIndex():
+    """ Cache of decoded location lists of a symbol file
+    """
+    def __init__(self, elf_file):
+        self.elf_file = elf_file
+        self.byte_order = '<' if elf_file.little_endian else '>'
+        self._sections = dict()
+        self._lists = dict()
+
+    def _get_section_data(self, name):
+        if not self._sections.has_key(name):
+            section = self.elf_file.get_section_by_name(name)
+            self._sections[name] = None if section is None else section.data()
+        return self._sections[name]
+
+    def _read_address(self, data, offset, address_size):
+        code = 'Q' if address_size == 8 else 'I'
+        return struct.unpack_from(self.byte_order + code, data, offset)[0]
+
+    def get_location_list(self, die, attr):
+        """ Returns LocationList referred by the attribute of the DIE
+        """
+        cu = die.cu
+        top_die = cu.get_top_DIE()
+        base_address = 0
+        if top_die.attributes.has_key('DW_AT_low_pc'):
+            base_address = top_die.attributes['DW_AT_low_pc'].value
+
+        if cu['version'] >= 5:
+            section = '.debug_loclists'
+            offset = self._get_loclists_offset(top_die, attr, cu)
+        else:
+            section = '.debug_loc'
+            offset = attr.value
+
+        key = (section, offset, base_address)
+        location_list = self._lists.get(key)
+        if location_list == None:
+            if section == '.debug_loc':
+                entries, default = self._decode_loc(offset, base_address,
+                                                    cu['address_size'])
+            else:
+                entries, default = self._decode_loclists(offset, base_address,
+                                                         cu, top_die)
+            location_list = LocationList(entries, default,
+                                         cu.dwarfinfo.structs)
+            self._lists[key] = location_list
+        return location_list
+
+    def _get_loclists_offset(self, top_die, attr, cu):
+        """ Section offset of a DWARF 5 location list
+            DW_FORM_loclistx is an index in to the offset table that starts
+            at DW_AT_loclists_base of the CU.
+        """
+        if attr.form != 'DW_FORM_loclistx':
+            return attr.value
+        base = 0
+        if top_die.attributes.has_key('DW_AT_loclists_base'):
+            base = top_die.attributes['DW_AT_loclists_base'].value
+        data = self._get_section_data('.debug_loclists')
+        offset_size = 8 if cu.dwarf_format() == 64 else 4
+        code = 'Q' if offset_size == 8 else 'I'
+        entry = struct.unpack_from(self.byte_order + code, data,
+                                   base + attr.value * offset_size)[0]
+        return base + entry
+
+    def _decode_loc(self, offset, base_address, address_size):
+        """ Decode a .debug_loc list - returns (entries, None)
+        """
+        data = self._get_section_data('.debug_loc')
+        entries = list()
+        if data == None:
+            logging.error('No .debug_loc section')
+            return entries, None
+        max_address = (1 << (address_size * 8)) - 1
+        while offset < len(data):
+            start = self._read_address(data, offset, address_size)
+            end = self._read_address(data, offset + address_size,
+                                     address_size)
+            offset += 2 * address_size
+            if start == 0 and end == 0:
+                break
+            if start == max_address:
+                #Base address selection entry
+                base_address = end
+                continue
+            length = struct.unpack_from(self.byte_order + 'H', data,
+                                        offset)[0]
+            offset += 2
+            expr = [ord(c) for c in data[offset:offset + length]]
+            offset += length
+            entries.append((base_address + start, base_address + end, expr))
+        return entries, None
+
+    def _read_indexed_address(self, top_die, index, address_size):
+        """ Address from .debug_addr for DW_LLE_*x entries
+        """
+        base = 0
+        if top_die.attributes.has_key('DW_AT_addr_base'):
+            base = top_die.attributes['DW_AT_addr_base'].value
+        data = self._get_section_data('.debug_addr')
+        return self._read_address(data, base + index * address_size,
+                                  address_size)
+
+    def _decode_loclists(self, offset, base_address, cu, top_die):
+        """ Decode a .debug_loclists list - returns (entries, default)
+        """
+        data = self._get_section_data('.debug_loclists')
+        entries = list()
+        default = None
+        if data == None:
+            logging.error('No .debug_loclists section')
+            return entries, default
+        address_size = cu['address_size']
+        while offset < len(data):
+            kind = ord(data[offset])
+            offset += 1
+            start = end = None
+            if kind == DW_LLE_end_of_list:
+                break
+            elif kind == DW_LLE_base_addressx:
+                index, offset = _read_uleb(data, offset)
+                base_address = self._read_indexed_address(top_die, index,
+                                                          address_size)
+                continue
+            elif kind == DW_LLE_base_address:
+                base_address = self._read_address(data, offset, address_size)
+                offset += address_size
+                continue
+            elif kind == DW_LLE_startx_endx:
+                start, offset = _read_uleb(data, offset)
+                end, offset = _read_uleb(data, offset)
+                start = self._read_indexed_address(top_die, start,
+                                                   address_size)
+                end = self._read_indexed_address(top_die, end, address_size)
+            elif kind == DW_LLE_startx_length:
+                start, offset = _read_uleb(data, offset)
+                length, offset = _read_uleb(data, offset)
+                start = self._read_indexed_address(top_die, start,
+                                                   address_size)
+                end = start + length
+            elif kind == DW_LLE_offset_pair:
+                start, offset = _read_uleb(data, offset)
+                end, offset = _read_uleb(data, offset)
+                start += base_address
+                end += base_address
+            elif kind == DW_LLE_start_end:
+                start = self._read_address(data, offset, address_size)
+                end = self._read_address(data, offset + address_size,
+                                         address_size)
+                offset += 2 * address_size
+            elif kind == DW_LLE_start_length:
+                start = self._read_address(data, offset, address_size)
+                length, offset = _read_uleb(data, offset + address_size)
+                end = start + length
+            elif kind != DW_LLE_default_location:
+                logging.error('Unknown location list entry {0:#x}'\
+                              .format(kind))
+                break
+
+            length, offset = _read_uleb(data, offset)
+            expr = [ord(c) for c in data[offset:offset + length]]
+            offset += length
+            if kind == DW_LLE_default_location:
+                default = expr
+            else:
+                entries.append((start, end, expr))
+        return entries, default
+
+def get_location_list_index():
+    """ Returns location list index of the symbol file being debugged
+    """
+    if shared.location_lists == None:
+        shared.location_lists = LocationListIndex(shared.symbol_file)
+    return shared.location_lists
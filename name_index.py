@@ -0,0 +1,529 @@
+"""
+name_index.py:
+    Global name(type, variable, function) to DIE index.
+    Uses the accelerator tables produced by compilers and linkers
+    (.debug_names, .gdb_index, .debug_pubnames/.debug_pubtypes) to locate
+    the compilation unit and DIE of a name without parsing all the CUs.
+    Names missing from those tables are served by an index built once from
+    all the DIEs and kept in the index cache.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+import multiprocessing
+import struct
+from array import array
+from collections import namedtuple
+from elftools.elf.elffile import ELFFile
+import shared
+
+#DIE offset is not known(.gdb_index gives only the CU)
+UNKNOWN_DIE = 0
+
+#DWARF5 .debug_names index attributes
+DW_IDX_compile_unit = 1
+DW_IDX_die_offset = 3
+
+#Size of fixed size DWARF forms(used by .debug_names entries)
+_FORM_SIZES = {0x0b: 1, 0x05: 2, 0x06: 4, 0x07: 8, 0x11: 1, 0x12: 2,
+               0x13: 4, 0x14: 8, 0x0c: 1, 0x19: 0, 0x1e: 16}
+#Forms encoded as ULEB128 - DW_FORM_udata and DW_FORM_ref_udata
+_FORM_ULEB = (0x0f, 0x15)
+
+"""Compact index of one compilation unit produced by index_compile_unit()
+    names        - name of each named DIE
+    die_offsets  - offset of each named DIE(parallel to names)
+    ranges       - (low pc, high pc, DIE offset, enclosing function DIE
+                   offset or 0) of each subprogram and inlined subroutine
+                   address range flattened into one array
+"""
+CUIndex = namedtuple('CUIndex', ['cu_offset', 'names', 'die_offsets',
+                                 'ranges'])
+
+FUNCTION_TAGS = ('DW_TAG_subprogram', 'DW_TAG_inlined_subroutine')
+
+def _get_high_pc(attr, low_pc):
+    """Returns DW_AT_high_pc as address(DWARF4 allows it as offset)
+    """
+    high_pc = attr['DW_AT_high_pc']
+    if high_pc.form == 'DW_FORM_addr':
+        return high_pc.value
+    return low_pc + high_pc.value
+
+def get_die_ranges(die, base_address=0):
+    """Returns list of (low pc, high pc) covered by the DIE
+       from DW_AT_low_pc/DW_AT_high_pc or DW_AT_ranges
+    """
+    attr = die.attributes
+    if attr.has_key('DW_AT_low_pc') and attr.has_key('DW_AT_high_pc'):
+        low_pc = attr['DW_AT_low_pc'].value
+        return [(low_pc, _get_high_pc(attr, low_pc))]
+    if not attr.has_key('DW_AT_ranges'):
+        return []
+
+    range_lists = die.dwarfinfo.range_lists()
+    if range_lists == None:
+        return []
+    result = list()
+    for entry in range_lists.get_range_list_at_offset(
+                                            attr['DW_AT_ranges'].value):
+        if hasattr(entry, 'base_address'):
+            base_address = entry.base_address
+        elif entry.begin_offset < entry.end_offset:
+            result.append((base_address + entry.begin_offset,
+                           base_address + entry.end_offset))
+    return result
+
+def index_compile_unit(cu):
+    """Returns CUIndex of the given compilation unit
+    """
+    cu_index = CUIndex(cu.cu_offset, list(), array('L'), array('L'))
+    top_die = cu.get_top_DIE()
+    base_address = 0
+    if top_die.attributes.has_key('DW_AT_low_pc'):
+        base_address = top_die.attributes['DW_AT_low_pc'].value
+    _index_die_children(cu_index, top_die, 0, base_address)
+    return cu_index
+
+def _index_die_children(cu_index, die, function_offset, base_address):
+    """Add children of the die to the CUIndex(recursively)
+       function_offset is the offset of the innermost enclosing function
+    """
+    for child in die.iter_children():
+        attr = child.attributes
+        if attr == None or len(attr) == 0:
+            continue
+        if attr.has_key('DW_AT_name'):
+            cu_index.names.append(attr['DW_AT_name'].value)
+            cu_index.die_offsets.append(child.offset)
+
+        child_function = function_offset
+        if child.tag in FUNCTION_TAGS:
+            ranges = get_die_ranges(child, base_address)
+            for low_pc, high_pc in ranges:
+                cu_index.ranges.extend([low_pc, high_pc, child.offset,
+                                        function_offset])
+            if ranges:
+                child_function = child.offset
+
+        _index_die_children(cu_index, child, child_function, base_address)
+
+#elf file -> DWARFInfo used by get_compile_unit()
+_dwarf_infos = dict()
+#(elf file, CU offset) -> CompileUnit shared by all the indexes
+_compile_units = dict()
+
+def _get_dwarf_info(elf_file):
+    dwarfinfo = _dwarf_infos.get(elf_file)
+    if dwarfinfo == None:
+        dwarfinfo = elf_file.get_dwarf_info()
+        _dwarf_infos[elf_file] = dwarfinfo
+    return dwarfinfo
+
+def get_compile_unit(elf_file, cu_offset):
+    """Returns CompileUnit at the given offset of .debug_info or None
+       Only the header of that CU is parsed(DWARFInfo.get_CU_at); pyelftools
+       versions without it parse all the CU headers once. The object is
+       shared so that the DIEs of a CU are parsed only once.
+    """
+    key = (elf_file, cu_offset)
+    cu = _compile_units.get(key)
+    if cu != None:
+        return cu
+    dwarfinfo = _get_dwarf_info(elf_file)
+    if cu_offset >= dwarfinfo.debug_info_sec.size:
+        return None
+    if hasattr(dwarfinfo, 'get_CU_at'):
+        cu = dwarfinfo.get_CU_at(cu_offset)
+        _compile_units[key] = cu
+        return cu
+    for cu in dwarfinfo.iter_CUs():
+        _compile_units.setdefault((elf_file, cu.cu_offset), cu)
+    return _compile_units.get(key)
+
+def get_cu_offsets(elf_file):
+    """Returns offsets of all the CU headers in .debug_info
+       Only the unit lengths are read - the CUs are not parsed.
+    """
+    section = _get_dwarf_info(elf_file).debug_info_sec
+    byte_order = '<' if elf_file.little_endian else '>'
+    cu_offsets = list()
+    offset = 0
+    while offset + 4 <= section.size:
+        section.stream.seek(offset)
+        header = section.stream.read(12)
+        length, _, end = _read_initial_length(header.ljust(12, '\0'), 0,
+                                              byte_order)
+        cu_offsets.append(offset)
+        offset += end + length
+    return cu_offsets
+
+_worker_cus = None
+
+def _init_worker(file_path):
+    """Pool initializer - each worker opens its own copy of the symbol file
+       since file position can not be shared between processes.
+    """
+    global _worker_cus
+    dwarfinfo = ELFFile(open(file_path, 'rb')).get_dwarf_info()
+    _worker_cus = dict((cu.cu_offset, cu) for cu in dwarfinfo.iter_CUs())
+
+def _index_compile_units(cu_offsets):
+    """Pool worker - returns CUIndex for each of the given CU offsets
+    """
+    return [index_compile_unit(_worker_cus[offset]) for offset in cu_offsets]
+
+def build_cu_indexes(elf_file, jobs=1):
+    """Returns CUIndex of all the compilation units in the elf file.
+       If jobs is more than 1, the CUs are split across a process pool.
+    """
+    cus = list(elf_file.get_dwarf_info().iter_CUs())
+    if jobs <= 1 or len(cus) < 2:
+        return [index_compile_unit(cu) for cu in cus]
+
+    #Hand out CUs in small chunks so that big CUs do not stall a worker
+    offsets = [cu.cu_offset for cu in cus]
+    chunk_count = jobs * 8
+    chunks = [offsets[i::chunk_count] for i in range(chunk_count)]
+    pool = multiprocessing.Pool(jobs, _init_worker, (elf_file.stream.name,))
+    try:
+        results = pool.map(_index_compile_units, [c for c in chunks if c])
+    finally:
+        pool.close()
+        pool.join()
+    #Chunks are interleaved - return the CUs in the order of the serial path
+    cu_indexes = dict((cu_index.cu_offset, cu_index)
+                      for chunk in results for cu_index in chunk)
+    return [cu_indexes[offset] for offset in offsets]
+
+#elf file -> (names, function ranges) from index_dwarf()
+_dwarf_indexes = dict()
+
+def index_dwarf(elf_file, jobs=1):
+    """Returns (names, function ranges) of all the compilation units.
+       names is name -> list of (CU offset, DIE offset) and function ranges
+       is columns of low pc, high pc, DIE offset, enclosing function DIE
+       offset and CU offset.
+       The DIEs are walked only once per elf file; both the name index and
+       the function index are built from the result.
+    """
+    result = _dwarf_indexes.get(elf_file)
+    if result != None:
+        return result
+
+    names = dict()
+    ranges = [array('L'), array('L'), array('L'), array('L'), array('L')]
+    for cu_index in build_cu_indexes(elf_file, jobs):
+        cu_offset = cu_index.cu_offset
+        for name, die_offset in zip(cu_index.names, cu_index.die_offsets):
+            if names.has_key(name):
+                names[name].append((cu_offset, die_offset))
+            else:
+                names[name] = [(cu_offset, die_offset)]
+        cu_ranges = cu_index.ranges
+        for i in range(0, len(cu_ranges), 4):
+            for column, value in zip(ranges, cu_ranges[i:i + 4]):
+                column.append(value)
+            ranges[4].append(cu_offset)
+
+    result = (names, ranges)
+    _dwarf_indexes[elf_file] = result
+    return result
+
+def _read_uleb(data, offset):
+    """Returns (value, new offset) of the ULEB128 at the given offset
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            return value, offset
+
+def _read_cstring(data, offset):
+    """Returns (string, new offset) of NUL terminated string at offset
+    """
+    end = data.index('\0', offset)
+    return data[offset:end], end + 1
+
+def _read_initial_length(data, offset, byte_order):
+    """Returns (unit length, offset size, new offset) of a DWARF unit header
+    """
+    length = struct.unpack_from(byte_order + 'I', data, offset)[0]
+    if length == 0xffffffff:
+        length = struct.unpack_from(byte_order + 'Q', data, offset + 4)[0]
+        return length, 8, offset + 12
+    return length, 4, offset + 4
+
+#Accelerator tables which list every named DIE(statics too)
+_COMPLETE_SOURCES = ['.debug_names', '.gdb_index']
+
+class NameIndex():
+    """Name to list of (CU offset, DIE offset) index
+    """
+    CACHE_NAME = 'names'
+    CACHE_VERSION = 2
+
+    def __init__(self, elf_file, index_cache=None, jobs=1):
+        self.elf_file = elf_file
+        self.jobs = jobs
+        self.dwarfinfo = elf_file.get_dwarf_info()
+        self.index_cache = index_cache
+        self.byte_order = '<' if elf_file.little_endian else '>'
+
+        """name -> list of (cu offset, die offset) from accelerator tables
+        """
+        self.names = dict()
+        self.source = None
+        self._full_index = None
+
+        for source, parser in [('.debug_names', self._parse_debug_names),
+                               ('.gdb_index', self._parse_gdb_index),
+                               ('.debug_pubnames', self._parse_pubnames),
+                               ('.debug_pubtypes', self._parse_pubnames)]:
+            section = elf_file.get_section_by_name(source)
+            if section is None:
+                continue
+            try:
+                parser(section.data())
+            except (struct.error, IndexError, ValueError) as e:
+                logging.warning('Unable to parse {0}: {1}'.format(source, e))
+                continue
+            if self.source == None:
+                self.source = source
+            if source != '.debug_pubnames':
+                #pubtypes complements pubnames, others are complete
+                break
+        logging.info('Name index source {0}'.format(self.source))
+
+    def _add(self, name, cu_offset, die_offset):
+        entry = (cu_offset, die_offset)
+        if self.names.has_key(name):
+            if entry not in self.names[name]:
+                self.names[name].append(entry)
+        else:
+            self.names[name] = [entry]
+
+    def _parse_pubnames(self, data):
+        """Parse .debug_pubnames or .debug_pubtypes
+        """
+        bo = self.byte_order
+        offset = 0
+        while offset < len(data):
+            length, offset_size, offset = _read_initial_length(data, offset,
+                                                               bo)
+            end = offset + length
+            fmt = bo + ('I' if offset_size == 4 else 'Q')
+            #skip version
+            offset += 2
+            cu_offset = struct.unpack_from(fmt, data, offset)[0]
+            #skip debug_info_length
+            offset += 2 * offset_size
+            while offset < end:
+                die_offset = struct.unpack_from(fmt, data, offset)[0]
+                offset += offset_size
+                if die_offset == 0:
+                    break
+                name, offset = _read_cstring(data, offset)
+                self._add(name, cu_offset, cu_offset + die_offset)
+            offset = end
+
+    def _parse_gdb_index(self, data):
+        """Parse .gdb_index(version 7 and later). This gives only the CU.
+        """
+        version, cu_list, types_list, address_area, symbol_table, \
+            constant_pool = struct.unpack_from('<6I', data, 0)
+        if version < 7:
+            raise ValueError('unsupported .gdb_index version %d' % version)
+        cu_offsets = [struct.unpack_from('<Q', data, cu_list + i * 16)[0]
+                      for i in range((types_list - cu_list) // 16)]
+        for slot in range(symbol_table, constant_pool, 8):
+            name_offset, vector_offset = struct.unpack_from('<II', data, slot)
+            if name_offset == 0 and vector_offset == 0:
+                continue
+            name, _ = _read_cstring(data, constant_pool + name_offset)
+            vector = constant_pool + vector_offset
+            count = struct.unpack_from('<I', data, vector)[0]
+            for value in struct.unpack_from('<%dI' % count, data, vector + 4):
+                cu_index = value & 0xffffff
+                #type units are numbered after the CUs - skip them
+                if cu_index < len(cu_offsets):
+                    self._add(name, cu_offsets[cu_index], UNKNOWN_DIE)
+
+    def _parse_debug_names(self, data):
+        """Parse DWARF5 .debug_names
+        """
+        bo = self.byte_order
+        str_section = self.elf_file.get_section_by_name('.debug_str')
+        strings = str_section.data() if str_section is not None else ''
+        offset = 0
+        while offset < len(data):
+            length, offset_size, offset = _read_initial_length(data, offset,
+                                                               bo)
+            end = offset + length
+            ofmt = bo + ('I' if offset_size == 4 else 'Q')
+            cu_count, ltu_count, ftu_count, bucket_count, name_count, \
+                abbrev_size, aug_size = struct.unpack_from(bo + '7I', data,
+                                                           offset + 4)
+            offset += 4 + 7 * 4 + ((aug_size + 3) & ~3)
+
+            cu_offsets = [struct.unpack_from(ofmt, data,
+                                             offset + i * offset_size)[0]
+                          for i in range(cu_count)]
+            offset += (cu_count + ltu_count) * offset_size + ftu_count * 8
+            offset += bucket_count * 4
+            if bucket_count:
+                offset += name_count * 4
+            string_offsets = offset
+            entry_offsets = string_offsets + name_count * offset_size
+            abbrev_table = entry_offsets + name_count * offset_size
+            entry_pool = abbrev_table + abbrev_size
+
+            abbrevs = self._parse_debug_names_abbrevs(data, abbrev_table,
+                                                      entry_pool)
+            for i in range(name_count):
+                str_offset = struct.unpack_from(ofmt, data,
+                                    string_offsets + i * offset_size)[0]
+                name, _ = _read_cstring(strings, str_offset)
+                entry = entry_pool + struct.unpack_from(ofmt, data,
+                                    entry_offsets + i * offset_size)[0]
+                while True:
+                    code, entry = _read_uleb(data, entry)
+                    if code == 0:
+                        break
+                    cu_index = 0
+                    die_offset = None
+                    for idx, form in abbrevs[code]:
+                        if form in _FORM_ULEB:
+                            value, entry = _read_uleb(data, entry)
+                        else:
+                            size = _FORM_SIZES[form]
+                            value = 0
+                            if size in (1, 2, 4, 8):
+                                value = struct.unpack_from(bo + \
+                                    {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[size],
+                                    data, entry)[0]
+                            entry += size
+                        if idx == DW_IDX_compile_unit:
+                            cu_index = value
+                        elif idx == DW_IDX_die_offset:
+                            die_offset = value
+                    if die_offset != None and cu_index < len(cu_offsets):
+                        cu_offset = cu_offsets[cu_index]
+                        self._add(name, cu_offset, cu_offset + die_offset)
+            offset = end
+
+    def _parse_debug_names_abbrevs(self, data, offset, end):
+        """Returns abbrev code -> list of (index attribute, form)
+        """
+        abbrevs = dict()
+        while offset < end:
+            code, offset = _read_uleb(data, offset)
+            if code == 0:
+                break
+            tag, offset = _read_uleb(data, offset)
+            attributes = list()
+            while True:
+                idx, offset = _read_uleb(data, offset)
+                form, offset = _read_uleb(data, offset)
+                if idx == 0 and form == 0:
+                    break
+                attributes.append((idx, form))
+            abbrevs[code] = attributes
+        return abbrevs
+
+    def _get_full_index(self):
+        """Returns name index of all the named DIEs in all the CUs.
+           It is built only once and stored in the index cache.
+        """
+        if self._full_index != None:
+            return self._full_index
+
+        cache = self.index_cache
+        if cache:
+            columns = cache.load(self.CACHE_NAME, self.CACHE_VERSION)
+            if columns:
+                self._full_index = self._from_columns(columns)
+                return self._full_index
+
+        names, _ = index_dwarf(self.elf_file, self.jobs)
+        self._full_index = names
+
+        if cache:
+            cache.store(self.CACHE_NAME, self.CACHE_VERSION,
+                        self._to_columns(names))
+        return self._full_index
+
+    def _to_columns(self, names):
+        name_list = list()
+        cu_offsets = array('L')
+        die_offsets = array('L')
+        for name, entries in names.iteritems():
+            for cu_offset, die_offset in entries:
+                name_list.append(name)
+                cu_offsets.append(cu_offset)
+                die_offsets.append(die_offset)
+        return [name_list, cu_offsets, die_offsets]
+
+    def _from_columns(self, columns):
+        names = dict()
+        for name, cu_offset, die_offset in zip(*columns):
+            if names.has_key(name):
+                names[name].append((cu_offset, die_offset))
+            else:
+                names[name] = [(cu_offset, die_offset)]
+        return names
+
+    def lookup(self, name):
+        """Returns list of (CU offset, DIE offset) for the given name
+           DIE offset is UNKNOWN_DIE if only the CU is known.
+           .debug_pubnames/.debug_pubtypes list only external names, so
+           with them the entries of the full index(static functions,
+           variables and types of every CU) are returned too.
+        """
+        entries = self.names.get(name)
+        if entries and self.source in _COMPLETE_SOURCES:
+            return entries
+        entries = list(entries or [])
+        for entry in self._get_full_index().get(name, []):
+            if entry not in entries:
+                entries.append(entry)
+        return entries
+
+    def get_cu(self, cu_offset):
+        """Returns CompileUnit at the given offset
+        """
+        return get_compile_unit(self.elf_file, cu_offset)
+
+def get_name_index():
+    """Returns name index of the symbol file being debugged
+    """
+    if shared.name_index == None:
+        shared.name_index = NameIndex(shared.symbol_file, shared.index_cache,
+                                      shared.jobs)
+    return shared.name_index
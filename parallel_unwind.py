@@ -0,0 +1,210 @@
+"""
+parallel_unwind.py:
+    Unwind and symbolize all the threads of a process using a process pool,
+    and group the threads having identical stacks.
+    The indexes(symbols, CFI, CU ranges and functions) are built once in the
+    parent before the pool is forked, so the workers inherit them along with
+    the mmap of the core file and only unwind. The frames are populated in
+    the parent, so the line tables and DIEs it builds for them are kept.
+
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+import multiprocessing
+import os
+import struct
+from collections import namedtuple
+from elftools.common.exceptions import DWARFError, ELFError
+from frames import Frame
+from register_map import RegisterMap
+from unwind_table import get_unwind_table
+from cu_ranges import get_cu_range_index
+from function_index import get_function_index
+from symbolize import symbolize
+import shared
+
+#Picklable summary of a frame - what the workers send back to the parent
+FrameInfo = namedtuple('FrameInfo', ['ip', 'sp', 'function', 'offset',
+                                     'filename', 'line', 'inline_frames'])
+ThreadBacktrace = namedtuple('ThreadBacktrace', ['index', 'thread_id',
+                                                 'frames', 'stop_reason'])
+""" Threads with identical stacks
+    ips        - ip of each frame, innermost first
+    thread_ids - threads having this stack
+    frames     - Symbolization of each ip
+"""
+UniqueStack = namedtuple('UniqueStack', ['ips', 'thread_ids', 'frames'])
+
+#Threads being unwound - inherited by the forked workers
+_threads = None
+
+def _reopen_private(stream):
+    """Give this process its own file offset for an inherited file
+       Forked processes share the file offset of inherited descriptors, so
+       concurrent seek+read from the workers would corrupt each other.
+       The descriptor number is kept so every object holding the stream
+       keeps working.
+    """
+    fd = stream.fileno()
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    new_fd = os.open(stream.name, os.O_RDONLY)
+    os.lseek(new_fd, position, os.SEEK_SET)
+    os.dup2(new_fd, fd)
+    os.close(new_fd)
+
+def _init_worker():
+    """Pool initializer
+    """
+    for elf_file in (shared.symbol_file, shared.core_file):
+        if elf_file != None:
+            _reopen_private(elf_file.stream)
+
+def get_frame_info(frame):
+    """Returns FrameInfo of a frame(populates the frame)
+    """
+    frame.populate()
+    return FrameInfo(frame.ip, frame.sp, frame.function, frame.offset,
+                     frame.filename, frame.line, tuple(frame.inline_frames))
+
+def unwind_thread(index, thread, populate=True, max_frames=None):
+    """Returns ThreadBacktrace of the thread
+       If populate is False the frames are not symbolized(only ip and sp)
+       Unwinding stops after max_frames frames if it is given; stop_reason is
+       None then.
+    """
+    frames = list()
+    stop_reason = None
+    try:
+        thread_frames = thread.get_frames()
+        for frame in thread_frames.iter_frames():
+            if populate:
+                frames.append(get_frame_info(frame))
+            else:
+                frames.append(FrameInfo(frame.ip, frame.sp, None, None,
+                                        '', 0, ()))
+            if max_frames != None and len(frames) >= max_frames:
+                return ThreadBacktrace(index, thread.thread_id, frames, None)
+        stop_reason = thread_frames.stop_reason
+    except (ValueError, struct.error, DWARFError, ELFError), e:
+        #Unreadable memory or malformed debug information
+        logging.warning('Unwinding thread {0} failed: {1}'.format(thread, e))
+        stop_reason = str(e)
+    return ThreadBacktrace(index, thread.thread_id, frames, stop_reason)
+
+def _unwind_threads(args):
+    """Pool worker - returns ThreadBacktrace of the given thread indexes
+    """
+    indexes, populate, max_frames = args
+    return [unwind_thread(index, _threads[index], populate, max_frames)
+            for index in indexes]
+
+def _populate_backtrace(backtrace, symbols, populated):
+    """Returns the backtrace(unwound by a worker) with its frames populated
+       in this process - line tables and DIEs are built here once and kept,
+       instead of in the workers which exit. populated is ip to FrameInfo
+       of the frames populated so far.
+    """
+    register_map = RegisterMap('x86-64')
+    ra_reg = register_map.get_ra_register_number()
+    sp_reg = register_map.get_sp_register_number()
+    frames = list()
+    for frame_info in backtrace.frames:
+        info = populated.get(frame_info.ip)
+        if info == None:
+            frame = Frame({ra_reg: frame_info.ip, sp_reg: frame_info.sp},
+                          register_map, symbols.sym_file, symbols)
+            info = populated[frame_info.ip] = get_frame_info(frame)
+        frames.append(info._replace(sp=frame_info.sp))
+    return backtrace._replace(frames=frames)
+
+def _prepare_indexes(threads):
+    """Build the shared indexes before forking the workers
+    """
+    threads[0].symbols.get_index()
+    get_unwind_table()
+    get_cu_range_index()
+    get_function_index()
+
+def iter_unwind_threads(threads, jobs=1, populate=True, max_frames=None):
+    """Yields ThreadBacktrace of each thread, in the order of threads.
+       If jobs is more than 1 the threads are unwound by a process pool;
+       the workers only unwind and the frames are populated here.
+       Only the innermost max_frames frames are unwound if it is given.
+    """
+    global _threads
+    if jobs <= 1 or len(threads) < 2:
+        for index, thread in enumerate(threads):
+            yield unwind_thread(index, thread, populate, max_frames)
+        return
+
+    _prepare_indexes(threads)
+    _threads = threads
+    #Small contiguous chunks - keeps the workers busy and results in order
+    chunk_size = max(1, min(64, len(threads) // (jobs * 8)))
+    chunks = [(range(i, min(i + chunk_size, len(threads))), False,
+               max_frames) for i in range(0, len(threads), chunk_size)]
+    symbols = threads[0].symbols
+    populated = dict()
+    pool = multiprocessing.Pool(jobs, _init_worker)
+    try:
+        for chunk in pool.imap(_unwind_threads, chunks):
+            for backtrace in chunk:
+                if populate:
+                    backtrace = _populate_backtrace(backtrace, symbols,
+                                                    populated)
+                yield backtrace
+    finally:
+        pool.terminate()
+        pool.join()
+        _threads = None
+
+def unwind_threads(threads, jobs=1):
+    """Returns list of ThreadBacktrace of all the given threads
+    """
+    return list(iter_unwind_threads(threads, jobs))
+
+def aggregate_stacks(backtraces, symbols=None):
+    """Group the ThreadBacktraces by identical ip sequence.
+       Returns list of UniqueStack, most common stack first. Only the ips
+       are hashed while the backtraces stream in; the unique ips are
+       symbolized once at the end.
+    """
+    groups = dict()
+    order = list()
+    for backtrace in backtraces:
+        ips = tuple(frame.ip for frame in backtrace.frames)
+        thread_ids = groups.get(ips)
+        if thread_ids == None:
+            thread_ids = groups[ips] = list()
+            order.append(ips)
+        thread_ids.append(backtrace.thread_id)
+
+    addresses = [ip for ips in order for ip in ips]
+    resolved = dict(zip(addresses, symbolize(addresses, symbols)))
+    stacks = [UniqueStack(ips, groups[ips], [resolved[ip] for ip in ips])
+              for ips in order]
+    stacks.sort(key=lambda stack: len(stack.thread_ids), reverse=True)
+    return stacks
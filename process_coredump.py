@@ -28,10 +28,12 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-from elftools.elf.note import NoteSegment
 from frames import Frames
 from symbols import Symbols
-from address_space import AddressSpace
+from address_space import MmapAddressSpace
+from core_notes import CoreNotes, AT_ENTRY
+from parallel_unwind import iter_unwind_threads, aggregate_stacks
+import shared
 
 class Process():
     """ Represents all the Threads captured in the CoreDump file
@@ -42,64 +44,28 @@ class Process():
         self.core_file = core_file
         self.symbols = Symbols(self.sym_file)
         self.threads = list()
-        self.load_address_diff = 0
-        self.address_space = AddressSpace(core_file)
-
-        def get_next_note(start_index, n_type, end_type='NT_PRSTATUS'):
-            """Search and find note of given type
-            """
-            note_index = start_index
-            while note_index < len(segment.notes):
-                note = segment.notes[note_index]
-                if note.entry.n_type == end_type:
-                    return None
-                if note.entry.n_type == n_type:
-                    return note
-                note_index += 1
-
-        def parse_notes(segment):
-            """Parse notes in the core file and create thread object for each
-                PRSTATUS, PRPSINFO and PRFPREG tuple
-            """
-            for note_index, note in enumerate(segment.notes):
-                if note.entry.n_type != 'NT_PRSTATUS':
-                    continue
-                prstatus = note
-                thread_id = prstatus.desc.pr_pid
-                prpsinfo = get_next_note(note_index + 1, 'NT_PRPSINFO')
-                fpregset = get_next_note(note_index + 1, 'NT_PRFPREG')
-                #Add thread's info to the thread list
-                thread = Thread(thread_id=thread_id, prpsinfo=prpsinfo,
-                                prstatus=prstatus, fpregset=fpregset,
-                                process=self)
-                self.threads.append(thread)
-
-        for segment in core_file.iter_segments():
-            if not isinstance(segment, NoteSegment):
-                continue
-            parse_notes(segment)
+        self.address_space = shared.address_space
+        if self.address_space == None:
+            self.address_space = MmapAddressSpace(core_file)
+
+        self.notes = CoreNotes(core_file)
+        self.load_address_diff = self._get_load_address_diff()
+        thread_ids = self.notes.get_thread_ids()
+        for index, thread_notes in enumerate(self.notes.threads):
+            thread = Thread(thread_id=thread_ids[index],
+                            prpsinfo=self.notes.prpsinfo,
+                            prstatus=thread_notes.prstatus,
+                            fpregset=thread_notes.fpregset, process=self,
+                            xstate=thread_notes.xstate, index=index)
+            self.threads.append(thread)
 
     def _get_load_address_diff(self):
         """Returns the difference between loaded address and linked address
         """
-        if self.load_address_diff != 0:
-            return self.load_address_diff
-        core_entry = 0
-        for segment in self.core_file.iter_segments():
-            if not isinstance(segment, NoteSegment):
-                continue
-            for note in segment.notes:
-                if note.entry.n_type == 'NT_AUXV':
-                    for aux in note.desc:
-                        if aux.a_type == 'AT_ENTRY':
-                            core_entry = aux.a_val
-                            break
+        core_entry = self.notes.get_auxv().get(AT_ENTRY, 0)
         if core_entry != 0:
-            self.load_address_diff = self.sym_file.header.e_entry - core_entry
-        else:
-            self.load_address_diff = 0
-
-        return self.load_address_diff
+            return self.sym_file.header.e_entry - core_entry
+        return 0
 
     def set_current_thread(self, thread_id):
         """Sets the current thread 
@@ -111,19 +77,32 @@ class Process():
         """
         return self.threads
 
+    def get_unique_stacks(self, jobs=None):
+        """Returns UniqueStack list - threads grouped by identical stacks
+        """
+        if jobs == None:
+            jobs = shared.jobs
+        return aggregate_stacks(iter_unwind_threads(self.threads, jobs,
+                                                    populate=False),
+                                self.symbols)
+
 class Thread():
     """Represents a single Thread
     """
-    def __init__(self, thread_id, prpsinfo, prstatus, fpregset, process):
+    def __init__(self, thread_id, prpsinfo, prstatus, fpregset, process,
+                 xstate=None, index=0):
         self.thread_id = thread_id
+        self.index = index
         self.prpsinfo = prpsinfo
         self.prstatus = prstatus
         self.fpregset = fpregset
+        self.xstate = xstate
 
+        self.notes = process.notes
         self.sym_file = process.sym_file
         self.symbols = process.symbols
         self.address_space = process.address_space
-        self.load_address_diff = process._get_load_address_diff()
+        self.load_address_diff = process.load_address_diff
 
         self._frames = None
 
@@ -143,7 +122,7 @@ class Thread():
     def get_frames(self):
         """ Returns call frame of the thread
         """
-        if self._frames:
+        if self._frames != None:
             return self._frames
 
         self._frames = Frames(registers = self.get_registers(),
@@ -156,8 +135,7 @@ class Thread():
     def get_registers(self):
         """Returns register state 
         """
-        if self.prstatus != None:
-            return self.prstatus.desc.pr_reg.register
-        else:
+        if self.prstatus == None:
             return None
+        return self.notes.get_registers(self.index)
 
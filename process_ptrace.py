@@ -28,7 +28,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from frames import Frames
 from symbols import Symbols
-from address_space import AddressSpace
+from address_space import ProcessAddressSpace, CachedAddressSpace
 from pyptrace import ptrace_getregs, ptrace_attach
 from elftools.common.utils import struct_parse
 import shared
@@ -43,6 +43,13 @@ class ProcessPtrace():
         self.symbols = Symbols(self.sym_file)
         self.threads = list()
         self.load_address_diff = 0
+        if shared.address_space == None:
+            #Every read of a live process is a system call - cache the pages
+            shared.address_space = ProcessAddressSpace(self.pid, sym_file)
+            if shared.page_cache_size > 0:
+                shared.address_space = CachedAddressSpace(
+                                            shared.address_space,
+                                            shared.page_cache_size)
         self.address_space = shared.address_space
 
         #Add thread's info to the thread list
@@ -120,6 +127,9 @@ class Thread():
         """Returns register state 
         """
         ptrace_attach(self.pid)
+        #The target might have run since the last stop
+        if hasattr(self.address_space, 'invalidate'):
+            self.address_space.invalidate()
         ptrace_regs = ptrace_getregs(self.pid)
         class registers:
             def __init__(self, regs):
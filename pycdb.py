@@ -30,6 +30,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from __future__ import print_function
 import sys
+import types
 from os import path
 import logging
 import IPython
@@ -48,7 +49,8 @@ sys.path.extend([_PycdbPath,
 from elftools import *
 from elftools.elf.elffile import ELFFile
 from symbols import Symbols
-from address_space import AddressSpace
+from address_space import MmapAddressSpace, CachedAddressSpace
+from index_cache import IndexCache
 
 import shared
 import command_line
@@ -85,14 +87,26 @@ def run_command(args):
     if args.color_lexer:
         lexer_name = args.color_lexer
 
+    lexer = formatter = None
     if args.no_color == False and lexer_name and lexer_name != '':
         try:
             lexer = get_lexer_by_name(lexer_name, stripall=True)
             formatter = get_formatter_by_name(args.color_formatter)
         except:
             logging.error("Not able format output")
-        else:
-            result = highlight(result, lexer, formatter)
+            lexer = None
+
+    if isinstance(result, types.GeneratorType):
+        #Commands producing lots of output yield it piece by piece
+        for chunk in result:
+            if lexer:
+                chunk = highlight(chunk, lexer, formatter)
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+        return
+
+    if lexer:
+        result = highlight(result, lexer, formatter)
 
     print(result)
 
@@ -138,11 +152,23 @@ def main():
         logging.error('No symbol file')
 
     shared.symbol_file = ELFFile(open(args.symbol_file, 'rb'))
+    shared.jobs = args.jobs
+    shared.max_frame_depth = args.max_depth
+    shared.unwind_time_budget = args.unwind_timeout
+    if args.cache_size != None:
+        shared.page_cache_size = args.cache_size * 1024 * 1024
+    if not args.no_index_cache:
+        shared.index_cache = IndexCache(shared.symbol_file,
+                                        args.index_cache_dir)
     shared.symbols = Symbols(shared.symbol_file)
 
     if args.core_file:
         shared.core_file = ELFFile(open(args.core_file, 'rb'))
-        shared.address_space = AddressSpace(shared.core_file)
+        shared.address_space = MmapAddressSpace(shared.core_file)
+        #mmap reads are already zero copy - cache only if asked for
+        if args.cache_size > 0:
+            shared.address_space = CachedAddressSpace(shared.address_space,
+                                                      shared.page_cache_size)
 
     run_command(args)
     if args.interactive:
@@ -0,0 +1,119 @@
+"""
+read_planner.py:
+    Coalesced memory reads for evaluating variables of frames.
+    The addresses the variables of a frame are read from(DW_OP_fbreg
+    locations against the frame base) are gathered up front, the stack pages
+    covering them are read with as few reads as possible and the variables
+    are then decoded from those pages. The pages are kept for the following
+    frames of a backtrace, so each stack page is read once.
+
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+from address_space import AddressSpace, PAGE_SIZE, as_slice
+
+def plan_reads(reads, page_size=PAGE_SIZE, skip=()):
+    """ Returns sorted list of (start, end) covering the reads
+        Each read is widened to whole pages, pages in skip are left out and
+        touching pages are merged.
+    """
+    page_mask = page_size - 1
+    pages = set()
+    for address, size in reads:
+        if size > 0:
+            pages.update(range(address & ~page_mask, address + size,
+                               page_size))
+    ranges = list()
+    for page in sorted(pages.difference(skip)):
+        if ranges and page == ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], page + page_size)
+        else:
+            ranges.append((page, page + page_size))
+    return ranges
+
+class PlannedAddressSpace(AddressSpace):
+    """ Serves reads from the pages read by plan(), anything else is read
+        from the backend.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.byte_order = backend.byte_order
+        self.word_size = backend.word_size
+        self._int_structs = backend._int_structs
+        #page address to its data(None when it is not mapped)
+        self.pages = dict()
+        self.backend_reads = 0
+
+    def plan(self, reads):
+        """ Read the pages covering the given (address, size) reads which
+            are not read yet
+        """
+        for start, end in plan_reads(reads, PAGE_SIZE, self.pages):
+            self._read_range(start, end)
+
+    def _read_range(self, start, end):
+        """ Read a planned range. A range crossing in to unmapped memory is
+            read page by page and the readable pages are kept.
+        """
+        try:
+            data = self.backend.read(start, end - start)
+        except ValueError:
+            data = None
+        self.backend_reads += 1
+        if data != None and len(data) == end - start:
+            for page in range(start, end, PAGE_SIZE):
+                self.pages[page] = as_slice(data, page - start, PAGE_SIZE)
+            return
+        if end - start <= PAGE_SIZE:
+            logging.debug('Planned read {0:#x} not mapped'.format(start))
+            self.pages[start] = None
+            return
+        for page in range(start, end, PAGE_SIZE):
+            self._read_range(page, page + PAGE_SIZE)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def get_mapping(self, address):
+        return self.backend.get_mapping(address)
+
+    def read(self, address, size):
+        """Returns size bytes at the given address
+        """
+        page = address & ~(PAGE_SIZE - 1)
+        offset = address - page
+        data = self.pages.get(page)
+        if data != None and offset + size <= PAGE_SIZE:
+            return as_slice(data, offset, size)
+        if data != None:
+            #Crosses in to the following pages
+            chunks = [self.pages.get(next_page) for next_page in
+                      range(page, address + size, PAGE_SIZE)]
+            if None not in chunks:
+                return as_slice(''.join(str(chunk) for chunk in chunks),
+                                offset, size)
+        self.backend_reads += 1
+        return self.backend.read(address, size)
@@ -27,6 +27,9 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 class RegisterMap():
+    #(architecture, register names) to mapping - see _get_name_mapping()
+    _name_mappings = dict()
+
     def __init__(self, architecture):
         self.architecture = architecture
 
@@ -57,13 +60,32 @@ class RegisterMap():
     def __getitem__(self, item):
         return self.__getattr__(item)
 
+    def _get_name_mapping(self, names):
+        """Returns list of (position in names, register number) of the
+           registers known to this map. Memoized per names tuple.
+        """
+        key = (self.architecture, names)
+        mapping = self._name_mappings.get(key)
+        if mapping == None:
+            mapping = [(index, self._reg_map[name.upper()])
+                       for index, name in enumerate(names)
+                       if self._reg_map.has_key(name.upper())]
+            self._name_mappings[key] = mapping
+        return mapping
+
     def create_register_table(self, registers):
         reg_tab = {}
-        #copy members in the register class to dict
-        for reg, value in registers.__dict__.iteritems():
-            reg = reg.upper()
-            if self._reg_map.has_key(reg):
-                reg_tab[self._reg_map[reg]] = value
+        if hasattr(registers, 'names'):
+            #Register view of a table(core_notes.RegisterView)
+            values = registers.values()
+            for index, number in self._get_name_mapping(registers.names):
+                reg_tab[number] = values[index]
+        else:
+            #copy members in the register class to dict
+            for reg, value in registers.__dict__.iteritems():
+                reg = reg.upper()
+                if self._reg_map.has_key(reg):
+                    reg_tab[self._reg_map[reg]] = value
 
         #special registers
         reg_tab['cfa'] = registers.rsp
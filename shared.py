@@ -30,4 +30,14 @@ symbol_file = None
 core_file = None
 symbols = None
 address_space = None
-
+index_cache = None
+name_index = None
+jobs = 1
+function_index = None
+cu_range_index = None
+unwind_table = None
+max_frame_depth = 100000
+unwind_time_budget = 0
+location_lists = None
+#Bytes of memory page cache used in front of non mmap address spaces
+page_cache_size = 64 * 1024 * 1024
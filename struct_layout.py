@@ -0,0 +1,335 @@
+"""
+struct_layout.py:
+    Precompiled memory layout of DWARF types.
+    A type is compiled once in to a tree of layouts with fixed member offsets,
+    precompiled struct formats and bitfield shifts. An object of the type is
+    read with one read and its members are decoded from that buffer only when
+    they are accessed - nested structures and arrays are views of the same
+    buffer, nothing is copied.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import struct
+from address_space import INT_FORMAT_CODES, SLICE_TYPE, as_slice
+
+#DWARF base type encodings(DW_ATE_*)
+DW_ATE_address = 0x1
+DW_ATE_boolean = 0x2
+DW_ATE_float = 0x4
+DW_ATE_signed = 0x5
+DW_ATE_signed_char = 0x6
+DW_ATE_unsigned = 0x7
+DW_ATE_unsigned_char = 0x8
+
+FLOAT_FORMAT_CODES = {4: 'f', 8: 'd'}
+
+#Tags which only qualify or rename their base type
+_TRANSPARENT_TAGS = ['DW_TAG_typedef', 'DW_TAG_const_type',
+                     'DW_TAG_volatile_type', 'DW_TAG_restrict_type']
+_CONTAINER_TAGS = ['DW_TAG_structure_type', 'DW_TAG_union_type',
+                   'DW_TAG_class_type']
+
+#(CU offset, DIE offset, byte order, word size) to compiled layout
+_layouts = dict()
+
+def get_layout(pydie, byte_order='<', word_size=8):
+    """ Returns compiled layout of the given type PyDie.
+        For a variable or member the layout of its type is returned.
+    """
+    if pydie.is_variable() or pydie.is_member():
+        pydie = pydie.get_base_type()
+    return _get_type_layout(pydie, byte_order, word_size)
+
+def _get_type_layout(pydie, byte_order, word_size):
+    """ Compiles a type once and caches it
+    """
+    if pydie == None:
+        #void
+        return RawLayout(0)
+    key = (pydie.pycu.compile_unit.cu_offset, pydie.offset, byte_order,
+           word_size)
+    layout = _layouts.get(key)
+    if layout == None:
+        layout = _compile_type(pydie, byte_order, word_size)
+        _layouts[key] = layout
+    return layout
+
+def _compile_type(pydie, byte_order, word_size):
+    """ Creates layout for the given type PyDie
+    """
+    tag = pydie.die.tag
+    if tag in _TRANSPARENT_TAGS:
+        return _get_type_layout(pydie.get_base_type(), byte_order, word_size)
+    if tag == 'DW_TAG_pointer_type':
+        return _compile_scalar(pydie.size or word_size, DW_ATE_unsigned,
+                               byte_order)
+    if tag == 'DW_TAG_base_type':
+        return _compile_scalar(pydie.size, pydie.encoding, byte_order)
+    if tag == 'DW_TAG_enumeration_type':
+        base_type = pydie.get_base_type()
+        if base_type:
+            return _get_type_layout(base_type, byte_order, word_size)
+        return _compile_scalar(pydie.size, DW_ATE_unsigned, byte_order)
+    if tag in _CONTAINER_TAGS:
+        return _compile_struct(pydie, byte_order, word_size)
+    if tag == 'DW_TAG_array_type':
+        return _compile_array(pydie, byte_order, word_size)
+    return RawLayout(pydie.size)
+
+def _compile_scalar(size, encoding, byte_order):
+    """ Integer or float layout - raw bytes if the size has no struct format
+    """
+    if encoding == DW_ATE_float:
+        code = FLOAT_FORMAT_CODES.get(size)
+        signed = True
+    else:
+        code = INT_FORMAT_CODES.get(size)
+        signed = encoding in [DW_ATE_signed, DW_ATE_signed_char]
+        if code and not signed:
+            code = code.upper()
+    if code == None:
+        return RawLayout(size)
+    return ScalarLayout(size, code, signed, byte_order)
+
+def _compile_struct(pydie, byte_order, word_size):
+    """ Structure or union layout
+        Anonymous members are named uniquely(_1, _2..) as done by
+        DataStructureObject.
+    """
+    fields = list()
+    unique = 0
+    pycu = pydie.pycu
+    for child in pydie.die.iter_children():
+        if child.tag != 'DW_TAG_member':
+            continue
+        member = pycu.get_pydie(child)
+        name = member.name
+        if name.strip() == '':
+            unique += 1
+            name = '_%s' % unique
+        layout = _get_type_layout(member.get_base_type(), byte_order,
+                                  word_size)
+        fields.append(_compile_field(name, member, layout, byte_order))
+    return StructLayout(pydie.name, pydie.size, fields)
+
+def _compile_field(name, member, layout, byte_order):
+    """ Field at fixed offset, bitfields are extracted from their storage unit
+    """
+    attr = member.die.attributes
+    offset = member.byte_offset
+    if attr.has_key('DW_AT_data_bit_offset'):
+        #DWARF4 - bit offset from the start of the structure
+        unit_size = layout.size
+        data_bit_offset = attr['DW_AT_data_bit_offset'].value
+        offset = (data_bit_offset // (unit_size * 8)) * unit_size
+        bit_position = data_bit_offset - offset * 8
+        if byte_order == '<':
+            shift = bit_position
+        else:
+            shift = unit_size * 8 - bit_position - member.bit_size
+    elif member.bit_size:
+        #DWARF2/3 - bit offset from the most significant bit of the unit
+        unit_size = member.size or layout.size
+        shift = unit_size * 8 - member.bit_offset - member.bit_size
+    else:
+        return Field(name, offset, layout)
+
+    unit = _compile_scalar(unit_size, DW_ATE_unsigned, byte_order)
+    if not isinstance(unit, ScalarLayout):
+        return Field(name, offset, RawLayout(unit_size))
+    return BitField(name, offset, unit, member.bit_size, shift,
+                    getattr(layout, 'signed', False))
+
+def _compile_array(pydie, byte_order, word_size):
+    """ Array layout, multi dimensional arrays are arrays of arrays
+    """
+    layout = _get_type_layout(pydie.get_base_type(), byte_order, word_size)
+    counts = list()
+    for child in pydie.die.iter_children():
+        if child.tag != 'DW_TAG_subrange_type':
+            continue
+        attr = child.attributes
+        if attr.has_key('DW_AT_count'):
+            counts.append(attr['DW_AT_count'].value)
+        elif attr.has_key('DW_AT_upper_bound'):
+            counts.append(attr['DW_AT_upper_bound'].value + 1)
+        else:
+            #Flexible array member
+            counts.append(0)
+    for count in reversed(counts or [0]):
+        layout = ArrayLayout(layout, count, byte_order)
+    return layout
+
+class RawLayout():
+    """ Type without a struct format - decoded as buffer of its bytes
+    """
+    def __init__(self, size):
+        self.size = size
+
+    def decode(self, data, offset):
+        return as_slice(data, offset, self.size)
+
+class ScalarLayout():
+    """ Integer, float, pointer or enum
+    """
+    def __init__(self, size, code, signed, byte_order):
+        self.size = size
+        self.code = code
+        self.signed = signed
+        self.format = struct.Struct(byte_order + code)
+
+    def decode(self, data, offset):
+        return self.format.unpack_from(data, offset)[0]
+
+class Field():
+    """ Member of a structure at a fixed offset
+    """
+    def __init__(self, name, offset, layout):
+        self.name = name
+        self.offset = offset
+        self.layout = layout
+
+    def decode(self, data, offset):
+        return self.layout.decode(data, offset + self.offset)
+
+class BitField(Field):
+    """ Bitfield member - unit is the unsigned layout of its storage unit
+    """
+    def __init__(self, name, offset, unit, bit_size, shift, signed=False):
+        Field.__init__(self, name, offset, unit)
+        self.bit_size = bit_size
+        self.shift = shift
+        self.mask = (1 << bit_size) - 1
+        self.signed = signed
+
+    def decode(self, data, offset):
+        unit = self.layout.decode(data, offset + self.offset)
+        value = (unit >> self.shift) & self.mask
+        if self.signed and value >> (self.bit_size - 1):
+            value -= 1 << self.bit_size
+        return value
+
+class StructLayout():
+    """ Structure or union - list of fields
+    """
+    def __init__(self, name, size, fields):
+        self.name = name
+        self.size = size
+        self.fields = fields
+        self.fields_by_name = dict((field.name, field) for field in fields)
+
+    def decode(self, data, offset):
+        return StructView(self, data, offset)
+
+class ArrayLayout():
+    """ Array of count elements
+        Arrays of integers and floats are decoded with one precompiled
+        struct format.
+    """
+    def __init__(self, element, count, byte_order):
+        self.element = element
+        self.count = count
+        self.size = element.size * count
+        self.format = None
+        if isinstance(element, ScalarLayout):
+            self.format = struct.Struct('{0}{1}{2}'.format(byte_order, count,
+                                                           element.code))
+
+    def decode(self, data, offset):
+        return ArrayView(self, data, offset)
+
+class StructView():
+    """ Decoded structure - members are decoded from the buffer when they are
+        accessed.
+        For example view.second.val[2]
+    """
+    def __init__(self, layout, data, offset):
+        self._layout = layout
+        self._data = data
+        self._offset = offset
+
+    def __getattr__(self, name):
+        field = self._layout.fields_by_name.get(name)
+        if field == None:
+            raise AttributeError(name)
+        return field.decode(self._data, self._offset)
+
+    def items(self):
+        """ Yields (name, value) of all the members in declaration order
+        """
+        for field in self._layout.fields:
+            yield field.name, field.decode(self._data, self._offset)
+
+    def raw(self):
+        """ Returns the bytes of the structure
+        """
+        return as_slice(self._data, self._offset, self._layout.size)
+
+    def __str__(self):
+        return '{' + ', '.join('{0} = {1}'.format(name, _format_value(value))
+                               for name, value in self.items()) + '}'
+
+class ArrayView():
+    """ Decoded array - elements are decoded from the buffer when they are
+        accessed.
+    """
+    def __init__(self, layout, data, offset):
+        self._layout = layout
+        self._data = data
+        self._offset = offset
+
+    def __len__(self):
+        return self._layout.count
+
+    def __getitem__(self, index):
+        layout = self._layout
+        if index < 0 or index >= layout.count:
+            raise IndexError
+        element = layout.element
+        return element.decode(self._data, self._offset + index * element.size)
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def values(self):
+        """ Returns all the elements as a tuple
+        """
+        layout = self._layout
+        if layout.format:
+            return layout.format.unpack_from(self._data, self._offset)
+        return tuple(self[index] for index in range(layout.count))
+
+    def raw(self):
+        """ Returns the bytes of the array
+        """
+        return as_slice(self._data, self._offset, self._layout.size)
+
+    def __str__(self):
+        return '{' + ', '.join(_format_value(value) for value in self) + '}'
+
+def _format_value(value):
+    if isinstance(value, SLICE_TYPE):
+        return repr(bytes(value))
+    return str(value)
@@ -0,0 +1,120 @@
+"""
+symbolize.py:
+    Batch symbolization of raw addresses(from logs, perf samples..).
+    Addresses are read in bounded batches, sorted, deduplicated and resolved
+    against the symbol, CU, line and function indexes in one pass per batch.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+from collections import namedtuple
+from function_index import get_function_index
+from name_index import get_compile_unit
+import shared
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+SYMBOLIZE_FORMAT = '{address:#018x}\t{function}+{offset:#x}\t'\
+                   '{file}:{line}\t{inlined}\n'
+
+""" Result of symbolizing one address
+    inlined - InlineFrames of the inlined functions at the address, innermost
+              first, each with its own location
+    call_file, call_line - location in the function the address belongs to;
+              the call site of the outermost inlined function or file, line
+"""
+Symbolization = namedtuple('Symbolization', ['address', 'function', 'offset',
+                                             'file', 'line', 'inlined',
+                                             'call_file', 'call_line'])
+
+def symbolize(addresses, symbols=None):
+    """Returns list of Symbolization for the given addresses(same order)
+    """
+    if symbols == None:
+        symbols = shared.symbols
+    unique = sorted(set(addresses))
+    lines = symbols.batch_addr2line(unique)
+    function_index = get_function_index()
+
+    resolved = dict()
+    for address, addr2line in zip(unique, lines):
+        function, offset = symbols.find_symbol(address)
+        filename = addr2line.file if addr2line else '??'
+        line = addr2line.line if addr2line else 0
+        inlined = list()
+        call_file, call_line = filename, line
+        chain = function_index.lookup(address)
+        if len(chain) > 1:
+            compile_unit = get_compile_unit(function_index.elf_file,
+                                            chain[0][0])
+            line_table = symbols.get_line_table(compile_unit) \
+                         if compile_unit else None
+            inlined, call_file, call_line = \
+                function_index.get_inline_frames(chain, line_table,
+                                                 filename, line)
+        resolved[address] = Symbolization(address, function or '??', offset,
+                                          filename, line, inlined,
+                                          call_file, call_line)
+
+    return [resolved[address] for address in addresses]
+
+def parse_address(token):
+    """Address are hex with or without 0x prefix(as in perf/log output)
+    """
+    return int(token, 16)
+
+def iter_symbolize(stream, batch_size=DEFAULT_BATCH_SIZE, symbols=None):
+    """Reads addresses(first word of each line) from the stream and yields
+       Symbolization for each of them. Only batch_size addresses are kept in
+       memory at any time.
+    """
+    batch = list()
+    for line in stream:
+        words = line.split()
+        if len(words) == 0:
+            continue
+        try:
+            batch.append(parse_address(words[0]))
+        except ValueError:
+            logging.warning('Ignoring invalid address {0}'.format(words[0]))
+            continue
+        if len(batch) >= batch_size:
+            for result in symbolize(batch, symbols):
+                yield result
+            batch = list()
+
+    if batch:
+        for result in symbolize(batch, symbols):
+            yield result
+
+def format_symbolization(result):
+    """Returns one line text for the given Symbolization
+    """
+    return SYMBOLIZE_FORMAT.format(address=result.address,
+                                   function=result.function,
+                                   offset=result.offset, file=result.file,
+                                   line=result.line,
+                                   inlined=' <- '.join(inline_frame.function
+                                          for inline_frame in result.inlined))
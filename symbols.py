@@ -27,9 +27,91 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import bisect
+from array import array
 from collections import namedtuple
 import logging
 from os import path, access, R_OK
+from cu_ranges import get_cu_range_index
+import shared
+
+Addr2Line = namedtuple('Addr2Line', ['file', 'line', 'dir', 'compilation_dir'])
+
+#Symbol types which can be used to symbolize an address
+SYMBOL_TYPES = ('STT_FUNC', 'STT_OBJECT', 'STT_NOTYPE', 'STT_GNU_IFUNC')
+
+class SymbolIndex():
+    """Merged and deduplicated index of all the symbol sections(.symtab,
+       .dynsym) in the elf file.
+       Start addresses are kept sorted in an array(parallel to sizes and
+       names) so that address to symbol is a binary search and name to
+       address is a hash lookup.
+    """
+    CACHE_NAME = 'symbols'
+    CACHE_VERSION = 1
+
+    def __init__(self, starts, sizes, symbol_names, names):
+        self.starts = starts
+        self.sizes = sizes
+        self.symbol_names = symbol_names
+        self.names = names
+
+    @classmethod
+    def build(cls, symbol_sections):
+        """Create the index from the given symbol sections
+        """
+        symbols = dict()
+        names = dict()
+        for section in symbol_sections:
+            for sym in section.iter_symbols():
+                address = sym['st_value']
+                if address == 0 or sym.name == '' or \
+                   sym['st_info']['type'] not in SYMBOL_TYPES:
+                    continue
+                size = sym['st_size']
+                if not names.has_key(sym.name):
+                    names[sym.name] = address
+                #Same address found in multiple sections or aliases
+                #Keep the symbol which has size, first one otherwise
+                if not symbols.has_key(address) or \
+                   (symbols[address][0] == 0 and size != 0):
+                    symbols[address] = (size, sym.name)
+
+        addresses = sorted(symbols)
+        return cls(array('L', addresses),
+                   array('L', [symbols[a][0] for a in addresses]),
+                   [symbols[a][1] for a in addresses], names)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Create the index from columns loaded from the index cache
+        """
+        starts, sizes, symbol_names, name_list, name_addresses = columns
+        return cls(starts, sizes, symbol_names,
+                   dict(zip(name_list, name_addresses)))
+
+    def get_columns(self):
+        """Returns the index as columns to be stored in the index cache
+        """
+        name_list = self.names.keys()
+        return [self.starts, self.sizes, self.symbol_names, name_list,
+                array('L', [self.names[n] for n in name_list])]
+
+    def lookup(self, address):
+        """Returns (name, start address) of the symbol containing the address
+           Returns (None, 0) if there is no such symbol.
+        """
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i < 0:
+            return None, 0
+        start = self.starts[i]
+        size = self.sizes[i]
+        if size != 0 and address >= start + size:
+            #Address is beyond the end of the nearest symbol
+            return None, 0
+        return self.symbol_names[i], start
+
+    def __len__(self):
+        return len(self.starts)
 
 class Symbols():
     """Represents symbol section in the elf file
@@ -37,36 +119,44 @@ class Symbols():
     def __init__(self, sym_file):
         self.sym_file = sym_file
         self.symbol_sections = None
+        self._index = None
+        self._line_tables = dict()
+        self._line_table_store = None
+        self._source_paths = dict()
 
-    def find_symbol(self, address, only_exact_match=False):
-        """ Get the nearest symbol for the given address
-            Returns the symbol name and offset difference
+    def get_index(self):
+        """Returns the merged symbol index, builds it on first use
         """
-        name = None
-        offset = 0
-        if self.sym_file == None:
-            return name, offset
+        if self._index != None:
+            return self._index
+
+        cache = shared.index_cache
+        if cache:
+            columns = cache.load(SymbolIndex.CACHE_NAME,
+                                 SymbolIndex.CACHE_VERSION)
+            if columns:
+                self._index = SymbolIndex.from_columns(columns)
+                return self._index
 
-        """ Read symbol sections if not already done 
-        """
         if self.symbol_sections == None:
             self.symbol_sections = self.sym_file.get_symbol_sections()
+        self._index = SymbolIndex.build(self.symbol_sections)
+        if cache:
+            cache.store(SymbolIndex.CACHE_NAME, SymbolIndex.CACHE_VERSION,
+                        self._index.get_columns())
+        return self._index
 
-        """ Walk through all symbol sections
+    def find_symbol(self, address, only_exact_match=False):
+        """ Get the nearest symbol for the given address
+            Returns the symbol name and offset difference
         """
-        for section in self.symbol_sections:
-            symbol_list = section.get_symbol_list()
-            if symbol_list == None:
-                continue
+        if self.sym_file == None:
+            return None, 0
 
-            """ The list is sorted - see the symbol section create class.
-                So do a binary search to match
-            """
-            i = bisect.bisect_left(symbol_list, address)
-            if i:
-                sym = symbol_list[i-1]
-                name = sym.name
-                offset = address - sym.value
+        name, start = self.get_index().lookup(address)
+        if name == None:
+            return None, 0
+        offset = address - start
 
         if (only_exact_match and offset !=0 ):
             name = None
@@ -77,60 +167,303 @@ class Symbols():
         """ Get the address for the given name
             Reverse of find_symbol()
         """
+        return self.get_index().names.get(name)
 
-        """ Read symbol sections if not already done
+    def _is_file_readable(self, file_path):
+        return path.exists(file_path) and path.isfile(file_path) and\
+            access(file_path, R_OK)
+
+    def get_line_table(self, compile_unit):
+        """Returns LineTable of the given CU - built once per CU
         """
-        if self.symbol_sections == None:
-            self.symbol_sections = self.sym_file.get_symbol_sections()
+        cu_offset = compile_unit.cu_offset
+        if self._line_tables.has_key(cu_offset):
+            return self._line_tables[cu_offset]
+
+        store = self._get_line_table_store()
+        line_table = store.get(cu_offset) if store else None
+        if line_table == None:
+            line_table = LineTable.build(compile_unit)
+            if line_table and store:
+                store.add(cu_offset, line_table)
 
-        """ Walk through all symbol sections
+        self._line_tables[cu_offset] = line_table
+        return line_table
+
+    def _get_line_table_store(self):
+        """Returns LineTableStore of the index cache or None
         """
-        for section in self.symbol_sections:
-            symbol_dict = section.get_symbol_dict()
-            if symbol_dict == None or not symbol_dict.has_key(name):
-                continue
-            return symbol_dict[name].value
-        return None
+        if self._line_table_store == None and shared.index_cache:
+            self._line_table_store = LineTableStore(shared.index_cache)
+        return self._line_table_store
 
-    def _is_file_readable(self, file_path):
-        return path.exists(file_path) and path.isfile(file_path) and\
-            access(file_path, R_OK)
+    def _resolve_source(self, line_table, file_index):
+        """Returns (directory, compilation directory) of the source file
+           Results are memoized per (comp_dir, dir, file) since checking
+           the file system for every address is costly.
+        """
+        file_name = line_table.file_names[file_index]
+        file_dir = line_table.file_dirs[file_index]
+        key = (line_table.comp_dir, file_dir, file_name)
+        if self._source_paths.has_key(key):
+            return self._source_paths[key]
+
+        compile_dir = line_table.comp_dir
+        if not( path.exists(compile_dir) and path.isdir(compile_dir) and\
+            access(compile_dir, R_OK)):
+            compile_dir = '.'
+        result = ('', compile_dir)
+        for inc_dir in [file_dir] + line_table.include_dirs:
+            file_path = compile_dir + '/' + inc_dir + '/' + file_name
+            if self._is_file_readable(file_path):
+                result = (inc_dir, compile_dir)
+                break
+            else:
+                logging.debug('Skipping {0}'.format(file_path))
+
+        self._source_paths[key] = result
+        return result
+
+    def _line_table_addr2line(self, line_table, row):
+        file_index = line_table.get_file_index(line_table.files[row])
+        if file_index < 0:
+            return Addr2Line('', line_table.lines[row], '',
+                             line_table.comp_dir)
+        inc_dir, compile_dir = self._resolve_source(line_table, file_index)
+        return Addr2Line(line_table.file_names[file_index],
+                         line_table.lines[row], inc_dir, compile_dir)
 
     def addr2line(self, ip):
         """ Returns filename and line for a given address
         """
-        Addr2Line = namedtuple('Addr2Line', ['file', 'line', 'dir', 'compilation_dir'])
-        dwarfinfo = self.sym_file.get_dwarf_info()
-        compile_unit = dwarfinfo.get_cu_for_address(ip)
+        compile_unit = get_cu_range_index().get_cu(ip)
         if compile_unit == None:
             logging.warning('No compiliation unit for address {0:#x}'.format(ip))
             return
-        line_program = compile_unit.get_line_program()
-        if line_program == None:
+        line_table = self.get_line_table(compile_unit)
+        if line_table == None:
             logging.warning('No line_program for address {0:#x}'.format(ip))
             return
-        line_entry = line_program.get_entry(ip)
-        if line_entry == None or line_entry.state == None:
-            logging.warning('LineEntry not found for address {0:#x} trying '\
-                            'next entry'.format(ip))
-            line_entry = line_program.get_entry(ip, 1)
+        row = line_table.lookup(ip)
+        if row < 0:
             logging.warning('No valid LineEntry found for address {0:#x}'\
                             .format(ip))
             return
-        file_name = line_entry.state.get_file_name()
-        line_number = line_entry.state.line
-        compile_dir = compile_unit.get_compilation_directory()
-        if not( path.exists(compile_dir) and path.isdir(compile_dir) and\
-            access(compile_dir, R_OK)):
-            compile_dir = '.'
-        inc_directories = line_program.get_include_directory()
-        for inc_dir in inc_directories:
-            file_path = compile_dir + '/' + inc_dir + '/' + file_name
-            if self._is_file_readable(file_path):
-                return Addr2Line(file_name, line_number, inc_dir, compile_dir)
-            else:
-                logging.debug('Skipping {0}'.format(file_path))
-        return Addr2Line(file_name, line_number, '', compile_dir)
+        return self._line_table_addr2line(line_table, row)
+
+    def batch_addr2line(self, addresses):
+        """ Returns list of Addr2Line(or None) for the given addresses
+            The addresses are sorted and resolved in one merged pass over the
+            CU ranges and line tables.
+        """
+        result = [None] * len(addresses)
+        cu_index = get_cu_range_index()
+        cu_end = 0
+        line_table = None
+        row = 0
+        for index in sorted(range(len(addresses)),
+                            key=addresses.__getitem__):
+            ip = addresses[index]
+            if ip >= cu_end:
+                i = bisect.bisect_right(cu_index.starts, ip) - 1
+                if i < 0 or ip >= cu_index.ends[i]:
+                    continue
+                cu_end = cu_index.ends[i]
+                compile_unit = cu_index.get_cu(ip)
+                line_table = self.get_line_table(compile_unit) \
+                             if compile_unit else None
+                row = 0
+            if line_table == None:
+                continue
+            #Addresses are sorted so search only beyond the last row
+            row = line_table.lookup(ip, max(row, 0))
+            if row >= 0:
+                result[index] = self._line_table_addr2line(line_table, row)
+        return result
+
+#line table row flags
+LINE_IS_STMT = 1
+LINE_END_SEQUENCE = 2
+
+class LineTable():
+    """Line number table of a CU as parallel arrays sorted by address
+       addresses, files(file number as in the line program), lines and flags
+       File numbers are 1 based before DWARF5 and 0 based from DWARF5 - use
+       get_file_index() to index file_names.
+    """
+
+    def __init__(self, addresses, files, lines, flags, file_names,
+                 file_dirs, include_dirs, comp_dir, version):
+        self.version = version
+        self.addresses = addresses
+        self.files = files
+        self.lines = lines
+        self.flags = flags
+        self.file_names = file_names
+        self.file_dirs = file_dirs
+        self.include_dirs = include_dirs
+        self.comp_dir = comp_dir
+
+    @classmethod
+    def build(cls, compile_unit):
+        """Create line table from the line program of the CU
+        """
+        line_program = compile_unit.dwarfinfo.line_program_for_CU(
+                                                            compile_unit)
+        if line_program == None:
+            return None
+
+        rows = list()
+        for entry in line_program.get_entries():
+            state = entry.state
+            if state == None:
+                continue
+            flags = (LINE_IS_STMT if state.is_stmt else 0) | \
+                    (LINE_END_SEQUENCE if state.end_sequence else 0)
+            #End of a sequence must sort before a sequence starting at the
+            #same address
+            rows.append((state.address, 0 if state.end_sequence else 1,
+                         state.file, state.line, flags))
+        rows.sort()
+
+        version = line_program.header['version']
+        include_dirs = list(line_program.header.include_directory)
+        file_names = list()
+        file_dirs = list()
+        for file_entry in line_program.header.file_entry:
+            file_names.append(file_entry.name)
+            dir_index = file_entry.dir_index
+            #DWARF5 directory 0 is the compilation directory, before DWARF5
+            #0 means the compilation directory and 1 is the first entry
+            if version < 5:
+                dir_index -= 1
+            file_dirs.append(include_dirs[dir_index]
+                             if 0 <= dir_index < len(include_dirs) else '')
+        comp_dir = compile_unit.get_compilation_directory() or ''
+
+        return cls(array('L', [r[0] for r in rows]),
+                   array('l', [r[2] for r in rows]),
+                   array('L', [r[3] for r in rows]),
+                   array('B', [r[4] for r in rows]),
+                   file_names, file_dirs, include_dirs, comp_dir, version)
+
+    @classmethod
+    def from_columns(cls, columns, index):
+        """Create the line table of the index'th CU of the columns loaded from
+           the index cache(see get_columns())
+        """
+        cu_offsets, versions, row_starts, file_starts, include_starts, \
+            addresses, files, lines, flags, file_names, file_dirs, \
+            include_dirs, comp_dirs = columns
+        start, end = row_starts[index], row_starts[index + 1]
+        file_start, file_end = file_starts[index], file_starts[index + 1]
+        include_start = include_starts[index]
+        include_end = include_starts[index + 1]
+        return cls(addresses[start:end], files[start:end], lines[start:end],
+                   flags[start:end], file_names[file_start:file_end],
+                   file_dirs[file_start:file_end],
+                   include_dirs[include_start:include_end], comp_dirs[index],
+                   versions[index])
+
+    @classmethod
+    def get_columns(cls, line_tables):
+        """Returns the line tables of many CUs as columns to be stored in the
+           index cache. line_tables is list of (cu offset, LineTable) sorted
+           by CU offset; rows, files and include directories of the index'th
+           CU are from *_starts[index] to *_starts[index + 1].
+        """
+        cu_offsets = array('L')
+        versions = array('H')
+        row_starts = array('L', [0])
+        file_starts = array('L', [0])
+        include_starts = array('L', [0])
+        addresses = array('L')
+        files = array('l')
+        lines = array('L')
+        flags = array('B')
+        file_names = list()
+        file_dirs = list()
+        include_dirs = list()
+        comp_dirs = list()
+        for cu_offset, line_table in line_tables:
+            cu_offsets.append(cu_offset)
+            versions.append(line_table.version)
+            addresses.extend(line_table.addresses)
+            files.extend(line_table.files)
+            lines.extend(line_table.lines)
+            flags.extend(line_table.flags)
+            file_names.extend(line_table.file_names)
+            file_dirs.extend(line_table.file_dirs)
+            include_dirs.extend(line_table.include_dirs)
+            comp_dirs.append(line_table.comp_dir)
+            row_starts.append(len(addresses))
+            file_starts.append(len(file_names))
+            include_starts.append(len(include_dirs))
+        return [cu_offsets, versions, row_starts, file_starts, include_starts,
+                addresses, files, lines, flags, file_names, file_dirs,
+                include_dirs, comp_dirs]
+
+    def lookup(self, address, lo=0):
+        """Returns row index for the given address or -1
+        """
+        row = bisect.bisect_right(self.addresses, address, lo) - 1
+        if row < 0 or self.flags[row] & LINE_END_SEQUENCE:
+            return -1
+        return row
 
+    def get_file_index(self, file_no):
+        """Returns index in to file_names of the file number(as in the line
+           program or DW_AT_decl_file/DW_AT_call_file) or -1
+        """
+        index = file_no if self.version >= 5 else file_no - 1
+        if index < 0 or index >= len(self.file_names):
+            return -1
+        return index
+
+    def get_file_name(self, file_no):
+        """Returns name of the file number or '' if there is no such file
+        """
+        index = self.get_file_index(file_no)
+        return self.file_names[index] if index >= 0 else ''
 
+class LineTableStore():
+    """Line tables of all the CUs in one index cache table
+       Each line table is appended to the table as a record(see
+       LineTable.get_columns()) when it is built, so nothing already cached
+       is written again. A table is created from the cached columns when it
+       is first asked for.
+    """
+    CACHE_NAME = 'lines'
+    CACHE_VERSION = 4
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._records = None
 
+    def _load(self):
+        """Load the records and index them by CU offset
+        """
+        if self._records != None:
+            return
+        self._records = dict()
+        records = self.cache.load_records(self.CACHE_NAME, self.CACHE_VERSION)
+        for columns in records or []:
+            for index, cu_offset in enumerate(columns[0]):
+                self._records[cu_offset] = (columns, index)
+
+    def get(self, cu_offset):
+        """Returns cached LineTable of the CU or None
+        """
+        self._load()
+        record = self._records.get(cu_offset)
+        if record == None:
+            return None
+        return LineTable.from_columns(*record)
+
+    def add(self, cu_offset, line_table):
+        """Write a line table built in this session to the index cache
+        """
+        self._load()
+        columns = LineTable.get_columns([(cu_offset, line_table)])
+        self.cache.append(self.CACHE_NAME, self.CACHE_VERSION, columns)
+        self._records[cu_offset] = (columns, 0)
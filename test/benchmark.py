@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py:
+    Micro benchmarks for pycdb internals.
+    Usage: ./benchmark.py -s ./a.out -c ./core <benchmark>
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import print_function
+import argparse
+import sys
+import timeit
+from os import path
+
+_PycdbPath = path.dirname(path.dirname(path.realpath(__file__)))
+sys.path.extend([_PycdbPath,
+                _PycdbPath + '/../pymsasid',
+                _PycdbPath + '/../pyelftools'])
+from elftools.elf.elffile import ELFFile
+from elftools.construct import Struct
+from address_space import AddressSpace, MmapAddressSpace
+import multiprocessing
+from name_index import build_cu_indexes
+import random
+import StringIO
+import shared
+from symbols import Symbols
+from symbolize import iter_symbolize
+
+def _report(name, count, seconds):
+    print('{0:40} {1:10d} calls {2:8.3f}s {3:10.0f} calls/s'.format(
+          name, count, seconds, count / seconds))
+
+def bench_read_int(args, sym_file, core_file):
+    """ construct based read_int64() vs precompiled struct read_int64()
+    """
+    if core_file == None:
+        print('No core file')
+        return
+    aspace = MmapAddressSpace(core_file)
+    addresses = [seg['p_vaddr'] + offset
+                 for seg in aspace.load_segments if seg['p_filesz'] >= 4096
+                 for offset in range(0, 4096, 8)]
+    if len(addresses) == 0:
+        print('No load segment in the core')
+        return
+    stream_aspace = AddressSpace(core_file)
+
+    def construct_read_int64(address):
+        int64 = Struct("int", core_file.structs.Elf_word64("value"))
+        data = str(bytearray(stream_aspace.read(address, int64.sizeof())))
+        return int64.parse(data).value
+
+    def run_construct():
+        for address in addresses:
+            construct_read_int64(address)
+
+    def run_struct():
+        for address in addresses:
+            aspace.read_int64(address)
+
+    def run_bulk():
+        for address in addresses[::512]:
+            aspace.read_ints(address, 512, 8)
+
+    count = len(addresses) * args.repeat
+    _report('construct read_int64', count,
+            timeit.timeit(run_construct, number=args.repeat))
+    _report('struct read_int64', count,
+            timeit.timeit(run_struct, number=args.repeat))
+    _report('struct read_ints(512)', count,
+            timeit.timeit(run_bulk, number=args.repeat))
+
+def bench_index(args, sym_file, core_file):
+    """ DWARF indexing with 1, 2, 4.. processes
+    """
+    cu_count = len(list(sym_file.get_dwarf_info().iter_CUs()))
+    jobs = 1
+    serial = None
+    while jobs <= multiprocessing.cpu_count():
+        seconds = timeit.timeit(lambda: build_cu_indexes(sym_file, jobs),
+                                number=1)
+        if serial == None:
+            serial = seconds
+        print('{0:3d} jobs {1:6d} CUs {2:8.3f}s speedup {3:5.2f}x'.format(
+              jobs, cu_count, seconds, serial / seconds))
+        jobs *= 2
+
+def bench_symbolize(args, sym_file, core_file):
+    """ Symbolize random addresses inside the functions of the symbol file
+    """
+    shared.symbol_file = sym_file
+    shared.symbols = Symbols(sym_file)
+    index = shared.symbols.get_index()
+    functions = [(start, size) for start, size in zip(index.starts,
+                                                      index.sizes) if size]
+    if len(functions) == 0:
+        print('No sized symbols in the symbol file')
+        return
+    lines = list()
+    for i in range(args.count):
+        start, size = random.choice(functions)
+        lines.append('{0:x}\n'.format(start + random.randrange(size)))
+
+    def run():
+        for result in iter_symbolize(StringIO.StringIO(''.join(lines))):
+            pass
+
+    #first run builds the indexes
+    _report('symbolize(cold)', args.count, timeit.timeit(run, number=1))
+    _report('symbolize(warm)', args.count, timeit.timeit(run, number=1))
+
+BENCHMARKS = dict(read_int=bench_read_int, index=bench_index,
+                  symbolize=bench_symbolize)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--core-file', default='core',
+                        help='Core file')
+    parser.add_argument('-s', '--symbol-file', default='a.out',
+                        help='Symbol file')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='Number of times to repeat each benchmark')
+    parser.add_argument('-n', '--count', type=int, default=1000000,
+                        help='Number of addresses to symbolize')
+    parser.add_argument('benchmark', nargs='*', choices=sorted(BENCHMARKS),
+                        default=sorted(BENCHMARKS))
+    args = parser.parse_args()
+
+    sym_file = ELFFile(open(args.symbol_file, 'rb'))
+    core_file = None
+    if path.exists(args.core_file):
+        core_file = ELFFile(open(args.core_file, 'rb'))
+    for name in args.benchmark:
+        print('--- {0}'.format(name))
+        BENCHMARKS[name](args, sym_file, core_file)
+
+main()
@@ -0,0 +1,221 @@
+"""
+unwind_table.py:
+    Sorted index of the CFI FDEs and compiled unwind rows.
+    FDEs come from .debug_frame or .eh_frame(see eh_frame.py).
+    Each FDE is decoded only once; every row of its decoded table is
+    compiled into a small tuple program which is applied to a register
+    table to unwind one frame.
+
+Copyright (c) 2012-2013 VMware, Inc. All Rights Reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+Redistributions in binary form must reproduce the above copyright notice, this
+list of conditions and the following disclaimer in the documentation and/or
+other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+import logging
+from array import array
+from elftools.dwarf.callframe import RegisterRule, FDE
+from eh_frame import EHFrameIndex
+from dwarf_expression_decoder import compile_expression, evaluate_expression
+import shared
+
+#Register step kinds of a compiled row
+STEP_MEMORY = 0         #value = [cfa + arg]
+STEP_CFA_OFFSET = 1     #value = cfa + arg
+STEP_REGISTER = 2       #value = register arg
+STEP_UNDEFINED = 3      #value = 0
+STEP_EXPRESSION = 4     #value = [result of expression arg]
+STEP_VAL_EXPRESSION = 5 #value = result of expression arg
+
+class CompiledFDE():
+    """Decoded and compiled rule table of one FDE
+       row_starts - sorted start address of each row
+       programs   - (cfa register, cfa offset, register steps) of each row
+                    or None if the row can not be compiled. If the CFA is
+                    an expression cfa register is None and cfa offset is
+                    the compiled expression.
+    """
+    def __init__(self, fde):
+        self.structs = fde.structs
+        self.row_starts = array('L')
+        self.programs = list()
+        decoded = fde.get_decoded()
+        rows = getattr(decoded, 'table', decoded)
+        for row in rows:
+            self.row_starts.append(row['pc'])
+            self.programs.append(self._compile_row(row))
+
+    def _compile_row(self, row):
+        """Compile one rule row into a tuple program
+        """
+        cfa_rule = row.get('cfa')
+        if cfa_rule == None:
+            return None
+        if cfa_rule.expr:
+            cfa = (None, compile_expression(cfa_rule.expr, self.structs))
+        elif cfa_rule.reg != None:
+            cfa = (cfa_rule.reg, cfa_rule.offset or 0)
+        else:
+            return None
+
+        steps = list()
+        for reg, rule in row.iteritems():
+            if reg == 'pc' or reg == 'cfa':
+                continue
+            if rule.type == RegisterRule.OFFSET:
+                steps.append((reg, STEP_MEMORY, rule.arg))
+            elif rule.type == RegisterRule.VAL_OFFSET:
+                steps.append((reg, STEP_CFA_OFFSET, rule.arg))
+            elif rule.type == RegisterRule.REGISTER:
+                steps.append((reg, STEP_REGISTER, rule.arg))
+            elif rule.type == RegisterRule.UNDEFINED:
+                steps.append((reg, STEP_UNDEFINED, 0))
+            elif rule.type == RegisterRule.EXPRESSION:
+                steps.append((reg, STEP_EXPRESSION,
+                              compile_expression(rule.arg, self.structs)))
+            elif rule.type == RegisterRule.VAL_EXPRESSION:
+                steps.append((reg, STEP_VAL_EXPRESSION,
+                              compile_expression(rule.arg, self.structs)))
+            elif rule.type == RegisterRule.SAME_VALUE:
+                continue
+            else:
+                #Unwinding with the callee's value would give wrong registers
+                logging.debug('Register rule {0} is not supported'\
+                              .format(rule.type))
+                return None
+        return cfa + (tuple(steps),)
+
+    def find_program(self, ip):
+        """Returns compiled program of the row covering the ip
+        """
+        i = bisect.bisect_right(self.row_starts, ip) - 1
+        if i < 0:
+            return None
+        return self.programs[i]
+
+def compute_cfa(program, reg_tab, address_space):
+    """Returns CFA of the frame whose registers are in reg_tab
+    """
+    cfa_reg, cfa_offset, _ = program
+    if cfa_reg == None:
+        return evaluate_expression(cfa_offset, reg_tab, address_space, None)
+    return reg_tab[cfa_reg] + cfa_offset
+
+def apply_program(program, reg_tab, address_space):
+    """Unwind one frame - update reg_tab in place with caller's registers
+       All the rules are evaluated against the callee's registers.
+       Expressions are evaluated with the CFA pushed on the stack.
+    """
+    steps = program[2]
+    cfa = compute_cfa(program, reg_tab, address_space)
+    values = list()
+    for reg, kind, arg in steps:
+        if kind == STEP_MEMORY:
+            values.append((reg, address_space.read_word(cfa + arg)))
+        elif kind == STEP_CFA_OFFSET:
+            values.append((reg, cfa + arg))
+        elif kind == STEP_REGISTER:
+            values.append((reg, reg_tab[arg]))
+        elif kind == STEP_EXPRESSION:
+            address = evaluate_expression(arg, reg_tab, address_space, None,
+                                          stack_base=cfa)
+            values.append((reg, address_space.read_word(address)))
+        elif kind == STEP_VAL_EXPRESSION:
+            values.append((reg, evaluate_expression(arg, reg_tab,
+                                                    address_space, None,
+                                                    stack_base=cfa)))
+        else:
+            values.append((reg, 0))
+    reg_tab['cfa'] = cfa
+    for reg, value in values:
+        reg_tab[reg] = value
+    return reg_tab
+
+class DebugFrameIndex():
+    """.debug_frame FDEs sorted by initial location
+    """
+    def __init__(self, dwarfinfo):
+        fdes = list()
+        for entry in dwarfinfo.CFI_entries():
+            if isinstance(entry, FDE):
+                fdes.append((entry['initial_location'],
+                             entry['address_range'], entry))
+        fdes.sort(key=lambda fde: fde[0])
+        self.starts = array('L', [fde[0] for fde in fdes])
+        self.ends = array('L', [fde[0] + fde[1] for fde in fdes])
+        self.fdes = [fde[2] for fde in fdes]
+
+    def find_fde(self, ip):
+        """Returns the FDE covering the ip or None
+        """
+        i = bisect.bisect_right(self.starts, ip) - 1
+        if i >= 0 and ip < self.ends[i]:
+            return self.fdes[i]
+        return None
+
+class UnwindTable():
+    """Compiled unwind rules of the symbol file
+       FDEs are searched in .debug_frame first and then in .eh_frame, so
+       binaries stripped of .debug_frame are still unwound by CFI.
+       Compiled FDEs are cached, so threads sharing the same functions
+       decode each FDE only once.
+    """
+    def __init__(self, elf_file):
+        self.sources = list()
+        if elf_file.has_dwarf_info():
+            dwarfinfo = elf_file.get_dwarf_info()
+            if dwarfinfo.has_CFI():
+                self.sources.append(('.debug_frame',
+                                     DebugFrameIndex(dwarfinfo)))
+        eh_frame_index = EHFrameIndex(elf_file)
+        if eh_frame_index.eh_frame != None:
+            self.sources.append(('.eh_frame', eh_frame_index))
+        if len(self.sources) == 0:
+            logging.warning('No .debug_frame or .eh_frame section')
+        self._compiled = dict()
+
+    def get_compiled_fde(self, source, fde):
+        key = (source, fde.offset)
+        compiled = self._compiled.get(key)
+        if compiled == None:
+            compiled = CompiledFDE(fde)
+            self._compiled[key] = compiled
+        return compiled
+
+    def find_program(self, ip):
+        """Returns compiled unwind program for the ip or None
+        """
+        for source, fde_index in self.sources:
+            fde = fde_index.find_fde(ip)
+            if fde != None:
+                return self.get_compiled_fde(source, fde).find_program(ip)
+        return None
+
+    def has_unwind_info(self):
+        return len(self.sources) > 0
+
+def get_unwind_table():
+    """Returns unwind table of the symbol file being debugged
+    """
+    if shared.unwind_table == None:
+        shared.unwind_table = UnwindTable(shared.symbol_file)
+    return shared.unwind_table